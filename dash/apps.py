@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DashConfig(AppConfig):
     name = 'dash'
+
+    def ready(self):
+        # Keeps dashboards' timelines, and the friend graph, up to date
+        from . import timelineUtils, graphUtils
@@ -2,7 +2,9 @@ from django.http import HttpResponse
 from django.shortcuts import render
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+import logging
 
+logger = logging.getLogger('stream.dash')
 
 def check_authenticate(request):
 
@@ -43,7 +45,7 @@ def check_authenticate(request):
     # returns None.
     try:
         user = authenticate(username=logindata[0], password=logindata[1])
-        print user
+        logger.debug('Authenticated %s', user)
     except:
         return None
 
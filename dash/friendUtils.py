@@ -0,0 +1,245 @@
+# Author: Braedy Kuzma
+import functools
+import hashlib
+import logging
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from rest.authUtils import getRemoteCredentials
+from rest.digestUtils import BloomFilter
+from .idUtils import canonicalId, idsByCanonical
+from rest.logUtils import truncate
+from rest.remoteUtils import remoteGet, postJSON, RemoteFetch, \
+                             requestKey
+from .models import Author, Follow
+
+logger = logging.getLogger('stream.dash')
+
+def fetchRemoteFriends(authorID, host):
+    """
+    Get the ids of the authors a remote author follows, None on failure.
+    """
+    try:
+        r = remoteGet(authorID + 'friends/', host, data={'query':'friends'})
+    except requests.RequestException as e:
+        #Down (or skipped by its circuit breaker)
+        logger.info('Could not get friends of %s: %s', authorID, e,
+                    extra={'node': host.host})
+        return None
+
+    if r.status_code != 200:
+        return None
+
+    try:
+        return r.json()['authors']
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Could not parse friends of %s', authorID,
+                       extra={'node': host.host, 'body': truncate(r.text)})
+        return None
+
+def getRemoteFriends(authorID, host, deadline=None):
+    """
+    Get the ids of the authors a remote author follows, [] if we can't find
+    out. With a deadline, if the remote server doesn't answer in time the last
+    good list is used.
+    """
+    if deadline is None:
+        return fetchRemoteFriends(authorID, host) or []
+
+    fetch = RemoteFetch(requestKey('GET', authorID + 'friends/', host),
+                        functools.partial(fetchRemoteFriends, authorID, host),
+                        deadline)
+    following, stale = fetch.result(deadline)
+    return following or []
+
+def digestKey(authorID):
+    return 'digest:' + hashlib.sha1(authorID.encode('utf-8')).hexdigest()
+
+def noDigestKey(name):
+    """
+    Key remembering that name (a server's host or an author's id) has no
+    digest.
+    """
+    return 'nodigest:' + hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+# Statuses that mean a server doesn't serve digests at all. Anything else
+# might only be about the author asked for (404) or not last (401, 429, 5xx).
+NO_DIGEST_STATUSES = (405, 501)
+
+def fetchFriendDigest(authorID, host):
+    """
+    Get the digest of who a remote author follows (see
+    rest.digestUtils.BloomFilter) as its data, None on failure. The last one
+    we got is kept and only downloaded again if its version changed. Servers
+    that don't serve digests, and authors whose digest was missing or
+    malformed, aren't asked again for settings.FRIEND_DIGEST_RETRY seconds.
+    """
+    cache = caches['remote']
+    if cache.get_many([noDigestKey(host.host), noDigestKey(authorID)]):
+        return None
+
+    previous = cache.get(digestKey(authorID))
+    headers = {}
+    if previous is not None:
+        headers['If-None-Match'] = '"{}"'.format(previous['version'])
+
+    try:
+        r = remoteGet(authorID + 'friends/digest/', host, headers=headers)
+    except requests.RequestException as e:
+        #Down (or skipped by its circuit breaker)
+        logger.info('Could not get friend digest of %s: %s', authorID, e,
+                    extra={'node': host.host})
+        return None
+
+    if r.status_code == 304 and previous is not None:
+        return previous
+
+    retry = getattr(settings, 'FRIEND_DIGEST_RETRY', 60 * 60)
+    if r.status_code != 200:
+        if r.status_code in NO_DIGEST_STATUSES:
+            cache.set(noDigestKey(host.host), True, retry)
+        elif r.status_code == 404:
+            cache.set(noDigestKey(authorID), True, retry)
+        return None
+
+    try:
+        data = r.json()
+        BloomFilter.fromData(data)
+        if not isinstance(data.get('version'), str):
+            raise ValueError('Digest has no version')
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Could not parse friend digest of %s', authorID,
+                       extra={'node': host.host, 'body': truncate(r.text)})
+        cache.set(noDigestKey(authorID), True, retry)
+        return None
+
+    cache.set(digestKey(authorID), data,
+              getattr(settings, 'REMOTE_STALE_TIMEOUT', 86400))
+    return data
+
+def getFriendDigest(authorID, host, deadline=None):
+    """
+    A BloomFilter of who a remote author follows, None if we can't get one.
+    With a deadline, if the remote server doesn't answer in time the last
+    good digest is used.
+    """
+    if deadline is None:
+        data = fetchFriendDigest(authorID, host)
+    else:
+        key = requestKey('GET', authorID + 'friends/digest/', host)
+        fetch = RemoteFetch(key, functools.partial(fetchFriendDigest,
+                                                   authorID, host),
+                            deadline)
+        data, stale = fetch.result(deadline)
+
+    return BloomFilter.fromData(data) if data else None
+
+def fetchRemoteFollows(authorID, ids, host):
+    """
+    Ask a remote server which of ids a remote author follows with one POST to
+    their friends endpoint. Servers that don't support that are asked for
+    everyone the author follows instead. None on failure.
+    """
+    data = {'query': 'friends', 'author': authorID, 'authors': ids}
+    try:
+        r = postJSON(authorID + 'friends/', data, host)
+    except requests.RequestException as e:
+        #Down (or skipped by its circuit breaker)
+        logger.info('Could not get friends of %s: %s', authorID, e,
+                    extra={'node': host.host})
+        return None
+
+    if r.status_code != 200:
+        following = fetchRemoteFriends(authorID, host)
+        if following is None:
+            return None
+        following = {canonicalId(i) for i in following}
+        return [i for i in ids if canonicalId(i) in following]
+
+    try:
+        return r.json()['friends']
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Could not parse friends of %s', authorID,
+                       extra={'node': host.host, 'body': truncate(r.text)})
+        return None
+
+def followsAny(authorID, ids, deadline=None):
+    """
+    Which of ids an author follows, a set. Local authors take one query and
+    remote ones one request no matter how many ids there are. Ids the remote
+    author's friend digest rules out aren't asked about, if it rules out all
+    of them there's no request besides (usually a 304 for) the digest. With a
+    deadline, if the remote server doesn't answer in time the last good
+    answer is used.
+    """
+    # Followed ids are matched by canonical id, answers are the ids given
+    ids = sorted(set(ids))
+    keys = idsByCanonical(ids)
+    if Author.objects.filter(id=authorID).exists():
+        found = Follow.objects.filter(author=authorID, friendKey__in=keys) \
+                              .values_list('friendKey', flat=True)
+        return {i for key in found for i in keys[key]}
+
+    host = getRemoteCredentials(authorID)
+    if not host:
+        #Might have friends with a server we don't have access to.
+        return set()
+
+    # Digests have false positives but no false negatives, only possible
+    # matches need confirming
+    digest = getFriendDigest(authorID, host, deadline)
+    if digest is not None:
+        ids = [i for i in ids if canonicalId(i) in digest]
+        if not ids:
+            return set()
+
+    if deadline is None:
+        follows = fetchRemoteFollows(authorID, ids, host)
+    else:
+        key = requestKey('POST', '{}friends/?authors={}'
+                                 .format(authorID, ','.join(ids)), host)
+        fetch = RemoteFetch(key, functools.partial(fetchRemoteFollows,
+                                                   authorID, ids, host),
+                            deadline)
+        follows, stale = fetch.result(deadline)
+
+    return {i for follow in follows or []
+            for i in keys.get(canonicalId(follow), [])}
+
+def getFollowing(authorID, deadline=None):
+    """
+    The ids of the authors an author follows.
+    """
+    if Author.objects.filter(id=authorID).exists():
+        return list(Follow.objects.filter(author=authorID)
+                                  .values_list('friend', flat=True))
+
+    host = getRemoteCredentials(authorID)
+    if not host:
+        return []
+    return getRemoteFriends(authorID, host, deadline)
+
+def isFriendOfFriend(viewerID, authorID, viewerFollowing, deadline=None):
+    """
+    Whether viewerID is a friend, or a friend of a friend, of authorID.
+    viewerFollowing is who the viewer follows.
+
+    Only authors both of them follow can be a friend in common, each of those
+    is asked once whether they follow both. That's a few requests instead of
+    getting every friend's friends.
+    """
+    viewerFollowing = set(viewerFollowing)
+    authorFollowing = set(getFollowing(authorID, deadline))
+
+    # Friends already
+    if viewerID in authorFollowing and authorID in viewerFollowing:
+        return True
+
+    for friend in authorFollowing & viewerFollowing:
+        if followsAny(friend, [authorID, viewerID], deadline) == \
+           {authorID, viewerID}:
+            return True
+
+    return False
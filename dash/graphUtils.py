@@ -0,0 +1,246 @@
+# Author: Braedy Kuzma
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .idUtils import canonicalId
+from .models import Follow
+
+class FriendGraph(object):
+    """
+    Who follows whom (from Follow) with every author numbered densely. Each
+    author has a set of the numbers of who they follow and who follows them,
+    so the graph grows with the number of follows, and set operations over
+    them, like finding all the friends of someone's friends, take no queries
+    or loops over ids. Authors are numbered by canonical id and known by their
+    local id if they have one.
+
+    Readers don't lock. Authors are only ever appended, so a number is only
+    handed out once its sets exist, and once built a set is never changed,
+    only replaced as a whole. Changes have to be made holding the shared lock
+    (see applyChange).
+    """
+    def __init__(self, follows=()):
+        """
+        follows are (author, friend) or, to save working them out,
+        (author, friend, canonical id of friend) tuples.
+        """
+        self.built = time.monotonic()
+        self.numbers = {}
+        self.ids = []
+
+        # Sets of who each author follows and who follows them
+        self.following = []
+        self.followers = []
+
+        # Built up in place, nothing can see them yet. Authors follow many, so
+        # their numbers are remembered rather than looked up by canonical id
+        # again.
+        authors = {}
+        following = defaultdict(set)
+        followers = defaultdict(set)
+        for follow in follows:
+            author, friend = follow[:2]
+            a = authors.get(author)
+            if a is None:
+                a = authors[author] = self.number(author, local=True)
+            key = follow[2] if len(follow) > 2 else canonicalId(friend)
+            b = self.numbers.get(key)
+            if b is None:
+                b = self.number(friend, key=key)
+            following[a].add(b)
+            followers[b].add(a)
+        for a, numbers in following.items():
+            self.following[a] = numbers
+        for b, numbers in followers.items():
+            self.followers[b] = numbers
+
+    def lookup(self, authorId):
+        """
+        The number of an author, None if they don't have one.
+        """
+        return self.numbers.get(canonicalId(authorId))
+
+    def number(self, authorId, local=False, key=None):
+        """
+        The number of an author, giving them one if they don't have one yet.
+        local is whether authorId is a local author's (exact) id and key its
+        canonical id, if known.
+        """
+        if key is None:
+            key = canonicalId(authorId)
+        n = self.numbers.get(key)
+        if n is None:
+            n = len(self.ids)
+            self.following.append(frozenset())
+            self.followers.append(frozenset())
+            self.ids.append(authorId)
+            self.numbers[key] = n
+        elif local:
+            self.ids[n] = authorId
+        return n
+
+    def add(self, author, friend):
+        """
+        Record that author (a local author's id) follows friend.
+        """
+        a = self.number(author, local=True)
+        b = self.number(friend)
+        self.following[a] = frozenset(self.following[a] | {b})
+        self.followers[b] = frozenset(self.followers[b] | {a})
+
+    def remove(self, author, friend):
+        a = self.lookup(author)
+        b = self.lookup(friend)
+        if a is None or b is None:
+            return
+        self.following[a] = self.following[a] - {b}
+        self.followers[b] = self.followers[b] - {a}
+
+    def numbersOf(self, authorIds):
+        """
+        The set of the numbers of the authors in authorIds, unknown ones are
+        left out.
+        """
+        numbers = (self.lookup(authorId) for authorId in authorIds)
+        return frozenset(n for n in numbers if n is not None)
+
+    def members(self, numbers):
+        """
+        The ids of the authors in a set of numbers.
+        """
+        return {self.ids[n] for n in numbers}
+
+    def follows(self, author, friend):
+        """
+        Whether author follows friend.
+        """
+        a = self.lookup(author)
+        b = self.lookup(friend)
+        return a is not None and b is not None and b in self.following[a]
+
+    def followersOf(self, authorId):
+        """
+        The numbers of the authors who follow an author.
+        """
+        n = self.lookup(authorId)
+        return frozenset() if n is None else self.followers[n]
+
+    def friends(self, authorId):
+        """
+        The numbers of an author's friends, who they follow and are followed
+        by.
+        """
+        n = self.lookup(authorId)
+        if n is None:
+            return frozenset()
+        return self.following[n] & self.followers[n]
+
+    def friendsOfFriends(self, friends):
+        """
+        The numbers of the authors who are friends with one of friends (a set
+        of numbers).
+        """
+        reach = set()
+        for n in friends:
+            reach.update(self.following[n] & self.followers[n])
+        return reach
+
+# The graph every thread shares, changes to it and swapping in a rebuilt one
+# are made holding _lock. Changes made while a rebuild is reading Follow are
+# also kept in _pending and made again to the new graph.
+_graph = None
+_pending = None
+_lock = threading.Lock()
+_rebuilding = threading.Lock()
+
+def isStale(graph):
+    return graph is None or time.monotonic() - graph.built > \
+           getattr(settings, 'FRIEND_GRAPH_TTL', 60)
+
+def friendGraph():
+    """
+    The shared FriendGraph. It's kept up to date with this process' Follow
+    changes, and rebuilt after settings.FRIEND_GRAPH_TTL seconds to catch up
+    with other processes'. Stale graphs are used while another thread
+    rebuilds them, only the first caller waits.
+    """
+    graph = _graph
+    if isStale(graph):
+        graph = rebuildFriendGraph(wait=graph is None)
+    return graph
+
+def rebuildFriendGraph(wait=True):
+    """
+    Build the shared graph from Follow again. If another thread is already
+    rebuilding it the graph it builds is used, without wait the current one
+    is used instead of waiting.
+    """
+    global _graph, _pending
+    if not _rebuilding.acquire(blocking=wait):
+        return _graph
+
+    try:
+        # Another thread rebuilt it while we waited
+        if not isStale(_graph):
+            return _graph
+
+        with _lock:
+            _pending = []
+        graph = FriendGraph(Follow.objects.values_list('author', 'friend',
+                                                       'friendKey')
+                                          .iterator())
+        with _lock:
+            for change in _pending:
+                change(graph)
+            _graph = graph
+        return graph
+    finally:
+        with _lock:
+            _pending = None
+        _rebuilding.release()
+
+def resetFriendGraph():
+    """
+    Forget the shared graph, it's rebuilt when next used.
+    """
+    global _graph
+    with _lock:
+        _graph = None
+
+def applyChange(change):
+    """
+    Make a change (a function taking a FriendGraph) to the shared graph.
+    """
+    with _lock:
+        if _graph is not None:
+            change(_graph)
+        if _pending is not None:
+            _pending.append(change)
+
+# Follow changes are only made to the graph once they're committed, changes
+# that are rolled back never happened
+
+@receiver(post_save, sender=Follow)
+def followAdded(sender, instance, **kwargs):
+    author, friend = instance.author_id, instance.friend
+    transaction.on_commit(
+        lambda: applyChange(lambda graph: graph.add(author, friend))
+    )
+
+@receiver(post_delete, sender=Follow)
+def followRemoved(sender, instance, **kwargs):
+    author, friend = instance.author_id, instance.friend
+
+    def removed():
+        # There can be more than one Follow saying the same thing
+        if Follow.objects.filter(author=author,
+                                 friendKey=canonicalId(friend)).exists():
+            return
+        applyChange(lambda graph: graph.remove(author, friend))
+    transaction.on_commit(removed)
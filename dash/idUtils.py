@@ -0,0 +1,37 @@
+# Author: Braedy Kuzma
+from urllib.parse import urlsplit
+
+from rest.models import normalizeNetloc
+
+def canonicalId(authorId):
+    """
+    The canonical form of an author id (a url), what relationship lookups
+    match on. Servers send the same author with http or https, with or
+    without their scheme's default port or a trailing slash and with the host
+    in any case, all of those have the same canonical id: the host as
+    normalizeNetloc has it (the same as credentials are looked up by) and the
+    path ending in a slash. '' for an empty id.
+    """
+    authorId = (authorId or '').strip()
+    if not authorId:
+        return ''
+
+    # Ids without a scheme are still host first
+    if '//' not in authorId:
+        authorId = '//' + authorId
+
+    path = urlsplit(authorId).path
+    if not path.endswith('/'):
+        path += '/'
+
+    return normalizeNetloc(authorId) + path
+
+def idsByCanonical(ids):
+    """
+    Group ids by their canonical ids, so lookups on canonical ids can be
+    answered with the ids that were asked about.
+    """
+    groups = {}
+    for i in ids:
+        groups.setdefault(canonicalId(i), []).append(i)
+    return groups
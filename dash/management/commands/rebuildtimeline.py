@@ -0,0 +1,19 @@
+# Author: Braedy Kuzma
+from django.core.management.base import BaseCommand
+
+from dash.models import Post
+from dash.timelineUtils import fanOut, postAudience
+
+class Command(BaseCommand):
+    help = 'Rebuilds every local author\'s dashboard timeline from scratch. ' \
+           'Run once after the timeline is added, it is kept up to date ' \
+           'after that.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for post in Post.objects.all().iterator():
+            fanOut(post, postAudience(post))
+            count += 1
+
+        self.stdout.write('Rebuilt timeline entries for {} posts'
+                          .format(count))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dash', '0012_auto_20170327_1808'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('published', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='dash.Post')),
+                ('viewer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='dash.Author')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='timelineentry',
+            unique_together=set([('viewer', 'post')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='timelineentry',
+            index_together=set([('viewer', 'published')]),
+        ),
+    ]
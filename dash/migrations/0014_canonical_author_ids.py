@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 15:06
+from __future__ import unicode_literals
+
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+
+# Copies of rest.models.normalizeNetloc and dash.idUtils.canonicalId as they
+# were when this was written, the live ones may change
+
+
+def normalizeNetloc(url):
+    split = urlsplit(url)
+    netloc = split.netloc.rpartition('@')[2].lower()
+
+    defaultPort = {'http': ':80', 'https': ':443'}.get(split.scheme.lower())
+    if defaultPort and netloc.endswith(defaultPort):
+        netloc = netloc[:-len(defaultPort)]
+
+    return netloc
+
+
+def canonicalId(authorId):
+    authorId = (authorId or '').strip()
+    if not authorId:
+        return ''
+
+    if '//' not in authorId:
+        authorId = '//' + authorId
+
+    path = urlsplit(authorId).path
+    if not path.endswith('/'):
+        path += '/'
+
+    return normalizeNetloc(authorId) + path
+
+
+# (model, raw id field, canonical id field)
+KEY_FIELDS = (
+    ('CanSee', 'visibleTo', 'visibleToKey'),
+    ('Comment', 'author', 'authorKey'),
+    ('Follow', 'friend', 'friendKey'),
+    ('FriendRequest', 'requester', 'requesterKey'),
+)
+
+def fillKeys(apps, schema_editor):
+    """
+    Fill in the canonical ids of existing rows, one update per distinct id.
+    """
+    for modelName, field, keyField in KEY_FIELDS:
+        Model = apps.get_model('dash', modelName)
+        ids = Model.objects.values_list(field, flat=True).distinct()
+        for authorId in list(ids):
+            Model.objects.filter(**{field: authorId}) \
+                         .update(**{keyField: canonicalId(authorId)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dash', '0013_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cansee',
+            name='visibleToKey',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='authorKey',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='friendKey',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='friendrequest',
+            name='requesterKey',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fillKeys, migrations.RunPython.noop),
+    ]
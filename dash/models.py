@@ -6,6 +6,8 @@ import django.utils.timezone as timezone
 from django.core.exceptions import ValidationError
 import uuid
 
+from .idUtils import canonicalId
+
 
 class Author(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL,
@@ -27,6 +29,14 @@ class Follow(models.Model):
     friend = models.URLField()
     friendDisplayName = models.CharField(max_length=256, default="")
 
+    # canonicalId(friend), look friends up by this
+    friendKey = models.CharField(max_length=200, db_index=True, default='',
+                                 editable=False)
+
+    def save(self, *args, **kwargs):
+        self.friendKey = canonicalId(self.friend)
+        super(Follow, self).save(*args, **kwargs)
+
     def __str__(self):
         return '{} follows {}'.format(self.author, self.friendDisplayName)
 
@@ -39,6 +49,14 @@ class FriendRequest(models.Model):
 
     created = models.DateTimeField(auto_now=True)
 
+    # canonicalId(requester), look requesters up by this
+    requesterKey = models.CharField(max_length=200, db_index=True, default='',
+                                    editable=False)
+
+    def save(self, *args, **kwargs):
+        self.requesterKey = canonicalId(self.requester)
+        super(FriendRequest, self).save(*args, **kwargs)
+
     def __str__(self):
         return '{} sent friend request for {}'.format(self.requesterDisplayName, self.requestee)
 
@@ -89,9 +107,37 @@ class CanSee(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     visibleTo = models.URLField() # This is an author id, could be remote
 
+    # canonicalId(visibleTo), look authors up by this
+    visibleToKey = models.CharField(max_length=200, db_index=True,
+                                    default='', editable=False)
+
+    def save(self, *args, **kwargs):
+        self.visibleToKey = canonicalId(self.visibleTo)
+        super(CanSee, self).save(*args, **kwargs)
+
     def __str__(self):
         return '{} sees {}'.format(self.visibleTo, self.post)
 
+class TimelineEntry(models.Model):
+    """
+    A post on a local author's dashboard. Written when the post is saved (see
+    dash.timelineUtils) so the dashboard is one indexed range per viewer
+    instead of working out visibility on every load.
+    """
+    class Meta:
+        unique_together = ('viewer', 'post')
+        index_together = ('viewer', 'published')
+    viewer = models.ForeignKey(Author, on_delete=models.CASCADE,
+                               related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline')
+
+    # Copy of the post's so the range is sorted by the index
+    published = models.DateTimeField()
+
+    def __str__(self):
+        return '{} sees {}'.format(self.viewer, self.post)
+
 class RemoteCommentAuthor(models.Model):
     """
     We need to cache remote comment authors. I think this is a terrible idea and
@@ -123,6 +169,14 @@ class Comment(models.Model):
     # So says the Hindle
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
 
+    # canonicalId(author), look authors up by this
+    authorKey = models.CharField(max_length=200, db_index=True, default='',
+                                 editable=False)
+
+    def save(self, *args, **kwargs):
+        self.authorKey = canonicalId(self.author)
+        super(Comment, self).save(*args, **kwargs)
+
     def __str__(self):
         try:
             localAuthor = Author.objects.get(id=self.author)
@@ -0,0 +1,103 @@
+# Author: Braedy Kuzma
+import hashlib
+
+import dateutil.parser
+from django.conf import settings
+from django.core.cache import caches
+
+from rest.remotePost import RemotePost
+from rest.serializers import PostSerializer
+from .models import Post
+
+# Most keys touched in one cache call
+KEY_CHUNK_SIZE = 500
+
+def streamCache():
+    # Looked up each time so tests' settings overrides apply
+    return caches['stream']
+
+def hashedKey(prefix, url):
+    # Urls aren't safe cache keys everywhere (e.g. memcached)
+    return '{}:{}'.format(prefix,
+                          hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+def streamKey(viewerId):
+    return hashedKey('stream', viewerId)
+
+def remotePostKey(postId):
+    return hashedKey('post', postId)
+
+def getStream(viewerId, limit):
+    """
+    A viewer's cached stream if it has at least the newest limit posts, None
+    otherwise. It's a dict of the ordered items (see CachedStream) and the
+    remote hosts that were stale when it was built.
+    """
+    stream = streamCache().get(streamKey(viewerId))
+    if stream is None or stream['limit'] < limit:
+        return None
+    return stream
+
+def setStream(viewerId, limit, posts, staleHosts):
+    """
+    Cache a viewer's stream, posts being the Posts and RemotePosts in it in
+    order. Remote posts are cached on their own since they can't be loaded
+    again from the database.
+    """
+    timeout = getattr(settings, 'STREAM_CACHE_TTL', 30)
+    items = []
+    fragments = {}
+    for post in posts:
+        remote = isinstance(post, RemotePost)
+        items.append((post.id, remote))
+        if remote:
+            fragments[remotePostKey(post.id)] = post
+
+    cache = streamCache()
+    cache.set_many(fragments, timeout)
+    stream = {'limit': limit, 'items': items, 'staleHosts': staleHosts}
+    cache.set(streamKey(viewerId), stream, timeout)
+    return stream
+
+def invalidateStreams(viewerIds):
+    """
+    Forget the cached streams of viewers, something they can see changed.
+    """
+    keys = [streamKey(viewerId) for viewerId in set(viewerIds)]
+    for i in range(0, len(keys), KEY_CHUNK_SIZE):
+        streamCache().delete_many(keys[i:i + KEY_CHUNK_SIZE])
+
+def hydrate(items):
+    """
+    Load the posts for a list of stream items. Local posts are serialized
+    fresh (so comments and edits show up), remote ones come from the cache.
+    Posts that have since been deleted, or expired, are left out.
+    """
+    localIds = [postId for postId, remote in items if not remote]
+    remoteKeys = [remotePostKey(postId) for postId, remote in items if remote]
+
+    posts = {}
+    local = Post.objects.filter(id__in=localIds)
+    for post in PostSerializer(local, many=True).data:
+        post['published'] = dateutil.parser.parse(post['published'])
+        posts[post['id']] = post
+    for post in streamCache().get_many(remoteKeys).values():
+        posts[post.id] = post
+
+    return [posts[postId] for postId, remote in items if postId in posts]
+
+class CachedStream(object):
+    """
+    A viewer's stream as (post id, is remote) items. Only the slices that are
+    used (i.e. the page being shown) are loaded.
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return hydrate(self.items[index])
+        return hydrate([self.items[index]])[0]
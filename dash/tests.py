@@ -1,13 +1,26 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, \
+                        override_settings
 from django.test.utils import setup_test_environment
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.db import transaction
 from django.db.utils import IntegrityError
-from dash.models import Author, Post, Comment, Category, Follow
+from dash.models import Author, Post, Comment, Category, Follow, CanSee, \
+                        TimelineEntry
+from dash.streamUtils import getStream, setStream, CachedStream
+from dash.timelineUtils import postAudience
+from dash.friendUtils import followsAny, isFriendOfFriend
+from dash.graphUtils import FriendGraph, friendGraph, resetFriendGraph
+from dash.idUtils import canonicalId
+from rest.jobUtils import runNextJob
+from rest.models import Job, RemoteCredentials
+from rest.digestUtils import BloomFilter, digestVersion
 from dash.forms import PostForm, CommentForm
 from django.forms.models import model_to_dict
 import requests
 import uuid
+import json
+from unittest import mock
 
 # Create your tests here.
 
@@ -15,6 +28,9 @@ import uuid
 # https://docs.djangoproject.com/en/1.10/topics/testing/tools/
 class DashViewTests(TestCase):
     def setUp(self):
+        # The friend graph only hears about committed Follow changes and
+        # tests never commit, so build it from this test's Follows
+        resetFriendGraph()
         self.userCount = 0
         self.user = self.createUser()
 
@@ -293,3 +309,392 @@ class DashViewTests(TestCase):
         postList = response.context['latest_post_list']
         self.assertEqual(len(postList), 1)
     
+
+class TimelineTests(TestCase):
+    """
+    Posts are fanned out to their audience's timelines as they're saved.
+    """
+    def setUp(self):
+        resetFriendGraph()
+        self.authorCount = 0
+
+    def createAuthor(self):
+        user = User.objects.create_user('timeline{}'.format(self.authorCount))
+        self.authorCount += 1
+
+        author = Author()
+        author.user = user
+        author.host = 'http://testserver/'
+        author.id = author.host + 'author/' + uuid.uuid4().hex
+        author.url = author.id
+        author.save()
+        return author
+
+    def createPost(self, author, visibility='PUBLIC'):
+        post = Post()
+        post.id = 'http://testserver/posts/{}/'.format(uuid.uuid4().hex)
+        post.author = author
+        post.title = 'Test'
+        post.contentType = 'text/plain'
+        post.content = 'Test'
+        post.visibility = visibility
+        post.save()
+        return post
+
+    def follow(self, author, friend):
+        return Follow.objects.create(author=author, friend=friend.id)
+
+    def viewers(self, post):
+        return set(TimelineEntry.objects.filter(post=post)
+                                        .values_list('viewer', flat=True))
+
+    def test_public_post_fans_out(self):
+        author1 = self.createAuthor()
+        author2 = self.createAuthor()
+        post = self.createPost(author1)
+        self.assertEqual(self.viewers(post), {author1.id, author2.id})
+
+        # New authors get what's already public
+        author3 = self.createAuthor()
+        self.assertIn(author3.id, self.viewers(post))
+
+        # Narrowing visibility takes it off timelines
+        post.visibility = 'PRIVATE'
+        post.save()
+        self.assertEqual(self.viewers(post), {author1.id})
+
+        # Until it's made visible to them, by any spelling of their id
+        CanSee.objects.create(post=post, visibleTo=author2.url)
+        self.assertEqual(self.viewers(post), {author1.id, author2.id})
+        CanSee.objects.create(post=post, visibleTo=author3.id.replace(
+            'http://testserver/', 'https://TESTSERVER:443/') + '/')
+        self.assertEqual(self.viewers(post),
+                         {author1.id, author2.id, author3.id})
+
+    def test_follow_changes_friends_posts(self):
+        author1 = self.createAuthor()
+        author2 = self.createAuthor()
+        post = self.createPost(author1, 'FRIENDS')
+        self.assertEqual(self.viewers(post), {author1.id})
+
+        self.follow(author1, author2)
+        follow = self.follow(author2, author1)
+        self.assertEqual(self.viewers(post), {author1.id, author2.id})
+
+        # Unfriending takes it away again
+        follow.delete()
+        self.assertEqual(self.viewers(post), {author1.id})
+
+    @override_settings(TIMELINE_FANOUT_INLINE_MAX=1)
+    def test_large_fan_out_uses_job(self):
+        author1 = self.createAuthor()
+        others = [self.createAuthor() for i in range(3)]
+        post = self.createPost(author1)
+
+        # Only the author sees it until the job runs
+        self.assertEqual(self.viewers(post), {author1.id})
+        self.assertEqual(Job.objects.count(), 1)
+
+        runNextJob()
+        self.assertEqual(self.viewers(post),
+                         {author1.id} | {other.id for other in others})
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_foaf_audience(self):
+        authors = [self.createAuthor() for i in range(5)]
+        for a, b in ((0, 1), (1, 2)):
+            self.follow(authors[a], authors[b])
+            self.follow(authors[b], authors[a])
+
+        # A remote friend, who's also friends with another local author
+        RemoteCredentials.objects.create(host='http://remote.example.com/',
+                                         username='user', password='pass')
+        remote = 'http://remote.example.com/author/1/'
+        followedBack = {authors[0].id, authors[3].id}
+        for author in (authors[0], authors[3]):
+            Follow.objects.create(author=author, friend=remote)
+
+        def respond(method, url, **kwargs):
+            if url.endswith('digest/'):
+                return mock.Mock(status_code=404, text='')
+            query = json.loads(kwargs['data'].decode('utf-8'))
+            friends = [i for i in query['authors'] if i in followedBack]
+            return mock.Mock(status_code=200,
+                             json=lambda: {'query': 'friends',
+                                           'author': query['author'],
+                                           'friends': friends})
+
+        post = Post(id='http://testserver/posts/foaf/', author=authors[0],
+                    visibility='FOAF')
+        with mock.patch('requests.request', side_effect=respond) as request:
+            audience = postAudience(post)
+        self.assertEqual(audience, {author.id for author in authors[:4]})
+
+        # The remote author is asked about everyone at once
+        self.assertEqual(request.call_count, 2)
+
+    def test_delete_author(self):
+        author1 = self.createAuthor()
+        author2 = self.createAuthor()
+        self.follow(author1, author2)
+        self.follow(author2, author1)
+        post = self.createPost(author2, 'FOAF')
+
+        author1.user.delete()
+        self.assertEqual(self.viewers(post), {author2.id})
+        self.assertFalse(TimelineEntry.objects.filter(viewer=author1.id)
+                                              .exists())
+
+    def test_stream_cache_invalidation(self):
+        author1 = self.createAuthor()
+        author2 = self.createAuthor()
+        post = self.createPost(author1)
+        setStream(author2.id, 10, [post], [])
+
+        # Posts they can't see leave it alone
+        self.createPost(author1, 'FRIENDS')
+        self.assertIsNotNone(getStream(author2.id, 10))
+        self.assertIsNone(getStream(author2.id, 20))
+
+        # New posts they can see invalidate it
+        self.createPost(author1)
+        self.assertIsNone(getStream(author2.id, 10))
+
+        # So does following someone
+        setStream(author2.id, 10, [post], [])
+        self.follow(author2, author1)
+        self.assertIsNone(getStream(author2.id, 10))
+
+    def test_cached_stream_hydrates_page(self):
+        author = self.createAuthor()
+        posts = [self.createPost(author) for i in range(3)]
+        stream = setStream(author.id, 10, posts, [])
+        cached = CachedStream(stream['items'])
+        self.assertEqual(len(cached), 3)
+        self.assertEqual([post['id'] for post in cached[1:]],
+                         [post.id for post in posts[1:]])
+
+        # Deleted posts are left out
+        posts[1].delete()
+        self.assertEqual([post['id'] for post in cached[1:]], [posts[2].id])
+
+class FriendQueryTests(TestCase):
+    """
+    Friend questions are asked in batches rather than author by author.
+    """
+    def setUp(self):
+        resetFriendGraph()
+        RemoteCredentials.objects.create(host='http://remote.example.com/',
+                                         username='user', password='pass')
+        self.remote = 'http://remote.example.com/author/1/'
+        self.remoteFriends = []
+        self.serveDigest = False
+        self.digestStatus = 404
+
+        user = User.objects.create_user('friendquery')
+        self.author = Author(user=user, host='http://testserver/')
+        self.author.id = self.author.host + 'author/' + uuid.uuid4().hex
+        self.author.url = self.author.id
+        self.author.save()
+
+    def respond(self, method, url, **kwargs):
+        # Serves friend digests when asked to
+        if url.endswith('friends/digest/'):
+            if not self.serveDigest:
+                return mock.Mock(status_code=self.digestStatus, text='')
+            keys = [canonicalId(i) for i in self.remoteFriends]
+            data = BloomFilter.build(keys, 0.01).toData()
+            data['version'] = digestVersion(keys)
+            return mock.Mock(status_code=200, json=lambda: data)
+
+        # Answers friends/ POSTs like the spec says
+        query = json.loads(kwargs['data'].decode('utf-8'))
+        friends = [i for i in query['authors'] if i in self.remoteFriends]
+        return mock.Mock(status_code=200,
+                         json=lambda: {'query': 'friends',
+                                       'author': query['author'],
+                                       'friends': friends})
+
+    def test_local_follows_one_query(self):
+        ids = ['http://localhost/author/{}/'.format(i) for i in range(20)]
+        for i in ids[:5]:
+            Follow.objects.create(author=self.author, friend=i)
+
+        with self.assertNumQueries(2):
+            follows = followsAny(self.author.id, ids)
+        self.assertEqual(follows, set(ids[:5]))
+
+    def test_local_follows_canonical(self):
+        # Followed over http, asked about over https without the slash
+        friend = 'http://localhost/author/1/'
+        Follow.objects.create(author=self.author, friend=friend)
+        asked = 'https://LOCALHOST:443/author/1'
+        self.assertEqual(followsAny(self.author.id, [asked]), {asked})
+
+    def test_remote_follows_one_request(self):
+        self.remoteFriends = [self.author.id]
+        ids = [self.author.id, 'http://localhost/author/2/']
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            self.assertEqual(followsAny(self.remote, ids), {self.author.id})
+            self.assertEqual(request.call_args[0][0], 'POST')
+
+            # Authors without digests aren't asked for one again
+            self.assertEqual(followsAny(self.remote, ids), {self.author.id})
+            self.assertEqual(request.call_count, 3)
+
+    def test_remote_follows_digest(self):
+        self.serveDigest = True
+        self.remoteFriends = [self.author.id]
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            # Ruled out by the digest alone
+            stranger = 'http://localhost/author/stranger/'
+            self.assertEqual(followsAny(self.remote, [stranger]), set())
+            self.assertEqual(request.call_count, 1)
+
+            # Possible matches are confirmed, the digest is asked for again
+            # by version
+            self.assertEqual(followsAny(self.remote, [self.author.id]),
+                             {self.author.id})
+            self.assertEqual(request.call_count, 3)
+            self.assertEqual(request.call_args_list[1][1]['headers'],
+                             {'If-None-Match': '"{}"'.format(
+                                 digestVersion([canonicalId(self.author.id)]))})
+
+    def test_missing_digests(self):
+        ids = [self.author.id]
+        others = ['http://remote.example.com/author/{}/'.format(i)
+                  for i in range(2, 5)]
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            # Failures that might not last aren't remembered
+            self.digestStatus = 401
+            followsAny(self.remote, ids)
+            followsAny(self.remote, ids)
+            self.assertEqual(request.call_count, 4)
+
+            # A missing digest is only missing for that author
+            self.digestStatus = 404
+            followsAny(self.remote, ids)
+            followsAny(self.remote, ids)
+            followsAny(others[0], ids)
+            self.assertEqual(request.call_count, 9)
+
+            # Servers that can't serve any aren't asked for them again
+            self.digestStatus = 405
+            followsAny(others[1], ids)
+            followsAny(others[2], ids)
+            self.assertEqual(request.call_count, 12)
+
+    def test_friend_of_friend_through_remote(self):
+        viewer = 'http://localhost/author/viewer/'
+        Follow.objects.create(author=self.author, friend=self.remote)
+
+        # The remote author only counts if they follow both back
+        self.remoteFriends = [self.author.id]
+        with mock.patch('requests.request', side_effect=self.respond):
+            self.assertFalse(isFriendOfFriend(viewer, self.author.id,
+                                              [self.remote]))
+
+        self.remoteFriends = [self.author.id, viewer]
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            self.assertTrue(isFriendOfFriend(viewer, self.author.id,
+                                             [self.remote]))
+            self.assertEqual(request.call_count, 1)
+
+class FriendGraphTests(TransactionTestCase):
+    """
+    The friend graph answers friend of a friend questions without queries.
+    Follow changes only reach it once committed, so these tests commit.
+    """
+    def setUp(self):
+        resetFriendGraph()
+
+    def test_friends_of_friends(self):
+        ids = ['http://localhost/author/{}/'.format(i) for i in range(6)]
+        graph = FriendGraph()
+        for a, b in ((0, 1), (1, 2), (2, 3), (4, 5)):
+            graph.add(ids[a], ids[b])
+            graph.add(ids[b], ids[a])
+        # Only one way isn't friends
+        graph.add(ids[3], ids[4])
+
+        self.assertEqual(graph.members(graph.friends(ids[1])),
+                         {ids[0], ids[2]})
+        reach = graph.friendsOfFriends(graph.numbersOf([ids[1], ids[5]]))
+        self.assertEqual(graph.members(reach), {ids[0], ids[2], ids[4]})
+
+        graph.remove(ids[1], ids[2])
+        self.assertEqual(graph.members(graph.friends(ids[1])), {ids[0]})
+        self.assertFalse(graph.follows(ids[1], ids[2]))
+        self.assertTrue(graph.follows(ids[2], ids[1]))
+
+    def test_follow_changes(self):
+        user = User.objects.create_user('graph')
+        author = Author(user=user, host='http://testserver/')
+        author.id = author.url = 'http://testserver/author/graph/'
+        author.save()
+
+        other = 'http://localhost/author/other/'
+        with self.assertNumQueries(1):
+            graph = friendGraph()
+        self.assertFalse(graph.follows(author.id, other))
+
+        # Kept up to date without rebuilding
+        follows = [Follow.objects.create(author=author, friend=other)
+                   for i in range(2)]
+        self.assertIs(friendGraph(), graph)
+        self.assertTrue(graph.follows(author.id, other))
+
+        # Until the last Follow saying so is gone
+        follows[0].delete()
+        self.assertTrue(graph.follows(author.id, other))
+        follows[1].delete()
+        self.assertFalse(graph.follows(author.id, other))
+
+        # Changes only reach it once committed, rolled back ones never do
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Follow.objects.create(author=author, friend=other)
+                self.assertFalse(graph.follows(author.id, other))
+                raise RuntimeError()
+        self.assertFalse(graph.follows(author.id, other))
+
+        # Old graphs are rebuilt
+        with override_settings(FRIEND_GRAPH_TTL=-1):
+            self.assertIsNot(friendGraph(), graph)
+
+class CanonicalIdTests(TestCase):
+    def test_variants(self):
+        canonical = 'remote.example.com/author/1/'
+        for authorId in ('http://remote.example.com/author/1/',
+                         'https://remote.example.com/author/1',
+                         'http://Remote.Example.com:80/author/1/',
+                         ' remote.example.com/author/1/?x=1 ',
+                         canonical):
+            self.assertEqual(canonicalId(authorId), canonical)
+
+        # Other ports and paths are different authors, like they're
+        # different servers to credential lookups
+        self.assertEqual(canonicalId('http://remote.example.com:8000/a/1/'),
+                         'remote.example.com:8000/a/1/')
+        self.assertEqual(canonicalId('https://remote.example.com:80/a/1/'),
+                         'remote.example.com:80/a/1/')
+        self.assertEqual(canonicalId('http://user@remote.example.com/a/1/'),
+                         'remote.example.com/a/1/')
+        self.assertNotEqual(canonicalId('http://remote.example.com/a/1/'),
+                            canonicalId('http://remote.example.com/A/1/'))
+        self.assertEqual(canonicalId(''), '')
+
+    def test_filled_on_save(self):
+        user = User.objects.create_user('canonical')
+        author = Author(user=user, host='http://testserver/')
+        author.id = author.url = 'http://testserver/author/canonical/'
+        author.save()
+
+        follow = Follow.objects.create(author=author,
+                                       friend='https://localhost/author/1')
+        self.assertEqual(Follow.objects.get(friendKey='localhost/author/1/'),
+                         follow)
@@ -0,0 +1,335 @@
+# Author: Braedy Kuzma
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from rest.jobUtils import enqueueJob
+from rest.remoteUtils import Deadline
+from .friendUtils import followsAny
+from .idUtils import canonicalId, idsByCanonical
+from .models import Author, Follow, Post, CanSee, TimelineEntry
+from .streamUtils import invalidateStreams
+
+logger = logging.getLogger('stream.dash')
+
+# Most ids put in one IN (...), SQLite only allows 999 parameters
+ID_CHUNK_SIZE = 500
+
+# Posts and authors being deleted by this thread. Their cascades fire the
+# signals below and we mustn't write entries for rows about to disappear.
+_deleting = threading.local()
+
+def deleting():
+    """
+    Primary keys of the posts and authors this thread is deleting.
+    """
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+def chunks(items, size=ID_CHUNK_SIZE):
+    """
+    Split items into lists of at most size.
+    """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def localAuthors(authorIds):
+    """
+    The ids of the local authors in authorIds (ids or urls).
+    """
+    local = set()
+    for ids in chunks(set(authorIds)):
+        local.update(Author.objects.filter(Q(id__in=ids) | Q(url__in=ids))
+                                   .values_list('id', flat=True))
+    return local
+
+def localAuthorsByKey(keys):
+    """
+    The ids of the local authors whose canonical ids (ids or urls) are in
+    keys. Local ids are urls, so each key is looked for with either scheme
+    and with or without its trailing slash.
+    """
+    candidates = set()
+    for key in keys:
+        for scheme in ('http://', 'https://'):
+            candidates.add(scheme + key)
+            candidates.add(scheme + key.rstrip('/'))
+    return localAuthors(candidates)
+
+def localFriends(authorId):
+    """
+    Ids of the local authors a local author follows who follow them back.
+    """
+    following = set(Follow.objects.filter(author=authorId)
+                                  .values_list('friendKey', flat=True))
+    followers = Follow.objects.filter(friendKey=canonicalId(authorId)) \
+                              .values_list('author', flat=True)
+    return {follower for follower in followers
+            if canonicalId(follower) in following}
+
+def friendsOfAny(authorIds):
+    """
+    Ids of the local authors who are friends with one of authorIds (local
+    authors' ids). Takes two queries however many there are.
+    """
+    following = set()
+    for ids in chunks(authorIds):
+        following.update(Follow.objects.filter(author__in=ids)
+                                       .values_list('author', 'friendKey'))
+
+    keys = idsByCanonical(authorIds)
+    friends = set()
+    for chunk in chunks(keys):
+        followers = Follow.objects.filter(friendKey__in=chunk) \
+                                  .values_list('author', 'friendKey')
+        for follower, key in followers:
+            followerKey = canonicalId(follower)
+            if any((authorId, followerKey) in following
+                   for authorId in keys[key]):
+                friends.add(follower)
+    return friends
+
+def foafAudience(authorId, deadline=None):
+    """
+    Ids of the local authors who are friends of a local author or of one of
+    their friends. Local friendships take a few queries. Each remote author
+    they follow is asked once (see followsAny) which of them and the local
+    authors following them they follow back.
+    """
+    friends = localFriends(authorId)
+    audience = friends | friendsOfAny(friends)
+
+    # Remote authors they follow, one id each
+    following = Follow.objects.filter(author=authorId) \
+                              .values_list('friend', flat=True)
+    following = set(following) - localAuthors(following)
+    remote = {key: ids[0] for key, ids in idsByCanonical(following).items()}
+
+    # And the local authors following them
+    followers = {}
+    for keys in chunks(remote):
+        for follower, key in Follow.objects.filter(friendKey__in=keys) \
+                                           .values_list('author', 'friendKey'):
+            followers.setdefault(key, set()).add(follower)
+
+    for key, friend in remote.items():
+        asked = {authorId} | followers.get(key, set())
+        followedBack = followsAny(friend, asked, deadline)
+        if authorId in followedBack:
+            audience |= followedBack
+
+    return audience
+
+def postAudience(post, deadline=None):
+    """
+    Ids of the local authors who should see post on their dashboard. FOAF
+    posts can depend on remote authors' follows, with a deadline those come
+    from the last good response (see followsAny).
+    """
+    # Authors always see their own posts, unlisted ones only them
+    audience = {post.author_id}
+    if post.unlisted:
+        return audience
+
+    if post.visibility in ('PUBLIC', 'SERVERONLY'):
+        audience.update(Author.objects.values_list('id', flat=True))
+    elif post.visibility == 'FRIENDS':
+        audience |= localFriends(post.author_id)
+    elif post.visibility == 'FOAF':
+        audience |= foafAudience(post.author_id, deadline)
+    elif post.visibility == 'PRIVATE':
+        keys = post.cansee_set.values_list('visibleToKey', flat=True)
+        audience |= localAuthorsByKey(set(keys) - {''})
+
+    return audience - deleting()
+
+def addEntries(post, viewers):
+    """
+    Put post on the timelines of viewers, none of which should have it yet.
+    """
+    new = [TimelineEntry(viewer_id=viewer, post=post,
+                         published=post.published)
+           for viewer in viewers]
+    try:
+        with transaction.atomic():
+            TimelineEntry.objects.bulk_create(new, batch_size=ID_CHUNK_SIZE)
+    except IntegrityError:
+        # Someone else fanned it out at the same time, fill in the gaps
+        for entry in new:
+            TimelineEntry.objects.get_or_create(
+                viewer_id=entry.viewer_id, post=post,
+                defaults={'published': post.published}
+            )
+
+def fanOut(post, audience, maxNew=None):
+    """
+    Make post's timeline entries match audience (a set of local author ids).
+    Entries that shouldn't be there are always removed right away. If more
+    than maxNew are missing only the author's is added and False is returned
+    so the rest can be left to a job. Everyone whose timeline changed has
+    their cached stream invalidated.
+    """
+    entries = TimelineEntry.objects.filter(post=post)
+    existing = set(entries.values_list('viewer', flat=True))
+
+    removed = existing - audience
+    for viewers in chunks(removed):
+        entries.filter(viewer__in=viewers).delete()
+
+    # Keep the copied sort key in step with edits, that reorders everyone's
+    changed = removed
+    if entries.exclude(published=post.published) \
+              .update(published=post.published):
+        changed = existing
+
+    missing = audience - existing
+    complete = True
+    if maxNew is not None and len(missing) > maxNew:
+        # The author at least sees it straight away
+        missing &= {post.author_id}
+        complete = False
+
+    addEntries(post, missing)
+    invalidateStreams(changed | missing)
+    return complete
+
+def fanOutJob(postId):
+    """
+    Job that fans out a post to its whole audience, waiting on remote servers
+    for friend lists.
+    """
+    try:
+        post = Post.objects.get(id=postId)
+    except Post.DoesNotExist:
+        # Deleted since, its entries went with it
+        return
+
+    fanOut(post, postAudience(post))
+
+def postChanged(post):
+    """
+    Bring a post's timeline entries up to date after it, or who it's visible
+    to, changed. Small audiences are written now. Big ones are written by a
+    job, as are FOAF posts since their audience can depend on remote friend
+    lists we only use here if they're cached.
+    """
+    maxNew = getattr(settings, 'TIMELINE_FANOUT_INLINE_MAX', 100)
+    audience = postAudience(post, Deadline(0))
+    complete = fanOut(post, audience, maxNew)
+
+    if not complete or post.visibility == 'FOAF':
+        enqueueJob(fanOutJob, {'postId': post.id})
+
+def visiblePosts(author):
+    """
+    Posts a new author can see without having any friends yet.
+    """
+    keys = {canonicalId(author.id), canonicalId(author.url)}
+    canSee = CanSee.objects.filter(visibleToKey__in=keys) \
+                           .values_list('post', flat=True)
+    return Post.objects.filter(Q(visibility__in=('PUBLIC', 'SERVERONLY')) |
+                               Q(visibility='PRIVATE', id__in=canSee),
+                               unlisted=False) \
+                       .exclude(timeline__viewer=author)
+
+def backfill(author):
+    """
+    Put the posts a new author can already see on their timeline.
+    """
+    posts = visiblePosts(author).values_list('id', 'published')
+    new = [TimelineEntry(viewer=author, post_id=postId, published=published)
+           for postId, published in posts]
+    TimelineEntry.objects.bulk_create(new, batch_size=ID_CHUNK_SIZE)
+    invalidateStreams([author.id])
+
+def backfillJob(authorId):
+    """
+    Job that backfills a new author's timeline.
+    """
+    try:
+        author = Author.objects.get(id=authorId)
+    except Author.DoesNotExist:
+        return
+
+    backfill(author)
+
+def followChanged(follow):
+    """
+    Someone followed or unfollowed, which can change who is friends (or
+    friends of friends) with whom. Refan the FRIENDS and FOAF posts of both
+    sides and of their friends.
+    """
+    # Which remote posts they can see may have changed too
+    sides = {follow.author_id} | localAuthors([follow.friend])
+    invalidateStreams(sides)
+
+    authors = set(sides)
+    for author in sides:
+        authors |= localFriends(author)
+
+    posts = Post.objects.filter(author__in=authors, unlisted=False,
+                                visibility__in=('FRIENDS', 'FOAF')) \
+                        .exclude(id__in=deleting())
+    for post in posts:
+        postChanged(post)
+
+def timelinePosts(author, limit):
+    """
+    The newest limit posts on a local author's dashboard, newest first.
+    """
+    entries = TimelineEntry.objects.filter(viewer=author) \
+                                   .select_related('post') \
+                                   .order_by('-published')[:limit]
+    return [entry.post for entry in entries]
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=Author)
+def startDelete(sender, instance, **kwargs):
+    deleting().add(instance.pk)
+
+@receiver(pre_delete, sender=Post)
+def postDeleting(sender, instance, **kwargs):
+    # Its entries are about to go, take it off cached streams too
+    invalidateStreams(TimelineEntry.objects.filter(post=instance)
+                                           .values_list('viewer', flat=True))
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Author)
+def endDelete(sender, instance, **kwargs):
+    deleting().discard(instance.pk)
+
+@receiver(post_save, sender=Post)
+def postSaved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        postChanged(instance)
+
+@receiver(post_save, sender=CanSee)
+@receiver(post_delete, sender=CanSee)
+def canSeeChanged(sender, instance, raw=False, **kwargs):
+    if raw or instance.post_id in deleting():
+        return
+    postChanged(instance.post)
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def followSaved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        followChanged(instance)
+
+@receiver(post_save, sender=Author)
+def authorSaved(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not created:
+        return
+
+    maxNew = getattr(settings, 'TIMELINE_FANOUT_INLINE_MAX', 100)
+    if visiblePosts(instance).count() > maxNew:
+        enqueueJob(backfillJob, {'authorId': instance.id})
+    else:
+        backfill(instance)
@@ -17,267 +17,215 @@ from django.views.generic.edit import CreateView
 from rest.authUtils import createBasicAuthToken, parseBasicAuthToken, \
                            getRemoteCredentials
 from rest.models import RemoteCredentials
+from rest.remotePost import RemotePost, Visibility
+from rest.deliveryUtils import enqueueDelivery
+from rest.remoteUtils import remoteGet, CircuitOpen, Deadline, \
+                             RemoteFetch, requestKey, iterRemotePosts
+from .friendUtils import followsAny, isFriendOfFriend
+from .idUtils import canonicalId
+from .timelineUtils import timelinePosts
+from .streamUtils import getStream, setStream, CachedStream
 from rest.serializers import PostSerializer, CommentSerializer, \
                              FollowSerializer, AuthorSerializer
 from django.utils.dateparse import parse_datetime
+from django.conf import settings
 from urllib.parse import urlsplit, urlunsplit
 import requests
 from rest.verifyUtils import NotFound, RequestExists
 import datetime
 import dateutil.parser
-from requests.exceptions import ChunkedEncodingError
+import functools
+import operator
+import logging
+import time
+from rest.logUtils import truncate
+
+logger = logging.getLogger('stream.dash')
 
 
 def postSortKey(postDict):
     return parse_datetime(postDict['published'])
 
-def getFriends(authorID):
-    friends = []
-    try:
-        #Check if author is local
-
-        #AuthorTest checks if that query breaks, because if so that goes to the DNE except
-        authorTest = Author.objects.get(id=authorID)
-        #If it hasn't broken yet, just check if local friends.
-        following = Follow.objects \
-                               .filter(author=authorID) \
-                               .values_list('friend', flat=True)
-        for author in following:
-            try:
-                #Check if author is local
-                #AuthorTest checks if that query breaks, because if so that goes to the DNE except
-                authorTest = Author.objects.get(id=author)
-
-                #If it hasn't broken yet, just check they follow you locally
-                following2 = Follow.objects \
-                                       .filter(author=author) \
-                                       .values_list('friend', flat=True)
-                if authorID in following2:
-                    friends.append(author)
-
-            except Author.DoesNotExist:
-                host2 = getRemoteCredentials(author)
-                following2 = []
-                if not host2:
-                    #Might have friends with a server we don't have access to.
-                    continue
-                r2 = requests.get(author+ 'friends/',
-                                  data={'query':'friends'},
-                                  auth=(host2.username, host2.password))
-                if r2.status_code == 200:
-                    following2 = r2.json()['authors']
-                    if authorID in following2:
-                        friends.append(author)
-
-
-    except Author.DoesNotExist:
-        #Huzzah, something broke. Most likely, this means that the author is remote
-        following = []
-        host = getRemoteCredentials(authorID)
-        if not host:
-            return friends
-
-        r1 = requests.get(authorID+ 'friends/',
-                          data={'query':'friends'},
-                          auth=(host.username, host.password))
-        if r1.status_code == 200:
-            following = r1.json()['authors']
-
-            for user in following:
+def fetchRemotePosts(host, limit, viewerId=None):
+    """
+    Get up to limit of the posts a remote server has for us as RemotePosts,
+    None on failure. Pages are only requested until there are enough posts.
+
+    With a viewerId the server is asked for only what that author can see
+    (for servers with RemoteCredentials.viewerFiltering).
+    """
+    headers = None
+    if viewerId is not None:
+        headers = {'X-Request-User-ID': viewerId}
+
+    # Paginating stops once this runs out, then we use what we've got
+    deadline = Deadline(getattr(settings, 'REMOTE_TIMEOUT', 5))
+    start = time.monotonic()
+
+    # Technically, author/posts is all posts and posts/ is only PUBLIC
+    # Will everyone follow that? who knows....
+    posts = None
+    for path in ('author/posts/', 'posts/'):
+        remotePosts = iterRemotePosts(host.host + path, host, deadline,
+                                      headers=headers,
+                                      params={'size': min(limit, 100)},
+                                      data={'query':'posts'})
+        try:
+            posts = []
+            for data in itertools.islice(remotePosts, limit):
                 try:
-                    #Check if author is local
-                    #AuthorTest checks if that query breaks, because if so that goes to the DNE except
-                    authorTest = Author.objects.get(id=user)
-
-                    #If it hasn't broken yet, just check if local friends.
-                    following2 = Follow.objects \
-                                           .filter(author=user) \
-                                           .values_list('friend', flat=True)
-                    if authorID in following2:
-                        friends.append(user)
-
-
-                except Author.DoesNotExist:
-                    host2 = getRemoteCredentials(user)
-                    following2 = []
-
-                    if not host2:
-                        continue
-                    r2 = requests.get(user+ 'friends/',
-                                      data={'query':'friends'},
-                                      auth=(host2.username, host2.password))
-                    if r2.status_code == 200:
-                        following2 = r2.json()['authors']
-                        if authorID in following2:
-                            friends.append(user)
-
-    return friends
+                    posts.append(RemotePost(data))
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning('Dropping bad post from %s: %s',
+                                   host.host, e, extra={'node': host.host})
+            break
+        except CircuitOpen:
+            # Known to be down, don't wait on it
+            logger.info('Skipping %s, circuit open', host.host,
+                        extra={'node': host.host})
+            return None
+        except requests.HTTPError as e:
+            logger.warning('Error connecting while getting posts: %s', e,
+                           extra={'node': host.host,
+                                  'status': e.response.status_code})
+        except requests.RequestException as e:
+            logger.warning('%s got error while getting posts: %s',
+                           host.host, e, extra={'node': host.host})
+            return None
+
+    if posts is None:
+        return None
+
+    logger.info('Got %s posts from %s', len(posts), host.host,
+                extra={'node': host.host, 'size': len(posts),
+                       'latency': round((time.monotonic() - start)
+                                        * 1000, 1)})
+    return posts
 
 class StreamView(LoginRequiredMixin, generic.ListView):
     login_url = 'login'
     template_name = 'dashboard.html'
     context_object_name = 'latest_post_list'
-    def get_queryset(self):
-        # Return posts that are visible to everyone (Public, this server only,
-        # self posted. Remove unlisted unless you are the creator of post)
-
-        localVisible = Post.objects.filter(
-            ((Q(visibility='PUBLIC') | Q(visibility='SERVERONLY'))\
-             & Q(unlisted=False)) | Q(author=self.request.user.author)
-        )
+    paginate_by = getattr(settings, 'DASH_PAGE_SIZE', 25)
 
+    def get_queryset(self):
+        #The newest posts of each source are all we could need to fill up to
+        #the requested page
+        try:
+            page = int(self.request.GET.get(self.page_kwarg, 1))
+        except ValueError:
+            page = 1
+        limit = max(page, 1) * self.paginate_by
+
+        # Reloads are just a cache read until something this author can see
+        # changes (or remote posts might have)
+        authorId = self.request.user.author.id
+        stream = getStream(authorId, limit)
+        if stream is None:
+            posts = self.buildStream(limit)
+            stream = setStream(authorId, limit, posts, self.staleHosts)
+
+        self.staleHosts = stream['staleHosts']
+        return CachedStream(stream['items'])
+
+    def buildStream(self, limit):
+        """
+        The newest (at least) limit Posts and RemotePosts this author can see,
+        newest first.
+        """
+        # All remote work shares one latency budget, anything that misses it
+        # is served from its last good response
+        deadline = Deadline(getattr(settings, 'REMOTE_BUDGET', 0.3))
 
         #list of all remote creditials we know about.
         #have host, username, password
         #does not contain our own server
-        allRemotePosts = []
+        #Start fetching from all of them at once
+        #Servers that filter for us only send what this author can see,
+        #the rest send everything and we filter below
+        authorId = self.request.user.author.id
         hosts = RemoteCredentials.objects.all()
+        fetches = []
         for host in hosts:
-            print('Getting from', host.host)
-            # Technically, author/posts is all posts and posts/ is only PUBLIC
-            # Will everyone follow that? who knows....
-            try:
-                r = requests.get(host.host + 'author/posts/',
-                                 data={'query':'posts'},
-                                 auth=(host.username, host.password))
-                if r.status_code != 200:
-                    r = requests.get(host.host + 'posts/',
-                                     data={'query':'posts'},
-                                     auth=(host.username, host.password))
-                    if r.status_code != 200:
-                        print('Error {} connecting while getting posts: {}'
-                              .format(r.status_code, host.host))
-                        print('Got response: {}'.format(r.text))
-                        continue
-            except ChunkedEncodingError as e:
-                print('{} got chunked encoding error...'.format(host.host))
-                print(e)
+            url = '{}author/posts/?limit={}'.format(host.host, limit)
+            viewerId = None
+            if host.viewerFiltering:
+                viewerId = authorId
+                url += '&viewer={}'.format(viewerId)
+            key = requestKey('GET', url, host)
+            fetch = functools.partial(fetchRemotePosts, host, limit, viewerId)
+            fetches.append((host, RemoteFetch(key, fetch, deadline)))
+
+        allRemotePosts = []
+        remotePosts = []
+        self.staleHosts = []
+        for host, fetch in fetches:
+            posts, stale = fetch.result(deadline)
+            if posts is None:
                 continue
 
-            # Hacky things to make us work with remotes that follow the spec
-            # "closely"
-            posts = r.json()['posts']
-            for post in posts:
-                try:
-                    uuid.UUID(post['id'])
-                # If it fails it means it's (probably) a url
-                except ValueError:
-                    pass
-                # If it succeeded we want to overwrite it with the url
-                else:
-                    origin = post['origin']
-                    if origin[-1] != '/':
-                        origin += '/'
-                    post['id'] = origin
-            allRemotePosts += posts
-
-
-        #get local authors who follow you
-        localFollowers = Follow.objects \
-                               .filter(friend=self.request.user.author.id) \
-                               .values_list('author', flat=True)
-        #Of your local follwers, get those that you follow back, the "friends"
-
-        localFriends = Follow.objects \
-                             .filter(author=self.request.user.author.id,friend__in=localFollowers) \
-                             .values_list('friend', flat=True)
-        # Get posts marked FRIENDS visibility whose authors consider this author
-        # a friend
-
-        localFriendsPosts = Post.objects\
-                           .filter(visibility='FRIENDS', author__in=localFriends,
-                                     unlisted=False)
-        #PURGE THE REMOTE POSTS
-
-        following = Follow.objects \
-                               .filter(author=self.request.user.author.id) \
-                               .values_list('friend', flat=True)
-
-        allLocalFOAFPosts = Post.objects\
-                         .filter(visibility='FOAF', unlisted = False)
-        localFOAFPosts = []
-        for FOAFPost in allLocalFOAFPosts:
-            friends = getFriends(FOAFPost.author.id)
-            if self.request.user.author.id in friends:
-                #Grab this post. Somehow.
-                localFOAFPosts.append(FOAFPost)
-
-            for friend in friends:
-                FOAF = getFriends(friend)
-                if self.request.user.author.id in FOAF:
-                    #Grab this post. Somehow.
-                    localFOAFPosts.append(FOAFPost)
-                    break
-
-
-        remotePosts=[]
+            if stale:
+                self.staleHosts.append(host.host)
+                for post in posts:
+                    post.stale = True
+
+            if host.viewerFiltering:
+                remotePosts += [post for post in posts if not post.unlisted]
+            else:
+                allRemotePosts += posts
+
+
+        following = set(Follow.objects
+                              .filter(author=authorId)
+                              .values_list('friend', flat=True))
+
+        #Each remote author is only asked about once, however many posts
+        #they have
+        friendOf = {}
+        foafOf = {}
         for remotePost in allRemotePosts:
-            # Not in just default to False
-            if 'unlisted' not in remotePost or remotePost['unlisted'] == False:
-                # Not in, assume PUBLIC
-                if 'visibility' not in remotePost:
+            if remotePost.unlisted:
+                continue
+
+            postAuthor = remotePost.author['id']
+            if remotePost.visibility is Visibility.PUBLIC:
+                remotePosts.append(remotePost)
+            elif remotePost.visibility is Visibility.FRIENDS:
+                #Check if you follow them, then ask if they follow you.
+                if postAuthor not in following:
+                    continue
+                if postAuthor not in friendOf:
+                    friendOf[postAuthor] = authorId in \
+                        followsAny(postAuthor, [authorId], deadline)
+                if friendOf[postAuthor]:
                     remotePosts.append(remotePost)
-                elif remotePost['visibility'] == 'PUBLIC':
+            elif remotePost.visibility is Visibility.FOAF:
+                if postAuthor not in foafOf:
+                    foafOf[postAuthor] = isFriendOfFriend(authorId,
+                                                          postAuthor,
+                                                          following,
+                                                          deadline)
+                if foafOf[postAuthor]:
                     remotePosts.append(remotePost)
-                elif remotePost['visibility'] == 'FRIENDS':
-                    #Check if you follow them.
-                    if remotePost['author']['id'] in following:
-                        #Huzzah, now check if they follow you.
-                        host = getRemoteCredentials(remotePost['author']['id'])
-                        r1 = requests.get(remotePost['author']['url']+ 'friends/',
-                                          data={'query':'friends'},
-                                          auth=(host.username, host.password))
-                        if r1.status_code == 200:
-                            friends = r1.json()['authors']
-                            if self.request.user.author.id in friends:
-                                remotePosts.append(remotePost)
-                        else:
-                            continue
-                elif remotePost['visibility'] == 'FOAF':
-                    #Same as above, if they're your friend you can just attach it.
-                    authorsFriends = getFriends(remotePost['author']['id'])
-
-                    if self.request.user.author.id in authorsFriends:
-                        #YOU ARE A FRIEND, JUST RUN WITH IT.
-                        remotePosts.append(remotePost)
-                    else:
-                        #YOU ARE NOT A FRIEND, CHECK THEIR FRIENDS
-                        for authorFriend in authorsFriends:
-                            FOAF = getFriends(authorFriend)
-
-                            if self.request.user.author.id in FOAF:
-                                remotePosts.append(remotePost)
-                                #YOU ARE A FOAF, SO BREAK OUT OF LOOP
-                                break
-
-
-                elif remotePost['visibility'] == 'PRIVATE':
-                    if self.request.user.author.url in remotePost['visibleTo']:
-                        remotePosts.append(remotePost)
-
-        # Get posts you can see
-        authorCanSee = CanSee.objects \
-                             .filter(visibleTo=self.request.user.author.url) \
-                             .values_list('post', flat=True)
-        visibleToPosts = Post.objects \
-                             .filter(id__in=authorCanSee, visibility="PRIVATE",
-                                        unlisted=False)
-
-        finalQuery = itertools.chain(localVisible, visibleToPosts, localFriendsPosts, localFOAFPosts)
-        postSerializer = PostSerializer(finalQuery, many=True)
-        #postSerializer.data gives us a list of dicts that can be added to the remote posts lists
-        posts= postSerializer.data + remotePosts
-        posts = sorted(posts, key = postSortKey, reverse=True)
 
-        for post in posts:
-            post['published'] = dateutil.parser.parse(post['published'])
+            elif remotePost.visibility is Visibility.PRIVATE:
+                if self.request.user.author.url in remotePost.visibleTo:
+                    remotePosts.append(remotePost)
 
-        return posts
+        # Local posts were put on our timeline when they were made, the newest
+        # are one indexed range. One extra so the paginator knows there's
+        # another page.
+        localPosts = timelinePosts(self.request.user.author, limit + 1)
+
+        posts = itertools.chain(localPosts, remotePosts)
+        return sorted(posts, key=operator.attrgetter('published'),
+                      reverse=True)
 
     def get_context_data(self, **kwargs):
         context = generic.ListView.get_context_data(self, **kwargs)
         context['postForm'] = PostForm()
         context['commentForm'] = CommentForm()
+        context['staleHosts'] = self.staleHosts
         return context
 
 @require_POST
@@ -403,7 +351,8 @@ def handlePostLists(post, categories, visibleTo):
         # Build canSee objects
         for author in visibilityList:
             try:
-                canSee = CanSee.objects.get(post=post.id, visibleTo=author)
+                canSee = CanSee.objects.get(post=post.id,
+                                            visibleToKey=canonicalId(author))
             except (CanSee.DoesNotExist) as e:
                 canSee = CanSee()
                 canSee.visibleTo = author
@@ -446,8 +395,8 @@ def newComment(request):
         # TODO show error message on failure instead
         hostCreds = getRemoteCredentials(hostUrl)
         if hostCreds == None:
-            print('Failed to find remote credentials for comment post: {}' \
-                  .format(data['post_id']))
+            logger.warning('Failed to find remote credentials for comment '
+                           'post: %s', data['post_id'])
             return redirect(previous_page)
 
         # Ensure that the last character is a slash
@@ -460,9 +409,8 @@ def newComment(request):
             'post':data['post_id'],
             'comment':serialized_comment
         }
-        r = requests.post(hostUrl,
-                          auth=(hostCreds.username, hostCreds.password),
-                          json=data)
+        # Sent by the deliver worker so we don't wait on the remote server
+        enqueueDelivery(hostUrl, data, hostCreds)
 
     # Redirect to the dash
     if (previous_page == None):
@@ -494,7 +442,7 @@ def editPost(request, pid):
         post = PostSerializer(post, many=False).data
         return JsonResponse(post)
     else:
-        print(pid)
+        logger.debug('Editing post %s', pid)
         form = PostForm(request.POST)
         if form.is_valid():
             data = form.cleaned_data
@@ -596,15 +544,16 @@ def addFriend(request):
     user = request.POST['user']
     displayName = request.POST['displayName']
     result = request.POST['result']
-    if result == 'accept' and len(Follow.objects.filter(author=request.user.author, friend=user)) == 0:
+    userKey = canonicalId(user)
+    if result == 'accept' and len(Follow.objects.filter(author=request.user.author, friendKey=userKey)) == 0:
         follow = Follow()
         follow.author = request.user.author
         follow.friend = user
         follow.friendDisplayName = displayName
         follow.save()
-        FriendRequest.objects.get(requestee = request.user.author,requester = user).delete()
+        FriendRequest.objects.filter(requestee = request.user.author,requesterKey = userKey).delete()
     elif result == 'decline':
-        FriendRequest.objects.get(requestee = request.user.author,requester = user).delete()
+        FriendRequest.objects.filter(requestee = request.user.author,requesterKey = userKey).delete()
     return redirect('dash:follow_requests')
 
 @require_POST
@@ -631,8 +580,9 @@ def SendFriendRequest(request):
 
     # Check if this user is already following the requested user. If they aren't
     # then follow the user
+    requestedKey = canonicalId(requestedId)
     localFollows = Follow.objects.filter(author=author,
-                                         friend=requestedId)
+                                         friendKey=requestedKey)
     if len(localFollows) == 0:
         # Build the follow
         follow = Follow()
@@ -649,13 +599,14 @@ def SendFriendRequest(request):
         localAuthorRequested = Author.objects.get(id=requestedId)
         # User can't send a friend request if they are friends already, this avoid the problem
         # where users can spam others sending friend requests
-        if len(Follow.objects.filter(author=author, friend=requestedId)) == 1 and len(
-                Follow.objects.filter(author=Author.objects.get(url=requestedId), friend=author.url)):
+        authorKey = canonicalId(author.url)
+        if len(Follow.objects.filter(author=author, friendKey=requestedKey)) == 1 and len(
+                Follow.objects.filter(author=Author.objects.get(url=requestedId), friendKey=authorKey)):
             return redirect('dash:dash')
 
             # check if the friend is already the following requesting user, this avoid friend requests
             # being added into the table
-        elif len(Follow.objects.filter(author=Author.objects.get(url=requestedId), friend=author.url)):
+        elif len(Follow.objects.filter(author=Author.objects.get(url=requestedId), friendKey=authorKey)):
             return redirect('dash:dash')
     # If they aren't just leave it as None
     except Author.DoesNotExist:
@@ -666,7 +617,7 @@ def SendFriendRequest(request):
          # Don't duplicate friend requests
         localRequest = FriendRequest.objects \
                                     .filter(requestee=localAuthorRequested,
-                                            requester=author.id)
+                                            requesterKey=canonicalId(author.id))
 
         # Just redirect and pretend we did something
         if len(localRequest) > 0:
@@ -682,7 +633,8 @@ def SendFriendRequest(request):
         # TODO show error message on failure instead
         hostCreds = getRemoteCredentials(requestedId)
         if hostCreds == None:
-            #print('Failed to find remote credentials for comment post: {}'.format(data['post_id']))
+            logger.warning('Failed to find remote credentials for friend '
+                           'request: %s', requestedId)
             return redirect('dash:dash')
 
         # Build remote friend request url
@@ -701,9 +653,7 @@ def SendFriendRequest(request):
             'author': authorData,
             'friend': requestedAuthor
         }
-        r = requests.post(url,
-                          auth=(hostCreds.username, hostCreds.password),
-                          json=data)
+        enqueueDelivery(url, data, hostCreds)
     #Redirect to the dash
     return redirect('dash:dash')
 
@@ -713,7 +663,8 @@ def DeleteFriends(request):
 
     if request.method == 'POST':
         if 'unfriend' in request.POST:
-            print(request.POST['unfriend'], request.user.author)
+            logger.debug('%s unfriending %s', request.user.author,
+                         request.POST['unfriend'])
             Follow.objects.get(friendDisplayName=request.POST['unfriend'],author=request.user.author).delete()
 
         elif 'unfollow' in request.POST:
@@ -723,41 +674,29 @@ def DeleteFriends(request):
     Friends = []
     Followings = []
     #get all follow list
-    following = request.user.author.follow.all()
+    author = request.user.author
+    following = list(author.follow.all())
+    followed = [follow.friend for follow in following]
+
+    #Local authors (and which of them follow back) are found in one query
+    #each, remote ones are each asked once if they follow back
+    localAuthors = set(Author.objects.filter(url__in=followed)
+                                     .values_list('url', flat=True))
+    localFollowers = set(Follow.objects.filter(friendKey=canonicalId(author.url),
+                                               author__url__in=localAuthors)
+                                       .values_list('author__url', flat=True))
 
     for follow in following:
-        #check if B follows A
-        localAuthorRequested = None
-        try:
-            localAuthorRequested = Author.objects.get(url = follow.friend)
-    # If they aren't just leave it as None
-        except Author.DoesNotExist:
-            pass
+        if follow.friend in localAuthors:
+            followsBack = follow.friend in localFollowers
+        else:
+            followsBack = author.url in followsAny(follow.friend, [author.url])
 
-    # Was the requested author local?
-        if localAuthorRequested != None:
-            if Follow.objects.filter(friend=follow.author.url,author=Author.objects.get(url = follow.friend)):
-                friend = Follow.objects.filter(friend=follow.author.url,author=Author.objects.get(url = follow.friend))
-                for f in friend:
-                    Friends.append(follow)
-            else:
-                Followings.append(follow)
+        if followsBack:
+            Friends.append(follow)
         else:
-                remote_friend_list=[]
-                try:
-                    host = getRemoteCredentials(follow.friend)
-                    r1 = requests.get(follow.friend+ 'friends/',
-                        data={'query':'friends'},
-                        auth=(host.username, host.password))
-                    if r1.status_code == 200:
-                        remote_friend_list= r1.json()["authors"]
-                        if follow.author.url in remote_friend_list:
-                            Friends.append(follow)
-                        else:
-                            Followings.append(follow)
-                except:
-                    Followings.append(follow)
-
-    print(Followings, Friends)
+            Followings.append(follow)
+
+    logger.debug('Followings: %s, Friends: %s', Followings, Friends)
     friend_requests = FriendRequest.objects.filter(requestee = request.user.author)
     return render(request, 'following.html', {'Followings':Followings,'Friends':Friends, 'Requests':friend_requests})
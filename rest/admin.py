@@ -1,6 +1,75 @@
 from django.contrib import admin
-from .models import LocalCredentials, RemoteCredentials
+from django.utils import timezone
+from .models import Job, LocalCredentials, OutboundDelivery, PeerHealth, \
+                    RemoteCredentials
+
+class PeerHealthAdmin(admin.ModelAdmin):
+    """
+    Shows the circuit breaker state and health score of each remote server.
+    The state is kept up to date by requests, so it's read only here.
+    """
+    list_display = ('credentials', 'state', 'score', 'errorRate', 'latency',
+                    'failures', 'lastSuccess', 'lastFailure', 'openUntil')
+    readonly_fields = ('credentials', 'state', 'score', 'errorRate', 'latency',
+                       'failures', 'openedAt', 'openUntil', 'lastSuccess',
+                       'lastFailure')
+    actions = ['closeCircuits']
+
+    def state(self, health):
+        return health.state(timezone.now())
+
+    def score(self, health):
+        return health.score()
+
+    def closeCircuits(self, request, queryset):
+        """
+        Close the breakers so the servers are tried again right away.
+        """
+        queryset.update(failures=0, openedAt=None, openUntil=None)
+    closeCircuits.short_description = 'Close circuit for selected servers'
+
+    def has_add_permission(self, request):
+        return False
+
+class OutboundDeliveryAdmin(admin.ModelAdmin):
+    """
+    Shows queued and dead lettered deliveries, dead ones can be retried.
+    """
+    list_display = ('url', 'credentials', 'status', 'attempts', 'nextAttempt',
+                    'created')
+    list_filter = ('status', 'credentials')
+    readonly_fields = ('created',)
+    actions = ['retryDeliveries']
+
+    def retryDeliveries(self, request, queryset):
+        """
+        Queue the deliveries to be sent again right away.
+        """
+        queryset.update(status=OutboundDelivery.PENDING, attempts=0,
+                        nextAttempt=timezone.now())
+    retryDeliveries.short_description = 'Retry selected deliveries'
+
+class JobAdmin(admin.ModelAdmin):
+    """
+    Shows queued and dead background jobs, dead ones can be retried.
+    """
+    list_display = ('name', 'status', 'priority', 'runAt', 'attempts',
+                    'created')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created',)
+    actions = ['retryJobs']
+
+    def retryJobs(self, request, queryset):
+        """
+        Queue the jobs to run again right away.
+        """
+        queryset.update(status=Job.PENDING, attempts=0,
+                        runAt=timezone.now())
+    retryJobs.short_description = 'Retry selected jobs'
 
 # Register your models here.
 admin.site.register(LocalCredentials)
 admin.site.register(RemoteCredentials)
+admin.site.register(PeerHealth, PeerHealthAdmin)
+admin.site.register(OutboundDelivery, OutboundDeliveryAdmin)
+admin.site.register(Job, JobAdmin)
@@ -1,13 +1,18 @@
 # Author: Braedy Kuzma
 import base64
-from urllib.parse import urlsplit
-from pprint import pprint # TODO stop logging accesses
-
+import binascii
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.http import HttpResponse
 from rest_framework import authentication
 from rest_framework import exceptions
 
-from .models import LocalCredentials, RemoteCredentials
+from .models import LocalCredentials, RemoteCredentials, normalizeNetloc
 
 def createBasicAuthToken(username, password):
     """
@@ -39,65 +44,166 @@ def parseBasicAuthToken(token):
 
     return (username, password)
 
+class ResultCache(object):
+    """
+    Remembers results for ttl seconds. Successes (truthy results) and
+    failures are each limited to maxSize, the oldest being forgotten first,
+    and kept apart so a flood of failures can't push out the successes.
+    """
+    def __init__(self, ttl, maxSize):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.successes = OrderedDict()
+        self.failures = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns a tuple of (found, result).
+        """
+        now = time.monotonic()
+        with self.lock:
+            for entries in (self.successes, self.failures):
+                cached = entries.get(key)
+                if cached is not None and cached[1] > now:
+                    return (True, cached[0])
+        return (False, None)
+
+    def set(self, key, result):
+        entries, other = (self.successes, self.failures) if result \
+                         else (self.failures, self.successes)
+        with self.lock:
+            other.pop(key, None)
+            entries.pop(key, None)
+            entries[key] = (result, time.monotonic() + self.ttl)
+            while len(entries) > self.maxSize:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.successes.clear()
+            self.failures.clear()
+
+# How long (seconds) a remote credentials lookup is remembered. Other processes
+# only see credential changes after this long.
+REMOTE_CREDENTIALS_CACHE_TTL = 30
+
+# Most lookups (and, separately, misses) to remember
+REMOTE_CREDENTIALS_CACHE_MAX = 1024
+
+# Normalized netloc -> RemoteCredentials or None
+_remoteCredentialsCache = ResultCache(REMOTE_CREDENTIALS_CACHE_TTL,
+                                      REMOTE_CREDENTIALS_CACHE_MAX)
+
+@receiver(post_save, sender=RemoteCredentials)
+@receiver(post_delete, sender=RemoteCredentials)
+def clearRemoteCredentialsCache(sender, **kwargs):
+    """
+    Forget every remote credentials lookup when any RemoteCredentials change.
+    """
+    _remoteCredentialsCache.clear()
+
 def getRemoteCredentials(url):
     """
     Finds a remote host that can be used for the given url.
     Returns None if it couldn't find.
+
+    Lookups (including misses) are remembered in process, so repeat lookups
+    for a server don't query at all.
     """
-    hostSplit = urlsplit(url)
-    hostNetloc = hostSplit.netloc
-    for remoteHost in RemoteCredentials.objects.all():
-        remoteHostSplit = urlsplit(remoteHost.host)
-        remoteHostNetloc = remoteHostSplit.netloc
-        if hostNetloc == remoteHostNetloc:
-            return remoteHost
+    netloc = normalizeNetloc(url)
+    found, remoteHost = _remoteCredentialsCache.get(netloc)
+    if found:
+        return remoteHost
 
-    return None
+    # First credentials made for the host win if there are many
+    remoteHost = RemoteCredentials.objects.filter(netloc=netloc) \
+                                          .order_by('pk') \
+                                          .first()
 
+    _remoteCredentialsCache.set(netloc, remoteHost)
+    return remoteHost
 
-class nodeToNodeBasicAuth(authentication.BaseAuthentication):
-    def authenticate(self, request):
-        """
-        This is an authentication backend for our rest API. It implements
-        HTTP Basic Auth using admin controlled passwords separate from users.
-        """
-        # TODO stop logging accesses
-        print(request.method, request.path)
-        body = request.body.decode('utf-8')
-        pprint(body)
+# How long (seconds) a credentials check is trusted before being redone. Other
+# processes only see credential changes after this long.
+CREDENTIALS_CACHE_TTL = 30
 
-        # Didn't provide auth
-        print('HTTP_AUTHORIZATION' in request.META)
-        if 'HTTP_AUTHORIZATION' not in request.META:
-            raise exceptions.AuthenticationFailed()
+# Most valid (and, separately, invalid) checks to remember
+CREDENTIALS_CACHE_MAX = 1024
 
-        auth = request.META['HTTP_AUTHORIZATION']
-        print('AUTH', auth)
+# Digest of Authorization header -> valid
+_credentialsCache = ResultCache(CREDENTIALS_CACHE_TTL, CREDENTIALS_CACHE_MAX)
 
-        # Tried to auth the wrong way
-        prefix = 'Basic '
-        if not auth.startswith(prefix):
-            raise exceptions.AuthenticationFailed()
+@receiver(post_save, sender=LocalCredentials)
+@receiver(post_delete, sender=LocalCredentials)
+def clearCredentialsCache(sender, **kwargs):
+    """
+    Forget every cached credentials check when any LocalCredentials change.
+    """
+    _credentialsCache.clear()
 
-        # Get username and password
-        token = auth[len(prefix):]
+def verifyCredentials(auth):
+    """
+    Verify an HTTP Basic Authorization header against LocalCredentials.
+    Returns the LocalCredentials it's for or None if it isn't valid.
+    """
+    # Tried to auth the wrong way
+    prefix = 'Basic '
+    if not auth.startswith(prefix):
+        return None
+
+    # Get username and password
+    token = auth[len(prefix):]
+    try:
         username, password = parseBasicAuthToken(token)
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+    # Fail if these credentials don't exist
+    try:
+        creds = LocalCredentials.objects.get(username=username)
+    except LocalCredentials.DoesNotExist:
+        return None
+
+    # Hashing is intentionally slow, this is why results are cached
+    return creds if creds.checkPassword(password) else None
+
+def checkCredentials(auth):
+    """
+    Check an HTTP Basic Authorization header, using a recent result for the
+    same header if we have one. Returns the LocalCredentials it's for or None
+    if it isn't valid.
+    """
+    # Don't keep credentials around in memory, just their digest
+    key = hashlib.sha256(auth.encode('utf-8')).digest()
+    found, creds = _credentialsCache.get(key)
+    if found:
+        return creds
 
-        # TODO stop logging accesses
-        print('AUTHD WITH: {}, {}\n\n'.format(username, password))
+    creds = verifyCredentials(auth)
+    _credentialsCache.set(key, creds)
+    return creds
 
-        # Fail if these credentials don't exist
-        try:
-            creds = LocalCredentials.objects.get(username=username)
-        except LocalCredentials.DoesNotExist:
+class nodeToNodeBasicAuth(authentication.BaseAuthentication):
+    def authenticate(self, request):
+        """
+        This is an authentication backend for our rest API. It implements
+        HTTP Basic Auth using admin controlled passwords separate from users.
+
+        Only the Authorization header is looked at, the body is never read.
+        """
+        # Didn't provide auth
+        auth = request.META.get('HTTP_AUTHORIZATION')
+        if auth is None:
             raise exceptions.AuthenticationFailed()
 
-        # We should probably check their password matches
-        if creds.password != password:
+        creds = checkCredentials(auth)
+        if creds is None:
             raise exceptions.AuthenticationFailed()
 
-        # These are useful things for auth.. maybe later
-        return (None, None)
+        # The credentials are request.auth, they say who's asking (see
+        # visibilityUtils.getViewer)
+        return (None, creds)
 
     def authenticate_header(self, request):
         return 'Basic realm="api"'
@@ -1,7 +1,14 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
 from rest_framework.views import APIView
 
+from dash.idUtils import canonicalId, idsByCanonical
 from dash.models import Follow
 from .serializers import AuthorSerializer
+from .digestUtils import BloomFilter, digestVersion
 from .dataUtils import validateData, getAuthor, getFriendsListData
 from .verifyUtils import multiFriendQueryValidators, DependencyError
 from .httpUtils import JSONResponse
@@ -44,21 +51,14 @@ class AuthorFriendsView(APIView):
                     'query.author': data['author']}
             raise DependencyError(data)
 
-        # Get all follows for the author ONCE. Filter later.
-        authorFollows = Follow.objects.filter(author=author)
-
-        # This is the list of people we consider friends from the list they sent
-        ourFriends = []
-
-        for friendId in data['authors']:
-            try:
-                # We don't actually care what we get back, if it doesn't throw
-                # an exception then we're friends
-                authorFollows.get(friend=friendId)
-                ourFriends.append(friendId)
-            except Follow.DoesNotExist:
-                # If there's an exception we don't care, just move on
-                pass
+        # Find which of them the author follows in one query (by canonical
+        # id), answering with the ids they sent in the order they sent them
+        keys = idsByCanonical(data['authors'])
+        follows = set(Follow.objects.filter(author=author,
+                                            friendKey__in=keys)
+                                    .values_list('friendKey', flat=True))
+        ourFriends = [friendId for friendId in data['authors']
+                      if canonicalId(friendId) in follows]
 
         # Our return data
         rv = {
@@ -69,6 +69,47 @@ class AuthorFriendsView(APIView):
 
         return JSONResponse(rv)
 
+class AuthorFriendsDigestView(APIView):
+    """
+    This view gets a Bloom filter (see BloomFilter) of the canonical ids (see
+    dash.idUtils.canonicalId) of the authors an author follows, so other
+    servers can rule out most friend questions without asking or downloading
+    the whole list. It's versioned by the list, sending the version back in
+    If-None-Match gets a 304 if it hasn't changed. Built digests are cached
+    by version for settings.FRIEND_DIGEST_CACHE_TTL seconds.
+    """
+    def get(self, request, aid):
+        author = getAuthor(request, aid)
+        friends = list(Follow.objects.filter(author=author)
+                                     .values_list('friendKey', flat=True))
+
+        version = digestVersion(friends)
+        etag = '"{}"'.format(version)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        errorRate = getattr(settings, 'FRIEND_DIGEST_ERROR_RATE', 0.01)
+        key = 'frienddigest:{}:{}:{}'.format(
+            hashlib.sha1(author.id.encode('utf-8')).hexdigest(), version,
+            errorRate
+        )
+        data = caches['default'].get(key)
+        if data is None:
+            data = BloomFilter.build(friends, errorRate).toData()
+            data['query'] = 'friendsdigest'
+            data['author'] = author.id
+            data['version'] = version
+            data['count'] = len(set(friends))
+            caches['default'].set(key, data,
+                                  getattr(settings, 'FRIEND_DIGEST_CACHE_TTL',
+                                          60 * 60))
+
+        response = JSONResponse(data)
+        response['ETag'] = etag
+        return response
+
 class AuthorIsFriendsView(APIView):
     """
     This view gets whether or not this user is friends with another.
@@ -80,16 +121,11 @@ class AuthorIsFriendsView(APIView):
         """
         author = getAuthor(request, aid)
 
-        # Make http id, and https id for back up
+        # Get the following relationship, the canonical id doesn't care if
+        # it was followed as http or https
         otherId = 'http://' + other
-        otherIdHttps = 'https://' + other
-
-        # Get the following relationship
-        follows = Follow.objects.filter(author=author, friend=otherId)
-
-        # If we didn't find one then try with https
-        if len(follows) == 0:
-            follows = Follow.objects.filter(author=author, friend=otherIdHttps)
+        follows = Follow.objects.filter(author=author,
+                                        friendKey=canonicalId(otherId))
 
         # Start data return
         data = {}
@@ -4,13 +4,16 @@ from django.core.paginator import Paginator, InvalidPage
 from rest_framework.views import APIView
 
 from dash.models import Post
-from .serializers import PostSerializer
+from .serializers import PostSerializer, POST_CHUNK_SIZE
 from .dataUtils import getAuthor
-from .httpUtils import JSONResponse
+from .httpUtils import JSONResponse, JSONStreamingResponse
+from .verifyUtils import InvalidField
+from .visibilityUtils import VisibilityChecker, getViewer
 
 class AuthorPostView(APIView):
     """
-    This is for viewing all of the posts that a single author has made.
+    This is for viewing all of the posts that a single author has made that
+    the requesting author (see visibilityUtils.getViewer) can see.
     """
     def get(self, request, aid):
         # Try to pull page number out of GET
@@ -35,9 +38,9 @@ class AuthorPostView(APIView):
         # Get the author
         author = getAuthor(request, aid)
 
-        # Get their posts and exclude server only and unlisted
-        posts = Post.objects.filter(author=author) \
-                            .exclude(unlisted=True) \
+        # Get their listed posts the viewer can see
+        checker = VisibilityChecker(getViewer(request))
+        posts = Post.objects.filter(checker.visibleQuery(), author=author) \
                             .exclude(visibility="SERVERONLY")
         count = posts.count()
 
@@ -75,11 +78,9 @@ class AuthorPostView(APIView):
         respData = {}
         respData['query'] = 'posts'
         respData['count'] = count
-        respData['size'] = size if size < len(page) else len(page)
-
-        # Now get our data
-        postSer = PostSerializer(page, many=True)
-        respData['posts'] = postSer.data
+        # Count the page without evaluating it so it can be streamed below
+        respData['size'] = page.end_index() - page.start_index() + 1 \
+                           if count else 0
 
         # Build and our next/previous uris
         # Next if one-indexed pageNum isn't already the page count
@@ -98,4 +99,8 @@ class AuthorPostView(APIView):
                                              .format(size, pageNum - 2))
             respData['previous'] = uri
 
-        return JSONResponse(respData)
+        # Serialize and send the posts one at a time
+        pagePosts = page.object_list.iterator()
+        return JSONStreamingResponse(respData, 'posts', pagePosts,
+                                     PostSerializer,
+                                     chunkSize=POST_CHUNK_SIZE)
@@ -2,8 +2,10 @@
 
 from rest_framework.views import APIView
 
+from dash.models import Author
 from .serializers import AuthorSerializer
-from .dataUtils import getAuthor
+from .verifyUtils import multiAuthorQueryValidators
+from .dataUtils import validateData, getAuthor, getAuthorsListData
 from .httpUtils import JSONResponse
 
 class AuthorView(APIView):
@@ -16,3 +18,27 @@ class AuthorView(APIView):
         context = {'addFriends': True}
         authSer =  AuthorSerializer(author, context=context)
         return JSONResponse(authSer.data)
+
+class AuthorsView(APIView):
+    """
+    This view gets many authors at once.
+    """
+    def post(self, request):
+        """
+        Rather than posting authors to create this is a lookup of a list of
+        author id urls. Authors we don't have are left out of the response.
+        """
+        data = getAuthorsListData(request)
+        validateData(data, multiAuthorQueryValidators)
+
+        # One query for every author asked for
+        authors = Author.objects.filter(id__in=data['authors']) \
+                                .select_related('user')
+        authSer = AuthorSerializer(authors, many=True)
+
+        rv = {
+            'query': 'authors',
+            'authors': authSer.data
+        }
+
+        return JSONResponse(rv)
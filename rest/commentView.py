@@ -1,14 +1,97 @@
 # Author: Braedy Kuzma
+import uuid
 
 from django.core.paginator import Paginator, InvalidPage
+from django.db import transaction, IntegrityError
 from rest_framework.views import APIView
 
+from dash.idUtils import canonicalId
 from dash.models import Comment, Author, RemoteCommentAuthor
 from .serializers import CommentSerializer
-from .verifyUtils import addCommentValidators, InvalidField, ResourceConflict, \
-                         DependencyError, NotVisible
-from .dataUtils import validateData, getCommentData, getPost
-from .httpUtils import JSONResponse
+from .verifyUtils import addCommentValidators, addCommentsValidators, \
+                         commentValidators, InvalidField, ResourceConflict, \
+                         DependencyError, NotVisible, DefaultException
+from .dataUtils import validateData, requireFields, getCommentData, \
+                       getCommentsData, getPost, commentRequired
+from .httpUtils import JSONResponse, JSONStreamingResponse
+from .visibilityUtils import VisibilityChecker, getViewer
+
+def saveCommentAuthors(authorsData):
+    """
+    Cache remote comment authors from comment author data, creating new ones
+    and updating ones we already had. Local authors are ignored. Uses a fixed
+    number of queries no matter how many authors there are.
+    """
+    # Only keep the latest data for each author
+    authorsData = {authorData['id']: authorData for authorData in authorsData}
+
+    # Local authors don't need caching
+    localIds = Author.objects.filter(id__in=authorsData) \
+                             .values_list('id', flat=True)
+    for authorId in localIds:
+        del authorsData[authorId]
+
+    existing = RemoteCommentAuthor.objects.in_bulk(list(authorsData))
+
+    newAuthors = []
+    for authorId, authorData in authorsData.items():
+        author = existing.get(authorId, RemoteCommentAuthor(authorId=authorId))
+        fields = {
+            'displayName': authorData['displayName'],
+            'host': authorData['host'],
+            'github': authorData.get('github', '')
+        }
+
+        # Brand new, make!
+        if authorId not in existing:
+            for field, value in fields.items():
+                setattr(author, field, value)
+            newAuthors.append(author)
+        # Update if anything changed
+        elif any(getattr(author, field) != value
+                 for field, value in fields.items()):
+            for field, value in fields.items():
+                setattr(author, field, value)
+            author.save()
+
+    RemoteCommentAuthor.objects.bulk_create(newAuthors)
+
+def saveComments(pending):
+    """
+    Save new comments and cache their remote authors. pending is a list of
+    (Comment, author data, status) for comments that didn't exist when we
+    checked. Comments someone else saved since then get a 409 status.
+    """
+    try:
+        with transaction.atomic():
+            Comment.objects.bulk_create([comment for comment, authorData,
+                                         status in pending])
+            saveCommentAuthors([authorData for comment, authorData, status
+                                in pending])
+        return
+    except IntegrityError:
+        pass
+
+    # A concurrent batch saved some of the same comments or comment authors
+    # first, save the comments one at a time so only the duplicates fail
+    saved = []
+    for comment, authorData, status in pending:
+        try:
+            with transaction.atomic():
+                comment.save(force_insert=True)
+        except IntegrityError:
+            e = ResourceConflict('comment', str(comment.id))
+            status.update(success=False, status=e.status, errors=e.data)
+        else:
+            saved.append(authorData)
+
+    # Authors made concurrently are updated instead the second time
+    try:
+        with transaction.atomic():
+            saveCommentAuthors(saved)
+    except IntegrityError:
+        with transaction.atomic():
+            saveCommentAuthors(saved)
 
 class CommentView(APIView):
     """
@@ -34,8 +117,10 @@ class CommentView(APIView):
         if size > 100:
             size = 100
 
-        # Get comments and the count
+        # Get comments and the count, only if they can see the post
         post = getPost(request, pid)
+        if not VisibilityChecker(getViewer(request)).canSee(post):
+            raise NotVisible('Access denied: post is not visible to you')
         comments = Comment.objects.filter(post=post)
         count = comments.count()
 
@@ -72,11 +157,9 @@ class CommentView(APIView):
         respData = {}
         respData['query'] = 'comments'
         respData['count'] = count
-        respData['size'] = size if size < len(page) else len(page)
-
-        # Now get our data
-        comSer = CommentSerializer(page, many=True)
-        respData['comments'] = comSer.data
+        # Count the page without evaluating it so it can be streamed below
+        respData['size'] = page.end_index() - page.start_index() + 1 \
+                           if count else 0
 
         # Build and our next/previous uris
         # Next if one-indexed pageNum isn't already the page count
@@ -95,7 +178,10 @@ class CommentView(APIView):
                                              .format(size, pageNum - 2))
             respData['previous'] = uri
 
-        return JSONResponse(respData, status=200)
+        # Serialize and send the comments one at a time
+        pageComments = page.object_list.iterator()
+        return JSONStreamingResponse(respData, 'comments', pageComments,
+                                     CommentSerializer, status=200)
 
     def post(self, request, pid):
         """
@@ -133,6 +219,12 @@ class CommentView(APIView):
         # Pull out comment specific data
         commentData = data['comment']
 
+        # The commenter has to be able to see the post
+        checker = VisibilityChecker(commentData['author']['id'])
+        if not checker.canSee(post):
+            raise NotVisible('Access denied: post is not visible to the '
+                             'comment\'s author')
+
         # Build comment
         comment = Comment()
         comment.author = commentData['author']['id']
@@ -144,29 +236,8 @@ class CommentView(APIView):
 
         comment.save()
 
-        authorData = commentData['author']
-        authorId = authorData['id']
-        # Try to get as a local author
-        try:
-            author = Author.objects.get(id=authorId)
-        # Not a local author, we don't care, just make them remote
-        except Author.DoesNotExist:
-            # Try and get remote author, if we find, then update
-            try:
-                author = RemoteCommentAuthor.objects.get(authorId=authorId)
-                author.displayName = authorData['displayName']
-                author.host = authorData['host']
-                author.github = authorData.get('github', '')
-                author.save()
-            # Didn't exist, so make!
-            except RemoteCommentAuthor.DoesNotExist:
-                author = RemoteCommentAuthor()
-                author.authorId = authorId
-                author.displayName = authorData['displayName']
-                author.host = authorData['host']
-                author.save()
-
-        # TODO check if author has visibility,403 if they don't
+        # Cache the author if they're remote
+        saveCommentAuthors([commentData['author']])
 
         data = {
             "query": "addComment",
@@ -175,3 +246,106 @@ class CommentView(APIView):
         }
 
         return JSONResponse(data)
+
+class CommentBulkView(APIView):
+    """
+    This view adds many comments to a post at once.
+    """
+    def post(self, request, pid):
+        """
+        This creates many comments on a post. Each comment is validated on its
+        own and gets its own status in the response, valid new comments are
+        all saved in one transaction.
+        """
+        # Get and validate the sent data
+        data = getCommentsData(request)
+        validateData(data, addCommentsValidators)
+
+        # Get the post these should be attached to
+        post = getPost(request, pid)
+
+        # Check if post is SERVERONLY, they can't post comments to a SERVERONLY
+        # post
+        if post.visibility == 'SERVERONLY':
+            raise NotVisible('Access denied: post has SERVERONLY visibility')
+
+        # Ensure that the url they POST'd to was the URL they said they were
+        # posting to
+        if post.id != data['post']:
+            data = {'post.id': post.id,
+                    'query.post': data['post']}
+            raise DependencyError(data)
+
+        # Validate every comment, remembering each one's status in order
+        statuses = []
+        validComments = []
+        for i, commentData in enumerate(data['comments']):
+            status = {'success': True, 'status': 201}
+            statuses.append(status)
+            try:
+                if not isinstance(commentData, dict):
+                    raise InvalidField('comments.{}'.format(i), commentData)
+                status['id'] = commentData.get('id')
+                requireFields(commentData, commentRequired)
+                validateData(commentData, commentValidators)
+            except DefaultException as e:
+                status.update(success=False, status=e.status, errors=e.data)
+            else:
+                validComments.append((commentData, status))
+
+        # Commenters have to be able to see the post, each is only checked once
+        allowed = {}
+        for commentData, status in validComments:
+            authorId = commentData['author']['id']
+            if authorId not in allowed:
+                checker = VisibilityChecker(authorId)
+                allowed[authorId] = checker.canSee(post)
+            if not allowed[authorId]:
+                e = NotVisible('Access denied: post is not visible to the '
+                               'comment\'s author')
+                status.update(success=False, status=e.status, errors=e.data)
+        validComments = [(commentData, status)
+                         for commentData, status in validComments
+                         if status['success']]
+
+        # Find the comments that already exist in one query. Compare as UUIDs
+        # in case they were formatted differently
+        commentIds = [uuid.UUID(commentData['id'])
+                      for commentData, status in validComments]
+        existing = Comment.objects.filter(id__in=commentIds) \
+                                  .values_list('id', flat=True)
+        existing = set(existing)
+
+        # Build comments
+        pending = []
+        for commentData, status in validComments:
+            commentId = uuid.UUID(commentData['id'])
+
+            # Exists already (or was sent twice)
+            if commentId in existing:
+                e = ResourceConflict('comment', commentData['id'])
+                status.update(success=False, status=e.status, errors=e.data)
+                continue
+            existing.add(commentId)
+
+            comment = Comment()
+            comment.author = commentData['author']['id']
+            # bulk_create doesn't call save
+            comment.authorKey = canonicalId(comment.author)
+            comment.post = post
+            comment.comment = commentData['comment']
+            comment.contentType = commentData['contentType']
+            comment.published = commentData['published']
+            comment.id = commentId
+            pending.append((comment, commentData['author'], status))
+
+        # Save it all at once
+        saveComments(pending)
+
+        data = {
+            "query": "addComments",
+            "success": all(status['success'] for status in statuses),
+            "comments": statuses
+        }
+
+        return JSONResponse(data)
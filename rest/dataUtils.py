@@ -1,6 +1,9 @@
 # Author: Braedy Kuzma
 import uuid
 import json
+import zlib
+
+from django.conf import settings
 
 from dash.models import Post, Author
 from .verifyUtils import InvalidField, MissingFields, MalformedId, NotFound, \
@@ -140,15 +143,47 @@ def getAuthor(request, aid):
     return author
 
 
+def getBody(request):
+    """
+    Returns the raw request body, decompressing it if it was sent with
+    Content-Encoding gzip or deflate.
+    Raises MalformedBody if it couldn't be decompressed or was too large.
+    """
+    body = request.body
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+
+    if encoding not in ('gzip', 'deflate'):
+        raise MalformedBody(encoding)
+
+    # Don't inflate past what Django would accept uncompressed, a tiny
+    # compressed body can be huge
+    maxSize = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    # wbits of 32 + 15 auto detects gzip or zlib (deflate) headers
+    decompressor = zlib.decompressobj(32 + 15)
+    try:
+        if maxSize is None:
+            return decompressor.decompress(body)
+        data = decompressor.decompress(body, maxSize)
+    except zlib.error:
+        raise MalformedBody(encoding)
+    if decompressor.unconsumed_tail:
+        raise MalformedBody('decompressed body too large')
+
+    return data
+
 def getData(request):
     """
     This tries to return valid JSON data from a request.
     Raises MalformedBody if POST body wasn't valid JSON.
     """
+    body = getBody(request)
     try:
-        return json.loads(str(request.body, encoding='utf-8'))
+        return json.loads(str(body, encoding='utf-8'))
     except json.decoder.JSONDecodeError:
-        raise MalformedBody(request.body)
+        raise MalformedBody(body)
 
 def getPostData(request):
     """
@@ -162,6 +197,19 @@ def getPostData(request):
 
     return data
 
+# Fields required for a single comment
+commentRequired = (
+    ('author', (
+        'id',
+        'host',
+        'displayName'
+    )),
+    'comment',
+    'contentType',
+    'published',
+    'id'
+)
+
 def getCommentData(request):
     """
     Returns comment data from POST request.
@@ -172,17 +220,24 @@ def getCommentData(request):
     required = (
         'query',
         'post',
-        ('comment', (
-            ('author', (
-                'id',
-                'host',
-                'displayName'
-            )),
-            'comment',
-            'contentType',
-            'published',
-            'id'
-        ))
+        ('comment', commentRequired)
+    )
+    requireFields(data, required)
+
+    return data
+
+def getCommentsData(request):
+    """
+    Returns data for many comments from POST request. Only the outer fields are
+    required here, each comment should be checked against commentRequired.
+    """
+    data = getData(request)
+
+    # Ensure required fields are present
+    required = (
+        'query',
+        'post',
+        'comments'
     )
     requireFields(data, required)
 
@@ -218,3 +273,31 @@ def getFriendsListData(request):
     requireFields(data, required)
 
     return data
+
+def getAuthorsListData(request):
+    """
+    Returns data about a multiple author query.
+    """
+    data = getData(request)
+
+    required = (
+        'query',
+        'authors'
+    )
+    requireFields(data, required)
+
+    return data
+
+def getPostsListData(request):
+    """
+    Returns data about a multiple post query.
+    """
+    data = getData(request)
+
+    required = (
+        'query',
+        'posts'
+    )
+    requireFields(data, required)
+
+    return data
@@ -0,0 +1,134 @@
+# Author: Braedy Kuzma
+import datetime
+import itertools
+import json
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+import requests
+
+from .jobUtils import lease, retryDelay
+from .logUtils import truncate
+from .models import OutboundDelivery
+from .remoteUtils import postJSON, CircuitOpen
+
+logger = logging.getLogger('stream.delivery')
+
+# Client errors that are worth retrying (timeout, too many requests)
+RETRY_STATUSES = (408, 429)
+
+def enqueueDelivery(url, data, creds):
+    """
+    Queue data to be POSTed as JSON to url on a remote server. It's sent by
+    the deliver worker, see deliverPending.
+    """
+    body = JSONRenderer().render(data).decode('utf-8')
+    return OutboundDelivery.objects.create(credentials=creds, url=url,
+                                           data=body)
+
+def claim(delivery, now):
+    """
+    Lease a due delivery so other workers leave it alone while we send it.
+    Returns False if another worker got it first.
+    """
+    seconds = getattr(settings, 'DELIVERY_LEASE', 5 * 60)
+    return lease(delivery, 'nextAttempt',
+                 now + datetime.timedelta(seconds=seconds))
+
+def failed(delivery, error, retry=True):
+    """
+    Record a failed attempt. The delivery is retried later unless retry is
+    False or it's out of attempts, then it's dead lettered.
+    """
+    delivery.attempts += 1
+    delivery.lastError = truncate(error)
+
+    maxAttempts = getattr(settings, 'DELIVERY_MAX_ATTEMPTS', 10)
+    if not retry or delivery.attempts >= maxAttempts:
+        delivery.status = OutboundDelivery.DEAD
+        logger.warning('Gave up delivering to %s: %s', delivery.url, error,
+                       extra={'node': delivery.credentials.host,
+                              'endpoint': delivery.url,
+                              'attempts': delivery.attempts})
+    else:
+        delay = retryDelay(delivery.attempts,
+                           getattr(settings, 'DELIVERY_RETRY_BASE', 30),
+                           getattr(settings, 'DELIVERY_RETRY_MAX',
+                                   6 * 60 * 60))
+        delivery.nextAttempt = timezone.now() + \
+                               datetime.timedelta(seconds=delay)
+        logger.info('Delivery to %s failed, retrying in %ds: %s',
+                    delivery.url, delay, error,
+                    extra={'node': delivery.credentials.host,
+                           'endpoint': delivery.url,
+                           'attempts': delivery.attempts})
+
+    delivery.save(update_fields=['attempts', 'lastError', 'status',
+                                 'nextAttempt'])
+
+def deliverBatch(creds, deliveries):
+    """
+    Send a remote server's due deliveries over one connection. Once its
+    circuit breaker opens the rest wait for the next pass.
+
+    Returns the number delivered.
+    """
+    delivered = 0
+    with requests.Session() as session:
+        for i, delivery in enumerate(deliveries):
+            try:
+                r = postJSON(delivery.url, json.loads(delivery.data), creds,
+                             session=session)
+            except CircuitOpen:
+                # Not an attempt, the rest wait until the server might be back
+                openSeconds = getattr(settings, 'CIRCUIT_OPEN_SECONDS', 60)
+                OutboundDelivery.objects \
+                    .filter(pk__in=[d.pk for d in deliveries[i:]]) \
+                    .update(nextAttempt=timezone.now() +
+                            datetime.timedelta(seconds=openSeconds))
+                break
+            except requests.RequestException as e:
+                failed(delivery, e)
+                continue
+
+            if 200 <= r.status_code < 300:
+                delivery.delete()
+                delivered += 1
+            else:
+                # Other client errors mean it'll never be accepted
+                error = 'Got status code {}: {}'.format(r.status_code,
+                                                        truncate(r.text))
+                retry = r.status_code >= 500 or \
+                        r.status_code in RETRY_STATUSES
+                failed(delivery, error, retry)
+
+    return delivered
+
+def deliverPending(limit=None):
+    """
+    Send up to limit (default settings.DELIVERY_BATCH_SIZE) due deliveries,
+    batched by remote server. Safe to run in several workers at once.
+
+    Returns the number of deliveries that were due.
+    """
+    if limit is None:
+        limit = getattr(settings, 'DELIVERY_BATCH_SIZE', 50)
+
+    # Oldest first so no server's deliveries starve the others'
+    now = timezone.now()
+    due = OutboundDelivery.objects \
+                          .filter(status=OutboundDelivery.PENDING,
+                                  nextAttempt__lte=now) \
+                          .select_related('credentials') \
+                          .order_by('nextAttempt')[:limit]
+    due = sorted(due, key=lambda d: d.credentials_id)
+
+    for credsId, deliveries in itertools.groupby(due,
+                                                 lambda d: d.credentials_id):
+        deliveries = [d for d in deliveries if claim(d, now)]
+        if deliveries:
+            deliverBatch(deliveries[0].credentials, deliveries)
+
+    return len(due)
@@ -0,0 +1,109 @@
+# Author: Braedy Kuzma
+import base64
+import hashlib
+import math
+import struct
+
+# Fewest bits a digest is made with, so empty and tiny sets still work
+MIN_DIGEST_BITS = 64
+
+# Largest digests we'll read from other servers, bigger ones would cost too
+# much memory (8 MiB) or time (hashes per lookup) to be worth it
+MAX_DIGEST_BITS = 8 * 1024 * 1024 * 8
+MAX_DIGEST_HASHES = 32
+
+def digestVersion(ids):
+    """
+    Version of a set of ids, it only changes when the set does.
+    """
+    joined = '\n'.join(sorted(set(ids))).encode('utf-8')
+    return hashlib.sha1(joined).hexdigest()
+
+class BloomFilter(object):
+    """
+    A compact set of strings that can have false positives but never false
+    negatives.
+
+    The positions of a string are (a + i * b) mod size for i in range(hashes)
+    where a and b are the first and second 8 bytes of its UTF-8 SHA-256 as big
+    endian integers. Other servers have to do the same to read our digests.
+
+    Bits are kept in a bytearray, bit n being bit n % 8 of byte n // 8.
+    """
+    def __init__(self, size, hashes, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(size // 8) if bits is None else bytearray(bits)
+
+    @classmethod
+    def build(cls, items, errorRate):
+        """
+        A filter of items sized for a false positive rate of errorRate.
+        """
+        items = set(items)
+        count = max(len(items), 1)
+        size = -count * math.log(errorRate) / math.log(2) ** 2
+        size = max(MIN_DIGEST_BITS, int(math.ceil(size / 8)) * 8)
+
+        # The best number of hashes for errorRate, tiny sets padded to
+        # MIN_DIGEST_BITS don't need more
+        hashes = -math.log(errorRate) / math.log(2)
+        hashes = min(MAX_DIGEST_HASHES, max(1, int(round(hashes))))
+
+        bloom = cls(size, hashes)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def positions(self, item):
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        a, b = struct.unpack('>QQ', digest[:16])
+        return ((a + i * b) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position // 8] |= 1 << position % 8
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] >> position % 8 & 1
+                   for position in self.positions(item))
+
+    def toData(self):
+        """
+        The filter as a JSON serializable dict, bits are base64 encoded little
+        endian bytes.
+        """
+        return {
+            'size': self.size,
+            'hashes': self.hashes,
+            'bits': base64.b64encode(self.bits).decode('ascii')
+        }
+
+    @classmethod
+    def fromData(cls, data):
+        """
+        Read a filter made by toData. Raises ValueError if it's malformed or
+        too big (see MAX_DIGEST_BITS and MAX_DIGEST_HASHES).
+        """
+        try:
+            size = int(data['size'])
+            hashes = int(data['hashes'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError('Malformed digest: {}'.format(e))
+
+        # Checked before decoding so huge digests aren't decoded
+        if size > MAX_DIGEST_BITS or hashes > MAX_DIGEST_HASHES:
+            raise ValueError('Digest too big')
+
+        try:
+            encoded = data['bits']
+            if len(encoded) > (size // 8 + 2) // 3 * 4:
+                raise ValueError('more bits than its size')
+            bits = base64.b64decode(encoded, validate=True)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError('Malformed digest: {}'.format(e))
+
+        if size <= 0 or size % 8 or len(bits) != size // 8 or hashes <= 0:
+            raise ValueError('Malformed digest: bad size')
+
+        return cls(size, hashes, bits)
@@ -0,0 +1,72 @@
+# Author: Braedy Kuzma
+
+from collections import defaultdict
+
+from rest_framework.views import APIView
+
+from dash.models import Post, Category, CanSee, Comment
+from .serializers import PostExportSerializer
+from .httpUtils import NDJSONStreamingResponse
+from .visibilityUtils import VisibilityChecker, getViewer
+
+# How many posts to pull related data for at once
+EXPORT_CHUNK_SIZE = 200
+
+def groupByPost(queryset, field):
+    """
+    Turn a queryset of related objects into a dict of post id -> list of field.
+    """
+    grouped = defaultdict(list)
+    for postId, value in queryset.values_list('post', field):
+        grouped[postId].append(value)
+    return grouped
+
+def exportPosts(posts):
+    """
+    Generator yielding serialized posts for export.
+
+    Posts are walked in id order a chunk at a time (keyset pagination, so no
+    OFFSET or COUNT) and each chunk's categories, visibleTos and comment ids are
+    fetched together. The number of queries is fixed per chunk rather than per
+    post and only one chunk is ever held in memory.
+    """
+    posts = posts.order_by('id')
+    lastId = None
+    while True:
+        # Get the next chunk after the last post we sent
+        if lastId is not None:
+            chunk = posts.filter(id__gt=lastId)
+        else:
+            chunk = posts
+        chunk = list(chunk[:EXPORT_CHUNK_SIZE])
+        if not chunk:
+            return
+        lastId = chunk[-1].id
+
+        postIds = [post.id for post in chunk]
+        categories = Category.objects.filter(post__in=postIds)
+        canSees = CanSee.objects.filter(post__in=postIds)
+        comments = Comment.objects.filter(post__in=postIds)
+
+        context = {
+            'categories': groupByPost(categories, 'category'),
+            'visibleTo': groupByPost(canSees, 'visibleTo'),
+            'comments': groupByPost(comments, 'id')
+        }
+
+        for post in chunk:
+            yield PostExportSerializer(post, context=context).data
+
+class PostExportView(APIView):
+    """
+    This streams every listed post the requesting author (see
+    visibilityUtils.getViewer) can see as newline delimited JSON, only PUBLIC
+    ones if the request isn't for anyone. It's meant for initial syncs and
+    backups, use posts/ for browsing.
+    """
+    def get(self, request):
+        # Same visibility as author/posts/
+        checker = VisibilityChecker(getViewer(request))
+        posts = Post.objects.filter(checker.visibleQuery())
+
+        return NDJSONStreamingResponse(exportPosts(posts))
@@ -1,5 +1,6 @@
 from rest_framework.views import APIView
 
+from dash.idUtils import canonicalId
 from dash.models import Author, FriendRequest, Follow
 from .dataUtils import validateData, getFriendRequestData
 from .verifyUtils import friendRequestValidators, NotFound, RequestExists
@@ -22,7 +23,8 @@ class FriendRequestView(APIView):
         authorId = data['friend']['id']
         requestorId = data['author']['id']
 
-        # Make sure they're requesting with a trailing slash
+        # Lookups use canonical ids, but what's stored is used to build urls
+        # so make sure it has a trailing slash
         if not requestorId.endswith('/'):
             requestorId += '/'
 
@@ -32,8 +34,9 @@ class FriendRequestView(APIView):
             raise NotFound('author', authorId)
 
         # Don't duplicate friend requests
+        requestorKey = canonicalId(requestorId)
         fqs = FriendRequest.objects.filter(requestee=author,
-                                           requester=requestorId)
+                                           requesterKey=requestorKey)
         if len(fqs) > 0:
             raise RequestExists({'query': data['query'],
                                  'author.id': authorId,
@@ -41,7 +44,7 @@ class FriendRequestView(APIView):
 
         # Don't create a FQ if they're already following
         follows = Follow.objects.filter(author=author,
-                                         friend=requestorId)
+                                        friendKey=requestorKey)
         if len(follows) > 0:
             raise RequestExists({'query': data['query'],
                                  'author.id': authorId,
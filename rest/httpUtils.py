@@ -1,4 +1,6 @@
-from django.http import HttpResponse
+import itertools
+
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.renderers import JSONRenderer
 
 # Initially taken from
@@ -11,3 +13,66 @@ class JSONResponse(HttpResponse):
         content = JSONRenderer().render(data)
         kwargs['content_type'] = 'application/json; charset=utf-8'
         super(JSONResponse, self).__init__(content, **kwargs)
+
+class JSONStreamingResponse(StreamingHttpResponse):
+    """
+    A StreamingHttpResponse that renders a JSON object with one list field that
+    is serialized and sent one item at a time.
+
+    data is the rest of the object (e.g. query, count, next), listName is the
+    key the items belong under and serializerClass is used (with many=True) on
+    chunkSize items at a time, so list serializers can fetch what a chunk needs
+    together. Peak memory is bounded by the largest chunk rather than the
+    whole list.
+    """
+    def __init__(self, data, listName, items, serializerClass, context=None,
+                 chunkSize=1, **kwargs):
+        content = self.renderStream(data, listName, items, serializerClass,
+                                    context or {}, chunkSize)
+        kwargs['content_type'] = 'application/json; charset=utf-8'
+        super(JSONStreamingResponse, self).__init__(content, **kwargs)
+
+    @staticmethod
+    def renderStream(data, listName, items, serializerClass, context,
+                     chunkSize=1):
+        """
+        Generator yielding the JSON bytes of the response.
+        """
+        renderer = JSONRenderer()
+
+        # Render everything except the list, then reopen the object so the list
+        # can be appended as the last key
+        envelope = renderer.render(data)
+        yield envelope[:-1]
+        if data:
+            yield b','
+        yield renderer.render(listName) + b':['
+
+        # Serialize items a chunk at a time, only the current chunk is held in
+        # memory
+        items = iter(items)
+        first = True
+        while True:
+            chunk = list(itertools.islice(items, chunkSize))
+            if not chunk:
+                break
+
+            chunkSer = serializerClass(chunk, many=True, context=context)
+            for itemData in chunkSer.data:
+                if not first:
+                    yield b','
+                first = False
+                yield renderer.render(itemData)
+
+        yield b']}'
+
+class NDJSONStreamingResponse(StreamingHttpResponse):
+    """
+    A StreamingHttpResponse that renders already serialized items as newline
+    delimited JSON, one object per line.
+    """
+    def __init__(self, items, **kwargs):
+        renderer = JSONRenderer()
+        content = (renderer.render(item) + b'\n' for item in items)
+        kwargs['content_type'] = 'application/x-ndjson; charset=utf-8'
+        super(NDJSONStreamingResponse, self).__init__(content, **kwargs)
@@ -0,0 +1,178 @@
+# Author: Braedy Kuzma
+import datetime
+import json
+import logging
+import random
+import time
+import traceback
+
+from django.db import connection, connections, transaction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from .logUtils import truncate
+from .models import Job
+
+logger = logging.getLogger('stream.jobs')
+
+# How many due jobs to try when claiming without SKIP LOCKED before giving up
+# for this pass (others may be claiming the same ones)
+CLAIM_CANDIDATES = 10
+
+def enqueueJob(func, args=None, priority=0, delay=0, timeout=None,
+               maxAttempts=None):
+    """
+    Queue func(**args) to be run by a worker (manage.py runworker). func must
+    be a module level function and args JSON serializable.
+
+    delay is seconds before it can run and timeout seconds a worker holds it
+    before it's assumed lost and run again.
+    """
+    job = Job()
+    job.name = '{}.{}'.format(func.__module__, func.__qualname__)
+    job.args = JSONRenderer().render(args or {}).decode('utf-8')
+    job.priority = priority
+    job.runAt = timezone.now() + datetime.timedelta(seconds=delay)
+    job.timeout = timeout or getattr(settings, 'JOB_TIMEOUT', 300)
+    job.maxAttempts = maxAttempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+    job.save()
+    return job
+
+def retryDelay(attempts, base, maxDelay=None):
+    """
+    Seconds to wait before retrying something (a job or delivery) that has
+    failed attempts times. Doubles each time from base, up to maxDelay if
+    given, with jitter so retries spread out.
+    """
+    delay = base * 2 ** (attempts - 1)
+    if maxDelay is not None:
+        delay = min(delay, maxDelay)
+    return delay * random.uniform(1, 1.1)
+
+def lease(row, field, until, **updates):
+    """
+    Lease a pending row (a Job or OutboundDelivery) by moving its due time,
+    field, to until. The update is conditional on the due time not having
+    moved, so it fails if another worker leased it first. updates are other
+    fields to set with it.
+
+    Returns whether we got the lease, the row is updated if we did.
+    """
+    updates[field] = until
+    claimed = type(row).objects \
+                       .filter(pk=row.pk, status=type(row).PENDING,
+                               **{field: getattr(row, field)}) \
+                       .update(**updates)
+    if claimed != 1:
+        return False
+
+    for name, value in updates.items():
+        setattr(row, name, value)
+    return True
+
+def dueJobs(now):
+    """
+    Due jobs in the order they should run.
+    """
+    return Job.objects.filter(status=Job.PENDING, runAt__lte=now) \
+                      .order_by('-priority', 'runAt')
+
+def claimJob():
+    """
+    Lease the next due job. On Postgres this uses SELECT ... FOR UPDATE SKIP
+    LOCKED so workers never wait on each other. Django 1.10 can't do that
+    through the ORM, so elsewhere (SQLite) a job is claimed with an update
+    conditional on nobody else having claimed it.
+
+    Returns the claimed Job or None if nothing is due.
+    """
+    now = timezone.now()
+
+    if connection.vendor == 'postgresql':
+        quote = connection.ops.quote_name
+        column = lambda name: quote(Job._meta.get_field(name).column)
+        query = 'SELECT * FROM {table} ' \
+                'WHERE {status} = %s AND {runAt} <= %s ' \
+                'ORDER BY {priority} DESC, {runAt} ' \
+                'LIMIT 1 FOR UPDATE SKIP LOCKED' \
+                .format(table=quote(Job._meta.db_table),
+                        status=column('status'), runAt=column('runAt'),
+                        priority=column('priority'))
+
+        with transaction.atomic():
+            jobs = list(Job.objects.raw(query, [Job.PENDING, now]))
+            if not jobs:
+                return None
+
+            job = jobs[0]
+            job.runAt = now + datetime.timedelta(seconds=job.timeout)
+            job.attempts += 1
+            job.save(update_fields=['runAt', 'attempts'])
+            return job
+
+    for job in dueJobs(now)[:CLAIM_CANDIDATES]:
+        leaseEnd = now + datetime.timedelta(seconds=job.timeout)
+        if lease(job, 'runAt', leaseEnd, attempts=job.attempts + 1):
+            return job
+
+    return None
+
+def runJob(job):
+    """
+    Run a claimed job. Finished jobs are deleted, failed ones are scheduled
+    to retry with exponential backoff or marked dead once they're out of
+    attempts. Attempts are counted when claimed so jobs that kill their
+    worker still run out.
+    """
+    start = time.monotonic()
+    try:
+        func = import_string(job.name)
+        func(**json.loads(job.args))
+    except Exception as e:
+        job.lastError = truncate(traceback.format_exc())
+        if job.attempts >= job.maxAttempts:
+            job.status = Job.DEAD
+            logger.warning('Job %s failed for good: %s', job.name, e,
+                           extra={'job': job.pk, 'attempts': job.attempts})
+        else:
+            delay = retryDelay(job.attempts,
+                               getattr(settings, 'JOB_RETRY_BASE', 30))
+            job.runAt = timezone.now() + datetime.timedelta(seconds=delay)
+            logger.info('Job %s failed, retrying in %ds: %s', job.name,
+                        delay, e,
+                        extra={'job': job.pk, 'attempts': job.attempts})
+        job.save(update_fields=['status', 'runAt', 'lastError'])
+        return
+
+    jobId = job.pk
+    job.delete()
+    logger.info('Ran job %s', job.name,
+                extra={'job': jobId, 'latency':
+                       round((time.monotonic() - start) * 1000, 1)})
+
+def runNextJob():
+    """
+    Claim and run one job. Returns False if there was nothing to run.
+    """
+    job = claimJob()
+    if job is None:
+        return False
+    runJob(job)
+    return True
+
+def workLoop(interval, once=False):
+    """
+    Run jobs forever, sleeping interval seconds whenever none are due. With
+    once it returns when none are due instead.
+    """
+    try:
+        while True:
+            if not runNextJob():
+                if once:
+                    return
+                time.sleep(interval)
+    finally:
+        # Workers in threads have their own connections
+        connections.close_all()
@@ -0,0 +1,212 @@
+# Author: Braedy Kuzma
+import json
+import re
+
+# Bytes that matter when finding the end of a JSON value. Everything JSON
+# cares about is ASCII and UTF-8 never uses ASCII bytes inside multi-byte
+# characters, so scanning the raw bytes is safe.
+SPECIAL = re.compile(b'["\\\\\\[\\]{}]')
+STRING_SPECIAL = re.compile(b'["\\\\]')
+SCALAR_END = re.compile(b'[\\s,\\]}]')
+WHITESPACE = re.compile(b'\\s*')
+
+class JSONListReader(object):
+    """
+    Incrementally parses a JSON object (e.g. a post list response) fed to it in
+    chunks of bytes. The items of the list field listName are returned as soon
+    as each one is complete, so only one item is ever buffered. Every other
+    field ends up in envelope.
+
+    Items bigger than maxItemBytes are skipped (and counted in skipped)
+    without being buffered. Other fields that big, or bad JSON, raise
+    ValueError. foundList says whether the list has been seen at all.
+    """
+    def __init__(self, listName, maxItemBytes):
+        self.listName = listName
+        self.maxItemBytes = maxItemBytes
+        self.envelope = {}
+        self.skipped = 0
+        self.foundList = False
+
+        # Unparsed bytes and what we expect next in them
+        self.buffer = bytearray()
+        self.state = 'start'
+        self.key = None
+
+        # Progress finding the end of the value at the start of the buffer,
+        # kept between chunks so big values are only scanned once
+        self.scanning = False
+        self.pos = 0
+        self.depth = 0
+        self.inString = False
+        self.scalar = False
+        self.oversize = False
+
+    def feed(self, chunk):
+        """
+        Add a chunk of bytes. Returns a list of the items it completed.
+        """
+        self.buffer += chunk
+        items = []
+        while self.step(items):
+            pass
+        return items
+
+    def step(self, items):
+        """
+        Make one step of progress through the buffer, completed items are
+        added to items. Returns False if more bytes are needed.
+        """
+        if self.scanning:
+            return self.scanValue(items)
+
+        buf = self.buffer
+        del buf[:WHITESPACE.match(buf).end()]
+        if not buf:
+            return False
+        char = buf[0:1]
+
+        if self.state == 'start':
+            if char != b'{':
+                raise ValueError('Expected a JSON object')
+            del buf[:1]
+            self.state = 'key'
+        elif self.state in ('key', 'item') and char == b',':
+            del buf[:1]
+        elif self.state == 'key':
+            if char == b'}':
+                del buf[:1]
+                self.state = 'done'
+            elif char == b'"':
+                self.startValue(char)
+            else:
+                raise ValueError('Expected a key')
+        elif self.state == 'colon':
+            if char != b':':
+                raise ValueError('Expected a colon')
+            del buf[:1]
+            self.state = 'list' if self.key == self.listName else 'value'
+        elif self.state == 'list' and char == b'[':
+            del buf[:1]
+            self.state = 'item'
+            self.foundList = True
+        elif self.state == 'item' and char == b']':
+            del buf[:1]
+            self.state = 'key'
+        elif self.state in ('value', 'list', 'item'):
+            # A list field that isn't a list (e.g. null) is just a value
+            if self.state == 'list':
+                self.state = 'value'
+            self.startValue(char)
+        else:
+            # Trailing bytes after the object
+            del buf[:]
+            return False
+
+        return True
+
+    def startValue(self, char):
+        """
+        Start scanning for the end of the value starting with char.
+        """
+        self.scanning = True
+        self.pos = 1
+        self.depth = 0
+        self.inString = False
+        self.scalar = False
+        if char == b'"':
+            self.inString = True
+        elif char in (b'{', b'['):
+            self.depth = 1
+        else:
+            self.scalar = True
+            self.pos = 0
+
+    def scanValue(self, items):
+        """
+        Continue scanning the current value, handling it once it's complete.
+        """
+        buf = self.buffer
+        if not self.scan():
+            # Stop buffering values that are too big, skip to their end
+            if self.pos > self.maxItemBytes:
+                if self.state != 'item':
+                    raise ValueError('JSON value too large')
+                self.oversize = True
+                del buf[:self.pos]
+                self.pos = 0
+            return False
+
+        end = self.pos
+        value = None
+        if not self.oversize:
+            value = json.loads(bytes(buf[:end]).decode('utf-8'))
+        del buf[:end]
+        self.scanning = False
+
+        if self.state == 'key':
+            self.key = value
+            self.state = 'colon'
+        elif self.state == 'value':
+            self.envelope[self.key] = value
+            self.state = 'key'
+        elif self.oversize:
+            self.oversize = False
+            self.skipped += 1
+        else:
+            items.append(value)
+
+        return True
+
+    def scan(self):
+        """
+        Advance self.pos through the buffer. Returns True once it's just past
+        the end of the current value.
+        """
+        buf = self.buffer
+        if self.scalar:
+            match = SCALAR_END.search(buf, self.pos)
+            if match is None:
+                self.pos = len(buf)
+                return False
+            self.pos = match.start()
+            return True
+
+        while True:
+            if self.inString:
+                match = STRING_SPECIAL.search(buf, self.pos)
+                if match is None:
+                    self.pos = len(buf)
+                    return False
+
+                # Skip escaped characters, wait if we don't have it yet
+                if match.group() == b'\\':
+                    if match.end() >= len(buf):
+                        self.pos = match.start()
+                        return False
+                    self.pos = match.end() + 1
+                    continue
+
+                self.pos = match.end()
+                self.inString = False
+                if self.depth == 0:
+                    return True
+                continue
+
+            match = SPECIAL.search(buf, self.pos)
+            if match is None:
+                self.pos = len(buf)
+                return False
+
+            char = match.group()
+            self.pos = match.end()
+            if char == b'"':
+                self.inString = True
+            elif char in (b'{', b'['):
+                self.depth += 1
+            elif char in (b'}', b']'):
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+            else:
+                raise ValueError('Unexpected backslash')
@@ -0,0 +1,136 @@
+# Author: Braedy Kuzma
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from django.conf import settings
+
+# Attributes every LogRecord has, anything else was passed in extra and is one
+# of our structured fields
+STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+STANDARD_ATTRS.update(('message', 'asctime'))
+
+def truncate(value, limit=None):
+    """
+    Shorten a (potentially huge) body for logging. Bodies longer than limit
+    (default settings.LOG_BODY_LIMIT) characters are cut off and marked with
+    their full length.
+    """
+    if limit is None:
+        limit = getattr(settings, 'LOG_BODY_LIMIT', 512)
+
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    value = str(value)
+
+    if len(value) <= limit:
+        return value
+    return '{}...[{} chars]'.format(value[:limit], len(value))
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Fields passed with extra=
+    (e.g. node, endpoint, latency, size) are included as their own keys.
+    """
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'category': record.name,
+            'message': record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS:
+                data[key] = value
+
+        # Records from BackgroundHandler only have the already formatted
+        # exc_text, their exc_info is gone
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, default=str)
+
+class SampleFilter(logging.Filter):
+    """
+    Only lets through a fraction of records for each category (logger name).
+    Rates come from settings.LOG_SAMPLE_RATES, a dict of logger name prefix ->
+    rate between 0 and 1, the longest matching prefix wins. Categories without
+    a rate are always let through, as are warnings and worse.
+    """
+    def __init__(self, name=''):
+        logging.Filter.__init__(self, name)
+        self.rates = {}
+
+    def sampleRate(self, category):
+        """
+        Find (and remember) the sample rate for a category.
+        """
+        if category not in self.rates:
+            rates = getattr(settings, 'LOG_SAMPLE_RATES', {})
+            matches = [prefix for prefix in rates
+                       if category == prefix or
+                          category.startswith(prefix + '.')]
+            if matches:
+                self.rates[category] = rates[max(matches, key=len)]
+            else:
+                self.rates[category] = 1.0
+
+        return self.rates[category]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rate = self.sampleRate(record.name)
+        return rate >= 1 or random.random() < rate
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background thread which formats and writes them to
+    stream (default stderr), so logging never blocks on I/O. If the queue is
+    full records are dropped and counted rather than waiting for room.
+    """
+    def __init__(self, stream=None, maxSize=10000):
+        logging.handlers.QueueHandler.__init__(self, queue.Queue(maxSize))
+        self.dropped = 0
+
+        self.structured = StructuredFormatter()
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(self.structured)
+
+        self.listener = logging.handlers.QueueListener(self.queue, target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        """
+        Make a copy of the record safe to pass to another thread. Unlike
+        QueueHandler.prepare the message isn't formatted into a single string
+        here, only the arguments are merged in and any traceback is kept in
+        exc_text so StructuredFormatter can still give it its own field.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = \
+                    self.structured.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,28 @@
+# Author: Braedy Kuzma
+import time
+
+from django.core.management.base import BaseCommand
+
+from rest.deliveryUtils import deliverPending
+
+class Command(BaseCommand):
+    help = 'Sends queued deliveries (comments, friend requests, ...) to ' \
+           'remote servers, retrying failures with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Send what is due then exit')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--batch', type=int, default=None,
+                            help='Most deliveries to send per pass')
+
+    def handle(self, *args, **options):
+        while True:
+            due = deliverPending(options['batch'])
+
+            # Keep going while there's a backlog
+            if options['once'] and due == 0:
+                break
+            if due == 0:
+                time.sleep(options['interval'])
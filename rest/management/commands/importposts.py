@@ -0,0 +1,108 @@
+# Author: Braedy Kuzma
+import gzip
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from dash.idUtils import canonicalId
+from dash.models import Post, Author, Category, CanSee
+from dash.timelineUtils import postChanged
+
+class Command(BaseCommand):
+    help = 'Imports posts from a newline delimited JSON export ' \
+           '(export/posts.ndjson). Gzipped files are detected automatically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Export file to read, - for stdin')
+
+    def handle(self, *args, **options):
+        stream = self.openExport(options['path'])
+
+        # Cache which authors exist so we don't look them up for every post
+        authorExists = {}
+        imported = 0
+        skipped = 0
+
+        with transaction.atomic():
+            for lineNum, line in enumerate(stream, 1):
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    data = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    raise CommandError('Invalid JSON on line {}'
+                                       .format(lineNum))
+
+                # Posts have to belong to a local author
+                authorId = data.get('author')
+                if authorId not in authorExists:
+                    authorExists[authorId] = Author.objects \
+                                                   .filter(id=authorId) \
+                                                   .exists()
+                if not authorExists[authorId]:
+                    self.stderr.write('Skipping {}, unknown author {}'
+                                      .format(data.get('id'), authorId))
+                    skipped += 1
+                    continue
+
+                self.importPost(data)
+                imported += 1
+
+        self.stdout.write('Imported {} posts, skipped {}.'
+                          .format(imported, skipped))
+
+    def openExport(self, path):
+        """
+        Open the export as a binary stream, transparently un-gzipping it.
+        """
+        if path == '-':
+            stream = sys.stdin.buffer
+        else:
+            try:
+                stream = open(path, 'rb')
+            except OSError as e:
+                raise CommandError(str(e))
+
+        # Check the gzip magic number
+        if stream.peek(2)[:2] == b'\x1f\x8b':
+            stream = gzip.GzipFile(fileobj=stream)
+
+        return stream
+
+    def importPost(self, data):
+        """
+        Create or overwrite a post and its categories and visibleTos.
+        """
+        post = Post()
+        post.id = data['id']
+        post.author_id = data['author']
+        post.title = data['title']
+        post.description = data.get('description', '')
+        post.contentType = data['contentType']
+        post.content = data['content']
+        post.published = parse_datetime(data['published'])
+        post.visibility = data['visibility']
+        post.unlisted = data.get('unlisted', False)
+        post.save()
+
+        # Replace the post's lists wholesale
+        Category.objects.filter(post=post).delete()
+        Category.objects.bulk_create(
+            [Category(post=post, category=category)
+             for category in data.get('categories', [])]
+        )
+
+        CanSee.objects.filter(post=post).delete()
+        CanSee.objects.bulk_create(
+            [CanSee(post=post, visibleTo=authorId,
+                    visibleToKey=canonicalId(authorId))
+             for authorId in data.get('visibleTo', [])]
+        )
+
+        # bulk_create doesn't send signals, fan out with the new visibleTos
+        postChanged(post)
@@ -0,0 +1,45 @@
+# Author: Braedy Kuzma
+import multiprocessing
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from rest.jobUtils import workLoop
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (see rest.jobUtils.enqueueJob). ' \
+           'Any number of these can run at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Jobs to run at once')
+        parser.add_argument('--processes', action='store_true',
+                            help='Run jobs in processes instead of threads')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to sleep when no jobs are due')
+        parser.add_argument('--once', action='store_true',
+                            help='Run due jobs then exit')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        kwargs = {'interval': options['interval'], 'once': options['once']}
+        if options['concurrency'] == 1:
+            workLoop(**kwargs)
+            return
+
+        if options['processes']:
+            # Don't share our database connections with the children
+            connections.close_all()
+            workerClass = multiprocessing.Process
+        else:
+            workerClass = threading.Thread
+
+        workers = [workerClass(target=workLoop, kwargs=kwargs, daemon=True)
+                   for i in range(options['concurrency'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,78 @@
+# Author: Braedy Kuzma
+import binascii
+import logging
+import time
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from .authUtils import parseBasicAuthToken
+
+accessLogger = logging.getLogger('stream.access')
+
+# Content types we bother compressing, these are what the REST api serves
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson')
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that only compresses JSON responses. Normal responses are
+    only compressed if they're at least settings.JSON_GZIP_MIN_LENGTH bytes,
+    streaming responses always are because we can't know their size.
+    """
+    def process_response(self, request, response):
+        contentType = response.get('Content-Type', '')
+        if not contentType.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        # Small bodies cost more to compress than they save
+        minLength = getattr(settings, 'JSON_GZIP_MIN_LENGTH', 1024)
+        if not response.streaming and len(response.content) < minLength:
+            return response
+
+        return GZipMiddleware.process_response(self, request, response)
+
+def getAuthUsername(request):
+    """
+    Get the username a request used for Basic Auth without verifying it.
+    Returns None if there isn't one.
+    """
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    prefix = 'Basic '
+    if not auth.startswith(prefix):
+        return None
+
+    try:
+        return parseBasicAuthToken(auth[len(prefix):])[0]
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+class AccessLogMiddleware(object):
+    """
+    Logs every request to the stream.access category with the node that made
+    it, the endpoint, status, latency and request/response sizes. Latency for
+    streaming responses only covers producing the headers.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.monotonic()
+        response = self.get_response(request)
+
+        # Don't bother building fields if nobody will see them
+        if accessLogger.isEnabledFor(logging.INFO):
+            latency = (time.monotonic() - start) * 1000
+            size = None if response.streaming else len(response.content)
+            fields = {
+                'node': getAuthUsername(request),
+                'method': request.method,
+                'endpoint': request.path,
+                'status': response.status_code,
+                'latency': round(latency, 1),
+                'requestSize': int(request.META.get('CONTENT_LENGTH') or 0),
+                'responseSize': size
+            }
+            accessLogger.info('%s %s %s', request.method, request.path,
+                              response.status_code, extra=fields)
+
+        return response
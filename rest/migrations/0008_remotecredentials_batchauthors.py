@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0007_remotecredentials_gziprequests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotecredentials',
+            name='batchAuthors',
+            field=models.BooleanField(default=False),
+        ),
+    ]
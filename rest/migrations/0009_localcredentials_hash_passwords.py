@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:33
+from __future__ import unicode_literals
+
+from django.contrib.auth.hashers import make_password, identify_hasher
+from django.db import migrations, models
+
+
+def hashPasswords(apps, schema_editor):
+    """
+    Hash any plain text LocalCredentials passwords.
+    """
+    LocalCredentials = apps.get_model('rest', 'LocalCredentials')
+    for creds in LocalCredentials.objects.all():
+        try:
+            identify_hasher(creds.password)
+        except ValueError:
+            creds.password = make_password(creds.password)
+            creds.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0008_remotecredentials_batchauthors'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='localcredentials',
+            name='password',
+            field=models.CharField(help_text='Stored hashed. Enter a new plain text password to change it.', max_length=128),
+        ),
+        migrations.RunPython(hashPasswords, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:34
+from __future__ import unicode_literals
+
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+
+
+def normalizeNetloc(url):
+    """
+    Copy of rest.models.normalizeNetloc as it was when this was written, the
+    live one may change.
+    """
+    split = urlsplit(url)
+    netloc = split.netloc.rpartition('@')[2].lower()
+
+    defaultPort = {'http': ':80', 'https': ':443'}.get(split.scheme.lower())
+    if defaultPort and netloc.endswith(defaultPort):
+        netloc = netloc[:-len(defaultPort)]
+
+    return netloc
+
+
+def fillNetlocs(apps, schema_editor):
+    """
+    Fill in the normalized netloc of existing RemoteCredentials.
+    """
+    RemoteCredentials = apps.get_model('rest', 'RemoteCredentials')
+    for creds in RemoteCredentials.objects.all():
+        creds.netloc = normalizeNetloc(creds.host)
+        creds.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0009_localcredentials_hash_passwords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotecredentials',
+            name='netloc',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fillNetlocs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0010_remotecredentials_netloc'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeerHealth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('failures', models.IntegerField(default=0)),
+                ('errorRate', models.FloatField(default=0)),
+                ('latency', models.FloatField(default=0)),
+                ('openedAt', models.DateTimeField(blank=True, null=True)),
+                ('openUntil', models.DateTimeField(blank=True, null=True)),
+                ('lastSuccess', models.DateTimeField(blank=True, null=True)),
+                ('lastFailure', models.DateTimeField(blank=True, null=True)),
+                ('credentials', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='rest.RemoteCredentials')),
+            ],
+            options={
+                'verbose_name_plural': 'PeerHealth',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0011_peerhealth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=512)),
+                ('data', models.TextField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DEAD', 'Dead')], default='PENDING', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('nextAttempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lastError', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('credentials', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rest.RemoteCredentials')),
+            ],
+            options={
+                'verbose_name_plural': 'OutboundDeliveries',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outbounddelivery',
+            index_together=set([('status', 'nextAttempt')]),
+        ),
+    ]
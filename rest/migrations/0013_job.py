@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0012_outbounddelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256)),
+                ('args', models.TextField(default='{}')),
+                ('priority', models.IntegerField(default=0)),
+                ('runAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('timeout', models.IntegerField(default=300)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DEAD', 'Dead')], default='PENDING', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('maxAttempts', models.IntegerField(default=5)),
+                ('lastError', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('status', 'runAt')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 14:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0013_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotecredentials',
+            name='viewerFiltering',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-19 15:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0014_remotecredentials_viewerfiltering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='localcredentials',
+            name='host',
+            field=models.URLField(blank=True, default='', help_text="Server these credentials were given to. Blank trusts them for any other server's authors."),
+        ),
+        migrations.AddField(
+            model_name='localcredentials',
+            name='netloc',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+    ]
@@ -1,7 +1,27 @@
+from urllib.parse import urlsplit
+
 from django.db import models
+from django.utils import timezone
+from django.contrib.auth.hashers import make_password, check_password, \
+                                      identify_hasher
 
 # Create your models here.
 
+def normalizeNetloc(url):
+    """
+    Get the network location (host[:port]) of a url in a normal form so that
+    urls on the same server compare equal. It's lowercased with any user info
+    and default port removed.
+    """
+    split = urlsplit(url)
+    netloc = split.netloc.rpartition('@')[2].lower()
+
+    defaultPort = {'http': ':80', 'https': ':443'}.get(split.scheme.lower())
+    if defaultPort and netloc.endswith(defaultPort):
+        netloc = netloc[:-len(defaultPort)]
+
+    return netloc
+
 class RemoteCredentials(models.Model):
     """
     Credentials to use for a remote server.
@@ -17,9 +37,161 @@ class RemoteCredentials(models.Model):
     username = models.CharField(max_length=64)
     password = models.CharField(max_length=64)
 
+    # Whether the remote server accepts gzipped request bodies
+    # (Content-Encoding: gzip). Responses are negotiated automatically.
+    gzipRequests = models.BooleanField(default=False)
+
+    # Whether the remote server supports batch author lookups (POST authors/)
+    batchAuthors = models.BooleanField(default=False)
+
+    # Whether the remote server only sends the posts the author named in
+    # X-Request-User-ID can see from author/posts/
+    viewerFiltering = models.BooleanField(default=False)
+
+    # Normalized network location of host, this is what urls are matched on
+    netloc = models.CharField(max_length=255, db_index=True, editable=False,
+                              default='')
+
+    def save(self, *args, **kwargs):
+        self.netloc = normalizeNetloc(self.host)
+        super(RemoteCredentials, self).save(*args, **kwargs)
+
     def __str__(self):
         return '{}@{}'.format(self.username, self.host)
 
+class PeerHealth(models.Model):
+    """
+    Circuit breaker state and health of a remote server. This is shared by
+    every process through the database so a dead server is only discovered
+    once.
+
+    The breaker is closed (requests go through) until failures reaches the
+    failure threshold, then it's open (requests are skipped) until openUntil.
+    After that it's half open and a single probe request is let through,
+    success closes it and failure opens it again.
+    """
+    class Meta:
+        verbose_name_plural = 'PeerHealth'
+
+    credentials = models.OneToOneField(RemoteCredentials,
+                                       on_delete=models.CASCADE,
+                                       related_name='health')
+
+    # Consecutive failed requests, reset on any success
+    failures = models.IntegerField(default=0)
+
+    # Moving averages of the fraction of requests that failed and of request
+    # latency in milliseconds
+    errorRate = models.FloatField(default=0)
+    latency = models.FloatField(default=0)
+
+    # When the breaker was tripped and until when it skips requests, None if
+    # it's closed
+    openedAt = models.DateTimeField(null=True, blank=True)
+    openUntil = models.DateTimeField(null=True, blank=True)
+
+    lastSuccess = models.DateTimeField(null=True, blank=True)
+    lastFailure = models.DateTimeField(null=True, blank=True)
+
+    def state(self, now):
+        """
+        The breaker's state at time now: 'closed', 'open' or 'half open'.
+        """
+        if self.openUntil is None:
+            return 'closed'
+        if now < self.openUntil:
+            return 'open'
+        return 'half open'
+
+    def score(self):
+        """
+        Health score out of 100, the success rate with a penalty for each
+        consecutive failure.
+        """
+        score = 100 * (1 - self.errorRate) - 10 * self.failures
+        return max(0, round(score))
+
+    def __str__(self):
+        return str(self.credentials)
+
+class OutboundDelivery(models.Model):
+    """
+    A POST to a remote server (e.g. a comment or friend request) waiting to be
+    sent by the deliver worker, so users never wait on remote servers.
+
+    Failed deliveries are retried with exponential backoff. Ones that can't
+    succeed (rejected by the remote server or out of attempts) are kept as
+    dead letters instead of being dropped.
+    """
+    class Meta:
+        verbose_name_plural = 'OutboundDeliveries'
+        index_together = ('status', 'nextAttempt')
+
+    PENDING = 'PENDING'
+    DEAD = 'DEAD'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DEAD, 'Dead'),
+    )
+
+    credentials = models.ForeignKey(RemoteCredentials,
+                                    on_delete=models.CASCADE)
+    url = models.URLField(max_length=512)
+
+    # The JSON body to POST
+    data = models.TextField()
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(default=timezone.now)
+    lastError = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.url, self.status)
+
+class Job(models.Model):
+    """
+    A function call to run in the background by a runworker process, see
+    rest.jobUtils.
+
+    Claiming a job leases it by moving runAt timeout seconds ahead, if the
+    worker dies the job becomes due again once the lease runs out (a
+    visibility timeout). Finished jobs are deleted, failed ones are retried
+    with backoff until they run out of attempts and are kept as dead.
+    """
+    class Meta:
+        index_together = ('status', 'runAt')
+
+    PENDING = 'PENDING'
+    DEAD = 'DEAD'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DEAD, 'Dead'),
+    )
+
+    # Dotted path of the function to run and its keyword arguments as JSON
+    name = models.CharField(max_length=256)
+    args = models.TextField(default='{}')
+
+    # Higher priority jobs run first, then whichever has been due longest
+    priority = models.IntegerField(default=0)
+    runAt = models.DateTimeField(default=timezone.now)
+
+    # Seconds a worker holds the job for before others can claim it
+    timeout = models.IntegerField(default=300)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=5)
+    lastError = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.name, self.status)
+
 class LocalCredentials(models.Model):
     """
     Credentials for a remote server to use when requesting things for us.
@@ -36,9 +208,40 @@ class LocalCredentials(models.Model):
     # host we would be using this with)
     description = models.CharField(max_length=256)
 
-    # Password and username a remote server can use with us
+    # Password and username a remote server can use with us. The password is
+    # stored hashed
     username = models.CharField(max_length=64, unique=True)
-    password = models.CharField(max_length=64)
+    password = models.CharField(max_length=128,
+                                help_text='Stored hashed. Enter a new plain '
+                                          'text password to change it.')
+
+    # The url of the server these credentials were given to. Requests made
+    # with them can only ask for its authors (X-Request-User-ID). Blank
+    # allows authors of any other server.
+    host = models.URLField(blank=True, default='',
+                           help_text='Server these credentials were given '
+                                     'to. Blank trusts them for any other '
+                                     'server\'s authors.')
+
+    # Normalized network location of host, '' if there's no host
+    netloc = models.CharField(max_length=255, editable=False, default='')
+
+    def save(self, *args, **kwargs):
+        self.netloc = normalizeNetloc(self.host)
+
+        # Never store plain text, hash anything that isn't already a hash
+        try:
+            identify_hasher(self.password)
+        except ValueError:
+            self.password = make_password(self.password)
+
+        super(LocalCredentials, self).save(*args, **kwargs)
+
+    def checkPassword(self, password):
+        """
+        Check a plain text password against the stored hash.
+        """
+        return check_password(password, self.password)
 
     def __str__(self):
         return self.description
@@ -4,14 +4,24 @@ from django.core.paginator import Paginator, InvalidPage
 from rest_framework.views import APIView
 
 from dash.models import Post
-from .serializers import PostSerializer
-from .verifyUtils import InvalidField
-from .httpUtils import JSONResponse
+from .serializers import PostSerializer, POST_CHUNK_SIZE
+from .verifyUtils import InvalidField, multiPostQueryValidators
+from .dataUtils import validateData, getPostsListData
+from .httpUtils import JSONResponse, JSONStreamingResponse
+from .visibilityUtils import VisibilityChecker, getViewer
 
 class PostsView(APIView):
     """
     This is the get multiple posts view and uses Pagination to display posts.
+    Only listed PUBLIC posts are here, see VisiblePostsView for everything a
+    remote author can see.
     """
+    def getPosts(self, request):
+        """
+        The posts to page through.
+        """
+        return Post.objects.filter(visibility='PUBLIC', unlisted=False)
+
     def get(self, request):
         # Try to pull page number out of GET
         try:
@@ -33,7 +43,7 @@ class PostsView(APIView):
             size = 100
 
         # Get posts and the count
-        posts = Post.objects.exclude(visibility='SERVERONLY')
+        posts = self.getPosts(request)
         count = posts.count()
 
         # Set up the Paginator
@@ -69,11 +79,9 @@ class PostsView(APIView):
         respData = {}
         respData['query'] = 'posts'
         respData['count'] = count
-        respData['size'] = size if size < len(page) else len(page)
-
-        # Now get our data
-        postSer = PostSerializer(page, many=True)
-        respData['posts'] = postSer.data
+        # Count the page without evaluating it so it can be streamed below
+        respData['size'] = page.end_index() - page.start_index() + 1 \
+                           if count else 0
 
         # Build and our next/previous uris
         # Next if one-indexed pageNum isn't already the page count
@@ -92,4 +100,54 @@ class PostsView(APIView):
                                              .format(size, pageNum - 2))
             respData['previous'] = uri
 
-        return JSONResponse(respData, status=200)
+        # Serialize and send the posts one at a time
+        pagePosts = page.object_list.iterator()
+        return JSONStreamingResponse(respData, 'posts', pagePosts,
+                                     PostSerializer,
+                                     chunkSize=POST_CHUNK_SIZE, status=200)
+
+class VisiblePostsView(PostsView):
+    """
+    The posts the requesting author (see visibilityUtils.getViewer) can see.
+    They're filtered in the database so we only send what they can see and
+    their server doesn't need to check with anyone.
+
+    We trust the server asking to say which of its authors it's asking for,
+    they're who it shows the posts to. So the author has to be on the server
+    the request's LocalCredentials were given to (if they name one), and
+    can't be one of ours, those requests are answered as if for nobody (only
+    PUBLIC posts). Friendships are checked with the author's own server.
+    """
+    def getPosts(self, request):
+        checker = VisibilityChecker(getViewer(request))
+        return Post.objects.filter(checker.visibleQuery())
+
+class PostBatchView(APIView):
+    """
+    This gets many posts by id at once.
+    """
+    def post(self, request):
+        """
+        Rather than posting posts to create this is a lookup of a list of post
+        id urls. Posts we don't have (or the requesting author can't see) are
+        left out of the response.
+        """
+        data = getPostsListData(request)
+        validateData(data, multiPostQueryValidators)
+
+        # Remote servers can't see SERVERONLY
+        posts = Post.objects.filter(id__in=data['posts']) \
+                            .exclude(visibility='SERVERONLY')
+        posts = VisibilityChecker(getViewer(request)).filter(posts)
+
+        # Serializing as a list fetches everything in a fixed set of queries
+        postSer = PostSerializer(posts, many=True)
+        postData = postSer.data
+
+        rv = {
+            'query': 'posts',
+            'count': len(postData),
+            'posts': postData
+        }
+
+        return JSONResponse(rv)
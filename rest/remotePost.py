@@ -0,0 +1,88 @@
+# Author: Braedy Kuzma
+import enum
+import uuid
+
+import dateutil.parser
+from django.utils import timezone
+
+class Visibility(enum.Enum):
+    """
+    Who a post is visible to.
+    """
+    PUBLIC = 'PUBLIC'
+    FOAF = 'FOAF'
+    FRIENDS = 'FRIENDS'
+    PRIVATE = 'PRIVATE'
+    SERVERONLY = 'SERVERONLY'
+
+class RemotePost(object):
+    """
+    A post from a remote server, normalized once when it's fetched so nothing
+    downstream has to check for missing fields or parse anything again.
+
+    published is an aware datetime, id is always the post's url and visibility
+    is a Visibility. Image content is only turned into a data url when it's
+    first used.
+    """
+    __slots__ = ('id', 'title', 'description', 'contentType', 'rawContent',
+                 'author', 'categories', 'comments', 'published',
+                 'visibility', 'visibleTo', 'unlisted', 'origin', 'stale')
+
+    def __init__(self, data):
+        """
+        Normalize a post's JSON data. Raises KeyError, TypeError or ValueError
+        if the data isn't a usable post.
+        """
+        self.origin = data.get('origin') or ''
+        self.id = self.canonicalId(data['id'], self.origin)
+        self.title = data.get('title', '')
+        self.description = data.get('description', '')
+        self.contentType = data.get('contentType', 'text/plain')
+        self.rawContent = data.get('content', '')
+        self.author = data['author']
+        self.categories = data.get('categories') or []
+        self.comments = data.get('comments') or []
+        self.visibleTo = data.get('visibleTo') or []
+        self.unlisted = bool(data.get('unlisted', False))
+        self.stale = False
+
+        # Not given, assume PUBLIC
+        self.visibility = Visibility(data.get('visibility') or 'PUBLIC')
+
+        published = dateutil.parser.parse(data['published'])
+        if timezone.is_naive(published):
+            published = timezone.make_aware(published, timezone.utc)
+        self.published = published
+
+    @staticmethod
+    def canonicalId(postId, origin):
+        """
+        Some remotes use the post's uuid as its id, we always use its url.
+        """
+        if not isinstance(postId, str):
+            raise TypeError('Post id must be a string')
+
+        try:
+            uuid.UUID(postId)
+        # If it fails it means it's (probably) a url
+        except ValueError:
+            return postId
+
+        # If it succeeded we want to overwrite it with the url
+        if not origin:
+            raise ValueError('Post {} has no url'.format(postId))
+        if not origin.endswith('/'):
+            origin += '/'
+        return origin
+
+    @property
+    def content(self):
+        """
+        The post's content, images as data urls (some remotes send just the
+        base64).
+        """
+        if 'image' in self.contentType and \
+           not self.rawContent.startswith('data:'):
+            self.rawContent = 'data:{},{}'.format(self.contentType,
+                                                  self.rawContent)
+        return self.rawContent
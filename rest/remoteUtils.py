@@ -0,0 +1,454 @@
+# Author: Braedy Kuzma
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import copy
+import datetime
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+import requests
+
+from .authUtils import getRemoteCredentials
+from .jsonUtils import JSONListReader
+from .logUtils import truncate
+from .models import PeerHealth, normalizeNetloc
+
+logger = logging.getLogger('stream.remote')
+
+# Weight of the newest request in the error rate and latency moving averages
+HEALTH_SMOOTHING = 0.2
+
+class CircuitOpen(requests.RequestException):
+    """
+    Raised instead of making a request to a remote server whose circuit
+    breaker is open.
+    """
+    pass
+
+def allowRequest(creds):
+    """
+    Check the circuit breaker for a remote server.
+
+    Returns True if a request can be made. When the breaker is half open only
+    one process gets to make a probe request, it moves openUntil forward so
+    everyone else keeps skipping the server until the probe finishes.
+    """
+    health, created = PeerHealth.objects.get_or_create(credentials=creds)
+    now = timezone.now()
+    state = health.state(now)
+    if state == 'closed':
+        return True
+    if state == 'open':
+        return False
+
+    openSeconds = getattr(settings, 'CIRCUIT_OPEN_SECONDS', 60)
+    claimed = PeerHealth.objects \
+        .filter(pk=health.pk, openUntil=health.openUntil) \
+        .update(openUntil=now + datetime.timedelta(seconds=openSeconds))
+    if claimed:
+        logger.info('Probing %s', creds.host, extra={'node': creds.host})
+    return claimed == 1
+
+def recordResult(creds, latency, failed):
+    """
+    Update the health of a remote server after a request to it. latency is in
+    milliseconds. Enough consecutive failures (or a failed probe) open the
+    breaker, any success closes it.
+    """
+    now = timezone.now()
+    keep = 1 - HEALTH_SMOOTHING
+    update = {
+        'errorRate': F('errorRate') * keep + (HEALTH_SMOOTHING if failed
+                                              else 0),
+        'latency': F('latency') * keep + HEALTH_SMOOTHING * latency
+    }
+    if failed:
+        update['failures'] = F('failures') + 1
+        update['lastFailure'] = now
+    else:
+        update['failures'] = 0
+        update['openedAt'] = None
+        update['openUntil'] = None
+        update['lastSuccess'] = now
+
+    health = PeerHealth.objects.filter(credentials=creds)
+    health.update(**update)
+    if not failed:
+        return
+
+    # Trip (or re-open after a failed probe) once there are enough failures
+    threshold = getattr(settings, 'CIRCUIT_FAILURE_THRESHOLD', 5)
+    openSeconds = getattr(settings, 'CIRCUIT_OPEN_SECONDS', 60)
+    failing = health.filter(failures__gte=threshold)
+    failing.update(openUntil=now + datetime.timedelta(seconds=openSeconds))
+    if failing.filter(openedAt__isnull=True).update(openedAt=now):
+        logger.warning('Circuit opened for %s', creds.host,
+                       extra={'node': creds.host})
+
+def remoteRequest(method, url, creds, session=None, **kwargs):
+    """
+    Make a request to a remote server using its RemoteCredentials, through its
+    circuit breaker. Connection errors, timeouts and 5xx responses count as
+    failures. Requests time out after settings.REMOTE_TIMEOUT seconds unless a
+    timeout is given. A requests Session can be given to reuse connections.
+
+    Raises CircuitOpen without making the request if the server's breaker is
+    open. Returns the requests Response.
+    """
+    if not allowRequest(creds):
+        raise CircuitOpen('Circuit open for {}'.format(creds.host))
+
+    kwargs.setdefault('auth', (creds.username, creds.password))
+    kwargs.setdefault('timeout', getattr(settings, 'REMOTE_TIMEOUT', 5))
+
+    start = time.monotonic()
+    try:
+        r = (session or requests).request(method, url, **kwargs)
+    except requests.RequestException:
+        recordResult(creds, (time.monotonic() - start) * 1000, True)
+        raise
+
+    recordResult(creds, (time.monotonic() - start) * 1000,
+                 r.status_code >= 500)
+    return r
+
+def remoteGet(url, creds, **kwargs):
+    """
+    GET from a remote server, see remoteRequest.
+    """
+    return remoteRequest('GET', url, creds, **kwargs)
+
+def postJSON(url, data, creds, **kwargs):
+    """
+    POST data as JSON to a remote server using its RemoteCredentials.
+
+    Bodies of at least settings.JSON_GZIP_MIN_LENGTH bytes are gzipped if the
+    remote server accepts gzipped requests. Responses are always negotiated by
+    requests (it sends Accept-Encoding: gzip, deflate and decodes for us).
+
+    Returns the requests Response, raises CircuitOpen if the remote server's
+    circuit breaker is open.
+    """
+    body = JSONRenderer().render(data)
+    headers = {'Content-Type': 'application/json'}
+
+    minLength = getattr(settings, 'JSON_GZIP_MIN_LENGTH', 1024)
+    if creds.gzipRequests and len(body) >= minLength:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    return remoteRequest('POST', url, creds, data=body, headers=headers,
+                         **kwargs)
+
+def groupByCredentials(urls):
+    """
+    Group urls by the RemoteCredentials that should be used for them. Urls we
+    have no credentials for are left out.
+
+    Returns a list of (RemoteCredentials, [url, ...]) tuples.
+    """
+    groups = {}
+    for url in urls:
+        creds = getRemoteCredentials(url)
+        if creds is None:
+            logger.warning('Could not get remote credentials for: %s', url,
+                           extra={'endpoint': url})
+            continue
+        groups.setdefault(creds.pk, (creds, []))[1].append(url)
+
+    return list(groups.values())
+
+# Bytes to read from a streamed remote response at a time
+REMOTE_CHUNK_SIZE = 64 * 1024
+
+# Threads for remote fetches, these can outlive the request that started them
+_executor = ThreadPoolExecutor(getattr(settings, 'REMOTE_FETCH_WORKERS', 16))
+
+# Cache key -> Future of the fetch currently running for it
+_inFlight = {}
+_inFlightLock = threading.Lock()
+
+class Deadline(object):
+    """
+    A latency budget (in seconds) shared by all of the remote work done for one
+    request.
+    """
+    def __init__(self, seconds):
+        self.end = time.monotonic() + seconds
+
+    def remaining(self):
+        """
+        Seconds left in the budget, never negative.
+        """
+        return max(0, self.end - time.monotonic())
+
+def requestKey(method, url, creds):
+    """
+    Key identifying a remote request for de-duplication and caching.
+    """
+    return '{} {} {}'.format(method, url, creds.pk)
+
+class RemoteFetch(object):
+    """
+    Runs fetch (a function returning data, or None on failure) in a background
+    thread. Good data is cached as the last good response for key so callers
+    that can't wait for the fetch can be served that instead. A fetch that
+    misses a caller's deadline keeps running and refreshes the cache when it
+    finishes.
+
+    Identical fetches are collapsed. Data cached less than
+    settings.REMOTE_SHARED_TTL seconds ago (by any process) is used without
+    fetching, and callers in this process share a fetch that's already in
+    flight rather than starting their own.
+
+    Nothing is fetched if the caller's deadline (when given) is already spent
+    and there's cached data to use instead, or if
+    settings.REMOTE_FETCH_MAX_PENDING fetches are already in flight. The
+    cached data (if any) is the result then.
+    """
+    def __init__(self, key, fetch, deadline=None):
+        self.key = 'remote:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.future = None
+
+        # Fresh enough to use as is?
+        cached = caches['remote'].get(self.key)
+        sharedTTL = getattr(settings, 'REMOTE_SHARED_TTL', 5)
+        if cached is not None and time.time() - cached[0] < sharedTTL:
+            self.future = Future()
+            self.future.set_result(cached[1])
+            return
+
+        # No time left to wait for it, the last good data will do
+        if deadline is not None and not deadline.remaining() and \
+           cached is not None:
+            return
+
+        # Join the fetch in flight or start one if there's room
+        maxPending = getattr(settings, 'REMOTE_FETCH_MAX_PENDING', 64)
+        with _inFlightLock:
+            self.future = _inFlight.get(self.key)
+            if self.future is None and len(_inFlight) < maxPending:
+                self.future = _executor.submit(self.run, fetch)
+                _inFlight[self.key] = self.future
+
+    def run(self, fetch):
+        try:
+            data = fetch()
+            if data is not None:
+                caches['remote'].set(self.key, (time.time(), data),
+                                getattr(settings, 'REMOTE_STALE_TIMEOUT',
+                                        86400))
+            return data
+        except Exception:
+            logger.exception('Remote fetch failed')
+            return None
+        finally:
+            # Later callers fetch again (the result is in the cache now)
+            with _inFlightLock:
+                _inFlight.pop(self.key, None)
+
+            # Nothing else closes connections opened in this thread (e.g. for
+            # circuit breaker updates)
+            connections.close_all()
+
+    def result(self, deadline):
+        """
+        Wait for the fetch until deadline.
+
+        Returns a tuple of (data, stale). If the fetch failed or didn't finish
+        in time data is the last good cached data (None if there is none) and
+        stale is True. Data is always the caller's own copy.
+        """
+        data = None
+        if self.future is not None:
+            try:
+                data = self.future.result(timeout=deadline.remaining())
+            except TimeoutError:
+                pass
+
+        if data is not None:
+            return (copy.deepcopy(data), False)
+
+        cached = caches['remote'].get(self.key)
+        return (cached and cached[1], True)
+
+def iterRemotePosts(url, creds, deadline, maxPages=None, headers=None,
+                    **kwargs):
+    """
+    Lazily iterate over the posts of a paginated remote post list (e.g.
+    host/posts/), following its next links. Responses are streamed and parsed
+    incrementally, posts are yielded as they arrive and the next page is only
+    requested once the current one is used up, so stopping early (e.g. with
+    itertools.islice) doesn't download the rest.
+
+    Memory is bounded: only settings.REMOTE_MAX_BYTES of each page are read
+    and posts over settings.REMOTE_MAX_POST_BYTES are skipped.
+
+    No new page is started after deadline or once maxPages (default
+    settings.REMOTE_MAX_PAGES) pages have been read. headers are sent with
+    every page, other kwargs are passed to the first request only since next
+    links are complete urls. Next links are resolved against the page they're
+    on and only followed on creds' server, since our credentials (and
+    headers) go with them.
+
+    Errors before any post has been yielded are raised (bad responses as
+    requests.HTTPError), later errors just end the iteration.
+    """
+    if maxPages is None:
+        maxPages = getattr(settings, 'REMOTE_MAX_PAGES', 5)
+    maxBytes = getattr(settings, 'REMOTE_MAX_BYTES', 8 * 1024 * 1024)
+    maxPostBytes = getattr(settings, 'REMOTE_MAX_POST_BYTES', 2 * 1024 * 1024)
+
+    pages = 0
+    yielded = 0
+    while url is not None and pages < maxPages:
+        if pages != 0 and deadline.remaining() == 0:
+            logger.info('Out of time paginating %s', url,
+                        extra={'node': creds.host, 'endpoint': url})
+            return
+
+        reader = JSONListReader('posts', maxPostBytes)
+        r = None
+        try:
+            r = remoteGet(url, creds, stream=True, headers=headers, **kwargs)
+            try:
+                if r.status_code != 200:
+                    raise requests.HTTPError('Got status code {} from {}'
+                                             .format(r.status_code, url),
+                                             response=r)
+
+                received = 0
+                for chunk in r.iter_content(REMOTE_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > maxBytes:
+                        logger.warning('Stopped reading %s after %s bytes',
+                                       url, maxBytes,
+                                       extra={'node': creds.host,
+                                              'endpoint': url})
+                        break
+
+                    for post in reader.feed(chunk):
+                        yielded += 1
+                        yield post
+            finally:
+                r.close()
+
+            if not reader.foundList:
+                raise ValueError('No post list')
+        except (requests.RequestException, ValueError) as e:
+            if yielded != 0:
+                logger.warning('Stopped paginating %s: %s', url, e,
+                               extra={'node': creds.host, 'endpoint': url})
+                return
+            if isinstance(e, ValueError):
+                raise requests.HTTPError('Bad post list from {}: {}'
+                                         .format(url, e), response=r)
+            raise
+
+        if reader.skipped:
+            logger.warning('Skipped %s posts over %s bytes from %s',
+                           reader.skipped, maxPostBytes, url,
+                           extra={'node': creds.host, 'endpoint': url})
+
+        pages += 1
+        kwargs = {}
+        nextUrl = reader.envelope.get('next')
+        if not isinstance(nextUrl, str) or not nextUrl:
+            return
+
+        nextUrl = urljoin(url, nextUrl)
+        if normalizeNetloc(nextUrl) != creds.netloc:
+            logger.warning('Not following next link %s off %s', nextUrl,
+                           creds.host,
+                           extra={'node': creds.host, 'endpoint': url})
+            return
+        url = nextUrl
+
+def getRemoteAuthor(creds, authorId):
+    """
+    GET a single author from a remote server.
+    Returns the author data or None if it couldn't be fetched.
+    """
+    try:
+        r = remoteGet(authorId, creds)
+    except requests.RequestException as e:
+        logger.warning('Error getting remote author %s: %s', authorId, e,
+                       extra={'node': creds.host, 'endpoint': authorId})
+        return None
+
+    if r.status_code != 200:
+        logger.warning('Got status code %s while requesting author %s',
+                       r.status_code, authorId,
+                       extra={'node': creds.host, 'endpoint': authorId,
+                              'status': r.status_code,
+                              'body': truncate(r.text)})
+        return None
+
+    try:
+        return r.json()
+    except ValueError:
+        logger.warning('Could not parse JSON from author request: %s',
+                       authorId, extra={'node': creds.host,
+                                        'endpoint': authorId,
+                                        'body': truncate(r.text)})
+        return None
+
+def getRemoteAuthorsBatch(creds, authorIds):
+    """
+    Look up many authors on one remote server with a POST to authors/.
+    Returns a dict of author id -> author data for the authors it returned.
+    """
+    data = {
+        'query': 'authors',
+        'authors': authorIds
+    }
+    try:
+        r = postJSON(creds.host + 'authors/', data, creds)
+    except requests.RequestException as e:
+        logger.warning('Error batch requesting authors from %s: %s',
+                       creds.host, e, extra={'node': creds.host})
+        return {}
+
+    if r.status_code != 200:
+        logger.warning('Got status code %s while batch requesting authors '
+                       'from %s', r.status_code, creds.host,
+                       extra={'node': creds.host, 'status': r.status_code,
+                              'body': truncate(r.text)})
+        return {}
+
+    try:
+        return {author['id']: author for author in r.json()['authors']}
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Could not parse batch author response from %s',
+                       creds.host, extra={'node': creds.host,
+                                          'body': truncate(r.text)})
+        return {}
+
+def getRemoteAuthors(authorIds):
+    """
+    Fetch author profiles from remote servers. Servers that support batch
+    lookups (RemoteCredentials.batchAuthors) get one request for all of their
+    authors, others get one request per author.
+
+    Returns a dict of author id -> author data for the authors that were found.
+    """
+    authors = {}
+    for creds, ids in groupByCredentials(authorIds):
+        if creds.batchAuthors:
+            authors.update(getRemoteAuthorsBatch(creds, ids))
+        else:
+            for authorId in ids:
+                author = getRemoteAuthor(creds, authorId)
+                if author is not None:
+                    authors[authorId] = author
+
+    return authors
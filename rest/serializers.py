@@ -1,65 +1,102 @@
 # Author: Braedy Kuzma
-
+import logging
+from collections import defaultdict
 from urllib.parse import urlsplit, urlunsplit
 
-from django.core.paginator import Paginator
+from django.db import models
+from django.db.models import Count, prefetch_related_objects
 from rest_framework import serializers
-import requests
 
 from dash.models import Post, Author, Comment, Category, CanSee, \
                         RemoteCommentAuthor
 from .models import RemoteCredentials
-from .authUtils import getRemoteCredentials
+from .remoteUtils import getRemoteAuthors
+
+logger = logging.getLogger('stream.serializers')
+
+# How many comments are sent with each post by default
+COMMENT_PAGE_SIZE = 50
+
+# How many posts streamed lists serialize (and prefetch for) together
+POST_CHUNK_SIZE = 25
+
+class FollowListSerializer(serializers.ListSerializer):
+    """
+    Serializes many follows at once. Local friends are fetched in one query and
+    remote friends are fetched together (batched per server where supported)
+    rather than one request per follow.
+    """
+    def to_representation(self, data):
+        follows = data.all() if isinstance(data, models.Manager) else data
+        follows = list(follows)
+        friendIds = [follow.friend for follow in follows]
+
+        localAuthors = Author.objects.filter(id__in=friendIds) \
+                                     .select_related('user')
+        localAuthors = {author.id: author for author in localAuthors}
+        remoteIds = [i for i in friendIds if i not in localAuthors]
+        remoteAuthors = getRemoteAuthors(remoteIds)
+
+        return [self.child.followData(follow, localAuthors, remoteAuthors)
+                for follow in follows]
 
 class FollowSerializer(serializers.BaseSerializer):
+    class Meta:
+        list_serializer_class = FollowListSerializer
+
     def to_representation(self, follow):
-        data = {}
         try:
             author = Author.objects.get(id=follow.friend)
+        except Author.DoesNotExist:
+            localAuthors = {}
+            remoteAuthors = getRemoteAuthors([follow.friend])
+        else:
+            localAuthors = {author.id: author}
+            remoteAuthors = {}
+
+        return self.followData(follow, localAuthors, remoteAuthors)
+
+    def followData(self, follow, localAuthors, remoteAuthors):
+        """
+        Build the representation of a follow from already fetched local Authors
+        and remote author data (both dicts keyed by author id).
+        """
+        data = {}
+        if follow.friend in localAuthors:
+            author = localAuthors[follow.friend]
             data['id'] = author.id
             data['host'] = author.host
             data['displayName'] = author.user.get_username()
             data['url'] = author.id
-        except Author.DoesNotExist:
-            # Build the fallback host
-            split = urlsplit(follow.friend)
-            split = (split.scheme, split.netloc, '', '', '')
-            url = urlunsplit(split) + '/'
-
-            # Set everything up with values, if we can successfully get a user
-            # from remote then we'll update
-            followId = follow.friend
-            data['id'] = followId
-            data['host'] = url
-            data['displayName'] = 'UnkownRemoteUser'
-            data['url'] = followId
-
-            remoteCreds = getRemoteCredentials(followId)
-            if remoteCreds != None:
-                req = requests.get(followId, auth=(remoteCreds.username,
-                                                   remoteCreds.password))
-                if req.status_code == 200:
-                   try:
-                       # Try to parse JSON out
-                       reqData = req.json()
-
-                       # We could just pass along everything, but the spec
-                       # says pick and choose these
-                       data['id'] = reqData['id']
-                       data['host'] = reqData['host']
-                       data['displayName'] = reqData['displayName']
-                       data['url'] = reqData['url']
-                   # Couldn't parse json, just give up
-                   except ValueError:
-                       print('Could not parse JSON from author follow request')
-                else:
-                    print(('Got status code {} while requesting follow user. ' \
-                           'Using "{}" for {}.') \
-                          .format(req.status_code, remoteCreds, followId))
-                    print('TEXT\n', req.text)
-            else:
-                print('Could not get remote credentials for follow id: {}' \
-                      .format(followId))
+            return data
+
+        # Build the fallback host
+        split = urlsplit(follow.friend)
+        split = (split.scheme, split.netloc, '', '', '')
+        url = urlunsplit(split) + '/'
+
+        # Set everything up with values, if we successfully got a user from
+        # remote then we'll update
+        followId = follow.friend
+        data['id'] = followId
+        data['host'] = url
+        data['displayName'] = 'UnkownRemoteUser'
+        data['url'] = followId
+
+        if followId in remoteAuthors:
+            reqData = remoteAuthors[followId]
+            try:
+                # We could just pass along everything, but the spec says pick
+                # and choose these
+                data['id'] = reqData['id']
+                data['host'] = reqData['host']
+                data['displayName'] = reqData['displayName']
+                data['url'] = reqData['url']
+            except (KeyError, TypeError):
+                logger.warning('Remote author data missing fields for follow '
+                               'id: %s', followId)
+
+        return data
 
 class AuthorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -80,10 +117,51 @@ class AuthorSerializer(serializers.ModelSerializer):
 
         return rv
 
+def commentAuthorsData(authorIds):
+    """
+    Build AuthorFromIdSerializer data for many comment authors at once, using
+    one query for local authors and one for remote ones.
+
+    Returns a dict of author id -> author data for the authors that were found.
+    """
+    authorIds = set(authorIds)
+    authors = {}
+
+    localAuthors = Author.objects.filter(id__in=authorIds) \
+                                 .select_related('user')
+    for author in localAuthors:
+        authors[author.id] = {
+            'id': author.id,
+            'host': author.host,
+            'displayName': author.user.get_username(),
+            'url': author.url,
+            'github': author.github
+        }
+
+    remoteIds = authorIds.difference(authors)
+    if remoteIds:
+        remoteAuthors = RemoteCommentAuthor.objects \
+                                           .filter(authorId__in=remoteIds)
+        for author in remoteAuthors:
+            authors[author.authorId] = {
+                'id': author.authorId,
+                'host': author.host,
+                'displayName': author.displayName,
+                'url': author.authorId,
+                'github': author.github
+            }
+
+    return authors
+
 class AuthorFromIdSerializer(serializers.BaseSerializer):
     def to_representation(self, authorId):
+        # Use the authors that were looked up in bulk if we have them
+        commentAuthors = self.context.get('commentAuthors', {})
+        if authorId in commentAuthors:
+            return commentAuthors[authorId]
+
         data = {}
-        print('AUTHOR FROM ID REP', authorId)
+        logger.debug('Looking up comment author %s', authorId)
         try:
             author = Author.objects.get(id=authorId)
             data['id'] = author.id
@@ -102,9 +180,8 @@ class AuthorFromIdSerializer(serializers.BaseSerializer):
                 data['github'] = author.github
             # We couldn't find a remote author either?!
             except RemoteCommentAuthor.DoesNotExist:
-                # Print some reasonable debug and blow up
-                print('Could not get remote credentials for author id: {}' \
-                      .format(authorId))
+                # Log some reasonable debug and blow up
+                logger.error('Could not find comment author: %s', authorId)
                 raise
 
         return data
@@ -117,15 +194,81 @@ class CanSeeSerializer(serializers.BaseSerializer):
     def to_representation(self, canSee):
         return canSee.visibleTo
 
+def prefetchPosts(posts, commentPageSize=COMMENT_PAGE_SIZE):
+    """
+    Fetch everything PostSerializer needs for a list of posts in a fixed number
+    of queries, plus one for each post with more than a page of comments.
+    Comments are counted in the database and only the first page of each
+    post's is fetched, as its firstComments (commentCount is the count).
+
+    Returns a dict of comment author id -> author data for those comments.
+    """
+    prefetch_related_objects(posts, 'author__user', 'category_set',
+                             'cansee_set')
+
+    postIds = [post.id for post in posts]
+    counts = dict(Comment.objects.filter(post__in=postIds)
+                                 .order_by()
+                                 .values_list('post')
+                                 .annotate(Count('id')))
+
+    # Posts with a page or less of comments get them all in one query, the
+    # rest one query each for their first page
+    comments = defaultdict(list)
+    small = [postId for postId, count in counts.items()
+             if count <= commentPageSize]
+    if small:
+        for comment in Comment.objects.filter(post__in=small):
+            comments[comment.post_id].append(comment)
+    for postId, count in counts.items():
+        if count > commentPageSize:
+            comments[postId] = list(Comment.objects
+                                           .filter(post=postId)
+                                           [:commentPageSize])
+
+    for post in posts:
+        post.commentCount = counts.get(post.id, 0)
+        post.firstComments = comments.get(post.id, [])
+
+    authorIds = [comment.author
+                 for postComments in comments.values()
+                 for comment in postComments]
+    return commentAuthorsData(authorIds)
+
+class PostListSerializer(serializers.ListSerializer):
+    """
+    Serializes many posts at once with one set of queries for all of them.
+    """
+    def to_representation(self, data):
+        posts = data.all() if isinstance(data, models.Manager) else data
+        posts = list(posts)
+        commentAuthors = prefetchPosts(posts,
+                                       self.context.get('commentPageSize',
+                                                        COMMENT_PAGE_SIZE))
+
+        return [self.child.postData(post, commentAuthors) for post in posts]
+
 class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = '__all__'
+        list_serializer_class = PostListSerializer
     author = AuthorSerializer()
 
     def to_representation(self, post):
+        commentAuthors = prefetchPosts([post],
+                                       self.context.get('commentPageSize',
+                                                        COMMENT_PAGE_SIZE))
+        return self.postData(post, commentAuthors)
+
+    def postData(self, post, commentAuthors):
+        """
+        Serialize a post whose related objects have already been prefetched
+        (see prefetchPosts). commentAuthors is a dict of comment author id ->
+        author data.
+        """
         rv = serializers.ModelSerializer.to_representation(self, post)
-        categories = Category.objects.filter(post=post)
+        categories = post.category_set.all()
         catSer = CategorySerializer(categories, many=True)
         rv['categories'] = catSer.data
 
@@ -133,22 +276,18 @@ class PostSerializer(serializers.ModelSerializer):
         rv['source'] = rv['id']
         rv['origin'] = rv['id']
 
-        # Get comments and add count to rv
-        comments = Comment.objects.filter(post=post)
-        count = comments.count()
-        rv['count'] = count
-
-        # Get number of comments to attach and add to rv
-        pageSize = self.context.get('commentPageSize', 50)
-        rv['size'] = pageSize if count > pageSize else count
+        # Add the comment count and how many are attached to rv
+        rv['count'] = post.commentCount
+        rv['size'] = len(post.firstComments)
 
         # Serialize and attach the first page
-        pager = Paginator(comments, pageSize)
-        commSer = CommentSerializer(pager.page(1), many=True)
+        context = {'commentAuthors': commentAuthors}
+        commSer = CommentSerializer(post.firstComments, many=True,
+                                    context=context)
         rv['comments'] = commSer.data
 
         # Serialize and attach list of visibileTo
-        canSees = CanSee.objects.filter(post=post)
+        canSees = post.cansee_set.all()
         canSer = CanSeeSerializer(canSees, many=True)
         rv['visibleTo'] = canSer.data
 
@@ -160,3 +299,21 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ('author', 'comment', 'contentType', 'published', 'id')
 
     author = AuthorFromIdSerializer()
+
+class PostExportSerializer(serializers.ModelSerializer):
+    """
+    Flat post representation used for bulk export. The author is just their id
+    and comments are just their ids. Categories, visibleTos and comments are
+    looked up in the context (built for a chunk of posts at once) rather than
+    queried for every post.
+    """
+    class Meta:
+        model = Post
+        fields = '__all__'
+
+    def to_representation(self, post):
+        rv = serializers.ModelSerializer.to_representation(self, post)
+        rv['categories'] = self.context['categories'].get(post.id, [])
+        rv['visibleTo'] = self.context['visibleTo'].get(post.id, [])
+        rv['comments'] = self.context['comments'].get(post.id, [])
+        return rv
@@ -4,9 +4,11 @@ from rest_framework.views import APIView
 
 from dash.models import Post, Author, Category, CanSee
 from .serializers import PostSerializer
-from .verifyUtils import postValidators, NotFound, ResourceConflict
+from .verifyUtils import postValidators, NotFound, ResourceConflict, \
+                         NotVisible
 from .dataUtils import validateData, pidToUrl, getPostData, getPost
 from .httpUtils import JSONResponse
+from .visibilityUtils import VisibilityChecker, getViewer
 
 class PostView(APIView):
     """
@@ -36,6 +38,10 @@ class PostView(APIView):
         # Get post
         post = getPost(request, pid)
 
+        # Make sure whoever is asking is allowed to see it
+        if not VisibilityChecker(getViewer(request)).canSee(post):
+            raise NotVisible('Access denied: post is not visible to you')
+
         # Serialize post
         postSer = PostSerializer(post)
         postData = postSer.data
@@ -1,3 +1,1256 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+import gzip
+import io
+import json
+import copy
+import datetime
+import logging
+import pickle
+import tempfile
+import threading
+import uuid
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import caches
+from django.utils import timezone
+import requests
+
+from dash.models import Author, Post, Category, Comment, Follow, \
+                        RemoteCommentAuthor, CanSee
+from dash.graphUtils import friendGraph, resetFriendGraph
+from dash.idUtils import canonicalId
+from .models import LocalCredentials, RemoteCredentials, PeerHealth, \
+                    OutboundDelivery, Job
+from .authUtils import createBasicAuthToken, getRemoteCredentials, \
+                       ResultCache
+from .commentView import saveComments
+from .digestUtils import BloomFilter, digestVersion, MAX_DIGEST_BITS, \
+                         MAX_DIGEST_HASHES
+from .deliveryUtils import enqueueDelivery, deliverPending
+from .jobUtils import enqueueJob, claimJob, runNextJob
+from .jsonUtils import JSONListReader
+from .logUtils import truncate, StructuredFormatter, SampleFilter, \
+                       BackgroundHandler
+from .remotePost import RemotePost, Visibility
+from .remoteUtils import remoteGet, CircuitOpen, Deadline, RemoteFetch, \
+                         iterRemotePosts
+from .visibilityUtils import isLocalHost
 
 # Create your tests here.
+
+# Calls made by test jobs
+jobCalls = []
+
+def recordJob(value):
+    jobCalls.append(value)
+
+def failingJob():
+    raise RuntimeError('job failed')
+
+class RestViewTests(TestCase):
+    def setUp(self):
+        # The friend graph only hears about committed Follow changes and
+        # tests never commit, so build it from this test's Follows
+        resetFriendGraph()
+
+        self.userCount = 0
+        self.postCount = 0
+
+        # Credentials a remote node would use with us
+        creds = LocalCredentials()
+        creds.description = 'test node'
+        creds.username = 'node'
+        creds.password = 'nodepass'
+        creds.save()
+
+        token = createBasicAuthToken('node', 'nodepass')
+        self.auth = {'HTTP_AUTHORIZATION': 'Basic ' + token.decode('utf-8')}
+
+        self.user = self.createUser()
+
+    def createUser(self, host='http://testserver/'):
+        username = 'user{}'.format(self.userCount)
+
+        user = User()
+        user.username = username
+        user.set_password('pass{}'.format(self.userCount))
+        user.is_active = True
+        user.save()
+
+        author = Author()
+        author.user = user
+        author.host = host
+        author.id = author.host + 'author/' + uuid.uuid4().hex + '/'
+        author.url = author.id
+        author.save()
+
+        # Increment user count
+        self.userCount += 1
+
+        return user
+
+    def createPost(self, author, **kwargs):
+        post = Post()
+        post.id = 'http://testserver/posts/' + uuid.uuid4().hex + '/'
+        post.author = author
+        post.title = 'Test {}'.format(self.postCount)
+        post.description = 'Test'
+        post.contentType = 'text/plain'
+        post.content = 'Test'
+        for key, value in kwargs.items():
+            setattr(post, key, value)
+        post.save()
+
+        # Increment post count
+        self.postCount += 1
+
+        return post
+
+    def getJSON(self, response):
+        """
+        Read JSON out of a normal or streaming response.
+        """
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return json.loads(content.decode('utf-8'))
+
+    def test_posts_requires_auth(self):
+        response = self.client.get('/posts/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_credentials_hashed(self):
+        creds = LocalCredentials.objects.get(username='node')
+        self.assertNotEqual(creds.password, 'nodepass')
+        self.assertTrue(creds.checkPassword('nodepass'))
+
+    def test_credentials_check_cached(self):
+        response = self.client.get('/posts/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        # Credentials are only checked once, not on every request
+        with self.assertNumQueries(2):
+            self.client.get('/posts/', **self.auth)
+
+        # Wrong passwords fail
+        token = createBasicAuthToken('node', 'wrong').decode('utf-8')
+        response = self.client.get('/posts/',
+                                   HTTP_AUTHORIZATION='Basic ' + token)
+        self.assertEqual(response.status_code, 401)
+
+        # Changing credentials forgets the cached check
+        creds = LocalCredentials.objects.get(username='node')
+        creds.password = 'newpass'
+        creds.save()
+        response = self.client.get('/posts/', **self.auth)
+        self.assertEqual(response.status_code, 401)
+
+    def test_posts_streamed_page(self):
+        for i in range(3):
+            self.createPost(self.user.author)
+        self.createPost(self.user.author, visibility='SERVERONLY')
+
+        response = self.client.get('/posts/?size=2', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        data = self.getJSON(response)
+        self.assertEqual(data['query'], 'posts')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['size'], 2)
+        self.assertEqual(len(data['posts']), 2)
+        self.assertIn('next', data)
+        self.assertNotIn('previous', data)
+
+        # Last page only has the leftover post
+        data = self.getJSON(self.client.get('/posts/?size=2&page=1',
+                                            **self.auth))
+        self.assertEqual(data['size'], 1)
+        self.assertEqual(len(data['posts']), 1)
+        self.assertIn('previous', data)
+
+    def test_posts_streamed_empty(self):
+        data = self.getJSON(self.client.get('/posts/', **self.auth))
+        self.assertEqual(data['count'], 0)
+        self.assertEqual(data['size'], 0)
+        self.assertEqual(data['posts'], [])
+
+    def test_posts_streamed_comments(self):
+        def comment(post):
+            Comment.objects.create(post=post, author=self.user.author.id,
+                                   comment='Test', contentType='text/plain')
+
+        busy = self.createPost(self.user.author)
+        for i in range(55):
+            comment(busy)
+        for i in range(2):
+            comment(self.createPost(self.user.author))
+
+        def getPosts():
+            response = self.client.get('/posts/', **self.auth)
+            return self.getJSON(response)
+
+        # Only the first page of comments is sent, but all are counted
+        posts = {post['id']: post for post in getPosts()['posts']}
+        self.assertEqual(posts[busy.id]['count'], 55)
+        self.assertEqual(posts[busy.id]['size'], 50)
+        self.assertEqual(len(posts[busy.id]['comments']), 50)
+        self.assertEqual(len(posts), 3)
+
+        # More posts on the page don't mean more queries
+        with CaptureQueriesContext(connection) as before:
+            getPosts()
+        for i in range(3):
+            comment(self.createPost(self.user.author))
+        with CaptureQueriesContext(connection) as after:
+            self.assertEqual(getPosts()['size'], 6)
+        self.assertEqual(len(after), len(before))
+
+    def test_export_posts(self):
+        post = self.createPost(self.user.author)
+        for visibility in ('SERVERONLY', 'FRIENDS', 'FOAF', 'PRIVATE'):
+            self.createPost(self.user.author, visibility=visibility)
+        Category.objects.create(post=post, category='test')
+        comment = Comment.objects.create(post=post,
+                                         author=self.user.author.id,
+                                         comment='Test',
+                                         contentType='text/plain')
+
+        response = self.client.get('/export/posts.ndjson', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).splitlines()
+
+        # Only what the (anonymous) requester can see is exported
+        self.assertEqual(len(lines), 1)
+        data = json.loads(lines[0].decode('utf-8'))
+        self.assertEqual(data['id'], post.id)
+        self.assertEqual(data['author'], self.user.author.id)
+        self.assertEqual(data['categories'], ['test'])
+        self.assertEqual(data['comments'], [str(comment.id)])
+
+    def test_export_import_round_trip(self):
+        post = self.createPost(self.user.author, visibility='PRIVATE')
+        Category.objects.create(post=post, category='test')
+        self.createPost(self.user.author)
+
+        # Exported for someone who can see the PRIVATE post
+        viewer = 'http://remote.example.com/author/1/'
+        CanSee.objects.create(post=post, visibleTo=viewer)
+        response = self.client.get('/export/posts.ndjson',
+                                   HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_X_REQUEST_USER_ID=viewer, **self.auth)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        exported = b''.join(response.streaming_content)
+
+        Post.objects.all().delete()
+
+        with tempfile.NamedTemporaryFile(suffix='.ndjson.gz') as f:
+            f.write(exported)
+            f.flush()
+            call_command('importposts', f.name, stdout=io.StringIO())
+
+        self.assertEqual(Post.objects.count(), 2)
+        post = Post.objects.get(id=post.id)
+        self.assertEqual(post.visibility, 'PRIVATE')
+        self.assertEqual(list(post.category_set.values_list('category',
+                                                            flat=True)),
+                         ['test'])
+
+    def test_json_responses_gzipped(self):
+        for i in range(10):
+            self.createPost(self.user.author, content='Test ' * 100)
+
+        response = self.client.get('/posts/', HTTP_ACCEPT_ENCODING='gzip',
+                                   **self.auth)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        data = json.loads(content.decode('utf-8'))
+        self.assertEqual(len(data['posts']), 10)
+
+        # Small responses aren't worth compressing
+        aid = self.user.author.id.split('/')[-2]
+        response = self.client.get('/author/{}/friends/'.format(aid),
+                                   HTTP_ACCEPT_ENCODING='gzip', **self.auth)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_gzipped_request_body(self):
+        # The URL validator won't accept testserver as a host
+        user = self.createUser('http://localhost/')
+        aid = user.author.id.split('/')[-2]
+        data = {
+            'query': 'friends',
+            'author': user.author.id,
+            'authors': ['http://remote.example.com/author/1/']
+        }
+        body = gzip.compress(json.dumps(data).encode('utf-8'))
+
+        response = self.client.post('/author/{}/friends/'.format(aid), body,
+                                    content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip',
+                                    HTTP_HOST='localhost', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getJSON(response)['friends'], [])
+
+    def test_batch_authors(self):
+        # The URL validator won't accept testserver as a host
+        users = [self.createUser('http://localhost/') for i in range(3)]
+        ids = [user.author.id for user in users[:2]]
+        ids.append('http://localhost/author/{}/'.format(uuid.uuid4().hex))
+
+        data = {'query': 'authors', 'authors': ids}
+        response = self.client.post('/authors/', json.dumps(data),
+                                    content_type='application/json',
+                                    HTTP_HOST='localhost', **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        # Missing authors are left out
+        authors = self.getJSON(response)['authors']
+        self.assertEqual(sorted(author['id'] for author in authors),
+                         sorted(ids[:2]))
+        for author in authors:
+            self.assertIn('displayName', author)
+            self.assertNotIn('friends', author)
+
+    def test_author_friends(self):
+        friend = self.createUser()
+        Follow.objects.create(author=self.user.author, friend=friend.author.id,
+                              friendDisplayName=friend.username)
+
+        aid = self.user.author.id.split('/')[-2]
+        response = self.client.get('/author/{}/'.format(aid), **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        friends = self.getJSON(response)['friends']
+        self.assertEqual(len(friends), 1)
+        self.assertEqual(friends[0]['id'], friend.author.id)
+        self.assertEqual(friends[0]['displayName'], friend.username)
+
+    def test_friends_digest(self):
+        friends = ['http://remote.example.com/author/{}/'.format(i)
+                   for i in range(50)]
+        for friend in friends:
+            Follow.objects.create(author=self.user.author, friend=friend)
+
+        url = '/author/{}/friends/digest/'.format(
+            self.user.author.id.split('/')[-2])
+        response = self.client.get(url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        # Of canonical ids
+        data = self.getJSON(response)
+        keys = [canonicalId(friend) for friend in friends]
+        self.assertEqual(data['version'], digestVersion(keys))
+        self.assertEqual(data['count'], 50)
+        digest = BloomFilter.fromData(data)
+        for key in keys:
+            self.assertIn(key, digest)
+
+        # Unchanged digests aren't sent again
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                   **self.auth)
+        self.assertEqual(response.status_code, 304)
+
+        # Or built again
+        with mock.patch('rest.authorFriendsView.BloomFilter.build') as build:
+            response = self.client.get(url, **self.auth)
+        self.assertEqual(self.getJSON(response), data)
+        self.assertFalse(build.called)
+
+    def test_is_friends_either_scheme(self):
+        friend = 'https://remote.example.com/author/1/'
+        Follow.objects.create(author=self.user.author, friend=friend)
+
+        aid = self.user.author.id.split('/')[-2]
+        url = '/author/{}/friends/remote.example.com/author/1/'.format(aid)
+        # Credentials, the author and one Follow lookup for either scheme
+        with self.assertNumQueries(3):
+            response = self.client.get(url, **self.auth)
+        data = self.getJSON(response)
+        self.assertTrue(data['friends'])
+        self.assertEqual(data['authors'], [self.user.author.id, friend])
+
+    def batchPosts(self, ids, **headers):
+        data = {'query': 'posts', 'posts': ids}
+        headers.update(self.auth)
+        return self.client.post('/posts/batch/', json.dumps(data),
+                                content_type='application/json', **headers)
+
+    def test_batch_posts(self):
+        posts = []
+        for i in range(5):
+            # The URL validator won't accept testserver as a host
+            post = self.createPost(self.user.author, id='http://localhost/' \
+                                   'posts/{}/'.format(uuid.uuid4().hex))
+            Category.objects.create(post=post, category='test')
+            Comment.objects.create(post=post, author=self.user.author.id,
+                                   comment='Test', contentType='text/plain')
+            posts.append(post)
+        posts[0].visibility = 'SERVERONLY'
+        posts[0].save()
+
+        ids = [post.id for post in posts]
+        response = self.batchPosts(ids)
+        self.assertEqual(response.status_code, 200)
+
+        # SERVERONLY is left out
+        data = self.getJSON(response)
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(sorted(post['id'] for post in data['posts']),
+                         sorted(ids[1:]))
+        for post in data['posts']:
+            self.assertEqual(post['categories'], ['test'])
+            self.assertEqual(len(post['comments']), 1)
+            self.assertEqual(post['comments'][0]['author']['id'],
+                             self.user.author.id)
+
+        # The number of queries doesn't depend on the number of posts
+        with self.assertNumQueries(8):
+            self.batchPosts(ids[:2])
+        with self.assertNumQueries(8):
+            self.batchPosts(ids)
+
+    def test_bulk_comments(self):
+        # The URL validator won't accept testserver as a host
+        pid = uuid.uuid4().hex
+        post = self.createPost(self.user.author,
+                               id='http://localhost/posts/{}/'.format(pid))
+        existing = Comment.objects.create(post=post,
+                                          author=self.user.author.id,
+                                          comment='Test',
+                                          contentType='text/plain')
+        RemoteCommentAuthor.objects.create(
+            authorId='http://remote.example.com/author/2/',
+            host='http://remote.example.com/', displayName='old')
+
+        def commentData(authorId, commentId=None):
+            return {
+                'author': {
+                    'id': authorId,
+                    'host': 'http://remote.example.com/',
+                    'displayName': 'remote'
+                },
+                'comment': 'Test',
+                'contentType': 'text/plain',
+                'published': '2017-04-01T00:00:00Z',
+                'id': commentId or str(uuid.uuid4())
+            }
+
+        comments = [
+            commentData('http://remote.example.com/author/1/'),
+            commentData('http://remote.example.com/author/2/'),
+            commentData('http://remote.example.com/author/1/',
+                        str(existing.id)),
+            {'comment': 'Missing everything'}
+        ]
+        data = {'query': 'addComments', 'post': post.id, 'comments': comments}
+        response = self.client.post('/posts/{}/comments/bulk/'.format(pid),
+                                    json.dumps(data),
+                                    content_type='application/json',
+                                    HTTP_HOST='localhost', **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        data = self.getJSON(response)
+        self.assertFalse(data['success'])
+        statuses = [status['status'] for status in data['comments']]
+        self.assertEqual(statuses, [201, 201, 409, 422])
+
+        self.assertEqual(Comment.objects.filter(post=post).count(), 3)
+        self.assertEqual(RemoteCommentAuthor.objects.count(), 2)
+
+        # Existing remote authors are updated
+        author = RemoteCommentAuthor.objects \
+                                    .get(authorId=comments[1]['author']['id'])
+        self.assertEqual(author.displayName, 'remote')
+
+    def test_bulk_comments_race(self):
+        pid = uuid.uuid4().hex
+        post = self.createPost(self.user.author,
+                               id='http://localhost/posts/{}/'.format(pid))
+        ids = [str(uuid.uuid4()) for i in range(2)]
+        comments = [{
+            'author': {
+                'id': 'http://remote.example.com/author/1/',
+                'host': 'http://remote.example.com/',
+                'displayName': 'remote'
+            },
+            'comment': 'Test',
+            'contentType': 'text/plain',
+            'published': '2017-04-01T00:00:00Z',
+            'id': commentId
+        } for commentId in ids]
+
+        # Another batch saves the first comment and its author between our
+        # check and our insert
+        def racingSave(pending):
+            Comment.objects.create(id=ids[0], post=post, comment='Other',
+                                   author=comments[0]['author']['id'],
+                                   contentType='text/plain')
+            RemoteCommentAuthor.objects.create(
+                authorId=comments[0]['author']['id'],
+                host='http://remote.example.com/', displayName='other')
+            saveComments(pending)
+
+        data = {'query': 'addComments', 'post': post.id, 'comments': comments}
+        with mock.patch('rest.commentView.saveComments',
+                        side_effect=racingSave):
+            response = self.client.post(
+                '/posts/{}/comments/bulk/'.format(pid), json.dumps(data),
+                content_type='application/json', HTTP_HOST='localhost',
+                **self.auth
+            )
+        self.assertEqual(response.status_code, 200)
+
+        statuses = [status['status'] for status in
+                    self.getJSON(response)['comments']]
+        self.assertEqual(statuses, [409, 201])
+        self.assertEqual(Comment.objects.filter(post=post).count(), 2)
+        author = RemoteCommentAuthor.objects.get()
+        self.assertEqual(author.displayName, 'remote')
+
+    def getPost(self, post, viewer=None):
+        headers = dict(self.auth)
+        if viewer is not None:
+            headers['HTTP_X_REQUEST_USER_ID'] = viewer
+        pid = post.id.split('/')[-2]
+        return self.client.get('/posts/{}/'.format(pid), HTTP_HOST='localhost',
+                               **headers)
+
+    def remoteFollows(self, following):
+        """
+        Patch the remote friend lookups of visibility checks so remote authors
+        (ids in following) follow following[id].
+        """
+        RemoteCredentials.objects.create(host='http://remote.example.com/',
+                                         username='user', password='pass')
+        return mock.patch('rest.visibilityUtils.getRemoteFriends',
+                          side_effect=lambda authorId, creds, deadline:
+                                      following[authorId])
+
+    def test_post_visibility(self):
+        local = self.createUser()
+        friend = 'http://remote.example.com/author/friend/'
+        foaf = 'http://remote.example.com/author/foaf/'
+        stranger = 'http://remote.example.com/author/stranger/'
+        Follow.objects.create(author=self.user.author, friend=local.author.id)
+        Follow.objects.create(author=local.author, friend=self.user.author.id)
+        Follow.objects.create(author=self.user.author, friend=friend)
+        Follow.objects.create(author=local.author, friend=foaf)
+        following = {
+            friend: [self.user.author.id],
+            foaf: [local.author.id],
+            stranger: []
+        }
+
+        def createPost(visibility):
+            # The URL validator won't accept testserver as a host
+            return self.createPost(self.user.author, visibility=visibility,
+                                   id='http://localhost/posts/{}/'
+                                      .format(uuid.uuid4().hex))
+
+        with self.remoteFollows(following):
+            friends = createPost('FRIENDS')
+            self.assertEqual(self.getPost(friends).status_code, 403)
+            self.assertEqual(self.getPost(friends, stranger).status_code, 403)
+            self.assertEqual(self.getPost(friends, foaf).status_code, 403)
+            self.assertEqual(self.getPost(friends, friend).status_code, 200)
+
+            foafPost = createPost('FOAF')
+            self.assertEqual(self.getPost(foafPost, foaf).status_code, 200)
+            self.assertEqual(self.getPost(foafPost, stranger).status_code,
+                             403)
+
+            private = createPost('PRIVATE')
+            CanSee.objects.create(post=private, visibleTo=stranger)
+            self.assertEqual(self.getPost(private, stranger).status_code, 200)
+            self.assertEqual(self.getPost(private, friend).status_code, 403)
+
+            # Relations come from the friend graph, not per author queries
+            ids = [post.id for post in (friends, foafPost, private)]
+            headers = {'HTTP_X_REQUEST_USER_ID': foaf}
+            friendGraph()
+            with self.assertNumQueries(7):
+                response = self.batchPosts(ids, **headers)
+            data = self.getJSON(response)
+            self.assertEqual([post['id'] for post in data['posts']],
+                             [foafPost.id])
+
+    def test_local_hosts(self):
+        request = RequestFactory().get('/posts/')
+
+        # Local authors' hosts are remembered until an author changes
+        self.assertFalse(isLocalHost('elsewhere.example.com', request))
+        with self.assertNumQueries(0):
+            self.assertFalse(isLocalHost('elsewhere.example.com', request))
+        self.createUser(host='https://elsewhere.example.com/')
+        self.assertTrue(isLocalHost('elsewhere.example.com', request))
+
+        with override_settings(LOCAL_HOSTS=['http://alias.example.com:80/']):
+            self.assertTrue(isLocalHost('alias.example.com', request))
+        self.assertFalse(isLocalHost('alias.example.com', request))
+
+    def test_local_viewers_ignored(self):
+        local = self.createUser()
+        Follow.objects.create(author=self.user.author, friend=local.author.id)
+        Follow.objects.create(author=local.author, friend=self.user.author.id)
+        friends = self.createPost(self.user.author, visibility='FRIENDS',
+                                  id='http://localhost/posts/{}/'
+                                     .format(uuid.uuid4().hex))
+        private = self.createPost(self.user.author, visibility='PRIVATE',
+                                  id='http://localhost/posts/{}/'
+                                     .format(uuid.uuid4().hex))
+        CanSee.objects.create(post=private, visibleTo=local.author.id)
+
+        # Remote servers can't speak for our authors, by any spelling of
+        # their ids or the host asked
+        viewers = [local.author.id,
+                   local.author.id.replace('http:', 'https:'),
+                   local.author.id.replace('testserver', 'TESTSERVER:80'),
+                   'http://localhost/author/{}/'.format(uuid.uuid4().hex)]
+        for viewer in viewers:
+            self.assertEqual(self.getPost(friends, viewer).status_code, 403)
+            self.assertEqual(self.getPost(private, viewer).status_code, 403)
+
+    def test_viewers_on_credentials_host(self):
+        creds = LocalCredentials.objects.get(username='node')
+        creds.host = 'http://remote.example.com/'
+        creds.save()
+
+        friend = 'http://remote.example.com/author/friend/'
+        impostor = 'http://other.example.com/author/friend/'
+        Follow.objects.create(author=self.user.author, friend=friend)
+        Follow.objects.create(author=self.user.author, friend=impostor)
+        following = {friend: [self.user.author.id]}
+
+        friends = self.createPost(self.user.author, visibility='FRIENDS',
+                                  id='http://localhost/posts/{}/'
+                                     .format(uuid.uuid4().hex))
+        with self.remoteFollows(following) as request:
+            self.assertEqual(self.getPost(friends, friend).status_code, 200)
+
+            # Not asked for at all
+            request.reset_mock()
+            self.assertEqual(self.getPost(friends, impostor).status_code, 403)
+            self.assertFalse(request.called)
+
+    def test_comment_visibility(self):
+        pid = uuid.uuid4().hex
+        post = self.createPost(self.user.author, visibility='FRIENDS',
+                               id='http://localhost/posts/{}/'.format(pid))
+
+        # A remote author we don't know anything about
+        data = {
+            'query': 'addComment',
+            'post': post.id,
+            'comment': {
+                'author': {
+                    'id': 'http://remote.example.com/author/1/',
+                    'host': 'http://remote.example.com/',
+                    'displayName': 'stranger'
+                },
+                'comment': 'Test',
+                'contentType': 'text/plain',
+                'published': '2017-04-01T00:00:00Z',
+                'id': str(uuid.uuid4())
+            }
+        }
+        response = self.client.post('/posts/{}/comments/'.format(pid),
+                                    json.dumps(data),
+                                    content_type='application/json',
+                                    HTTP_HOST='localhost', **self.auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Comment.objects.filter(post=post).exists())
+
+    def test_author_posts_filtered(self):
+        friend = 'http://remote.example.com/author/friend/'
+        stranger = 'http://remote.example.com/author/stranger/'
+        Follow.objects.create(author=self.user.author, friend=friend)
+        following = {friend: [self.user.author.id], stranger: []}
+
+        public = self.createPost(self.user.author)
+        friends = self.createPost(self.user.author, visibility='FRIENDS')
+        self.createPost(self.user.author, visibility='FOAF', unlisted=True)
+        self.createPost(self.user.author, visibility='SERVERONLY')
+        private = self.createPost(self.user.author, visibility='PRIVATE')
+        CanSee.objects.create(post=private, visibleTo=stranger)
+
+        def visibleIds(viewer=None):
+            headers = dict(self.auth)
+            if viewer is not None:
+                headers['HTTP_X_REQUEST_USER_ID'] = viewer
+            response = self.client.get('/author/posts/', **headers)
+            self.assertEqual(response.status_code, 200)
+            data = self.getJSON(response)
+            self.assertEqual(data['count'], len(data['posts']))
+            return {post['id'] for post in data['posts']}
+
+        self.assertEqual(visibleIds(), {public.id})
+        with self.remoteFollows(following):
+            self.assertEqual(visibleIds(friend), {public.id, friends.id})
+            self.assertEqual(visibleIds(stranger), {public.id, private.id})
+
+        # Our own authors are answered for as nobody
+        self.assertEqual(visibleIds(self.user.author.id), {public.id})
+
+    def test_post_lists_filtered(self):
+        public = self.createPost(self.user.author)
+        for visibility in ('FRIENDS', 'FOAF', 'PRIVATE', 'SERVERONLY'):
+            self.createPost(self.user.author, visibility=visibility)
+
+        aid = self.user.author.id.split('/')[-2]
+        for url in ('/posts/', '/author/{}/posts/'.format(aid)):
+            response = self.client.get(url, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            data = self.getJSON(response)
+            self.assertEqual(data['count'], 1)
+            self.assertEqual([post['id'] for post in data['posts']],
+                             [public.id])
+
+class BloomFilterTests(TestCase):
+    def test_false_positive_rate(self):
+        ids = ['http://localhost/author/{}/'.format(i) for i in range(1000)]
+        bloom = BloomFilter.fromData(BloomFilter.build(ids, 0.01).toData())
+        for i in ids:
+            self.assertIn(i, bloom)
+
+        others = ['http://localhost/other/{}/'.format(i) for i in range(1000)]
+        falsePositives = sum(1 for i in others if i in bloom)
+        self.assertLess(falsePositives, 30)
+
+        # Empty sets still make a usable filter
+        self.assertNotIn(ids[0], BloomFilter.build([], 0.01))
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            BloomFilter.fromData({'size': 64, 'hashes': 3, 'bits': 'AAAA'})
+        with self.assertRaises(ValueError):
+            BloomFilter.fromData({'query': 'friends'})
+
+        # Digests too big to be worth reading
+        bloom = BloomFilter.build(['http://localhost/author/1/'], 0.01)
+        data = bloom.toData()
+        data['hashes'] = MAX_DIGEST_HASHES + 1
+        with self.assertRaises(ValueError):
+            BloomFilter.fromData(data)
+        with self.assertRaises(ValueError):
+            BloomFilter.fromData({'size': MAX_DIGEST_BITS + 8, 'hashes': 1,
+                                  'bits': ''})
+
+class ResultCacheTests(TestCase):
+    def test_failures_keep_successes(self):
+        cache = ResultCache(30, 2)
+        cache.set('good', True)
+        for i in range(10):
+            cache.set('bad{}'.format(i), False)
+        self.assertEqual(cache.get('good'), (True, True))
+        self.assertEqual(cache.get('bad9'), (True, False))
+
+        # Only the oldest are forgotten
+        self.assertEqual(cache.get('bad7'), (False, None))
+        cache.set('good2', True)
+        cache.set('good3', True)
+        self.assertEqual(cache.get('good'), (False, None))
+        self.assertEqual(cache.get('good3'), (True, True))
+
+class RemoteCredentialsTests(TestCase):
+    def test_get_remote_credentials(self):
+        creds = RemoteCredentials.objects.create(host='http://Remote.com:80/',
+                                                 username='user',
+                                                 password='pass')
+        self.assertEqual(creds.netloc, 'remote.com')
+
+        # Matches regardless of case, default port and path
+        self.assertEqual(getRemoteCredentials('http://remote.com/author/1/'),
+                         creds)
+        self.assertIsNone(getRemoteCredentials('http://remote.com:8000/'))
+
+        # Repeat lookups, even misses, don't query
+        with self.assertNumQueries(0):
+            getRemoteCredentials('http://REMOTE.com/posts/')
+            getRemoteCredentials('http://remote.com:8000/')
+
+        # Changes are seen straight away
+        other = RemoteCredentials.objects.create(host='http://remote.com:8000/',
+                                                 username='user',
+                                                 password='pass')
+        self.assertEqual(getRemoteCredentials('http://remote.com:8000/'),
+                         other)
+
+@override_settings(CIRCUIT_FAILURE_THRESHOLD=2)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.creds = RemoteCredentials.objects.create(
+            host='http://remote.example.com/',
+            username='user',
+            password='pass'
+        )
+        self.url = self.creds.host + 'posts/'
+
+    def test_opens_after_failures(self):
+        # Failing requests are still made until the threshold
+        with mock.patch('requests.request',
+                        side_effect=requests.ConnectionError) as request:
+            for i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    remoteGet(self.url, self.creds)
+            self.assertEqual(request.call_count, 2)
+
+            # Then they're skipped straight away
+            with self.assertRaises(CircuitOpen):
+                remoteGet(self.url, self.creds)
+            self.assertEqual(request.call_count, 2)
+
+        health = PeerHealth.objects.get(credentials=self.creds)
+        self.assertEqual(health.state(timezone.now()), 'open')
+        self.assertEqual(health.failures, 2)
+        self.assertLess(health.score(), 50)
+
+    def test_half_open_probe(self):
+        PeerHealth.objects.create(credentials=self.creds, failures=2,
+                                  errorRate=0.5, openedAt=timezone.now(),
+                                  openUntil=timezone.now())
+
+        # One probe is let through, success closes the breaker
+        response = mock.Mock(status_code=200)
+        with mock.patch('requests.request', return_value=response) as request:
+            self.assertIs(remoteGet(self.url, self.creds), response)
+            request.assert_called_once_with('GET', self.url,
+                                            auth=('user', 'pass'), timeout=5)
+
+        health = PeerHealth.objects.get(credentials=self.creds)
+        self.assertEqual(health.state(timezone.now()), 'closed')
+        self.assertEqual(health.failures, 0)
+        self.assertAlmostEqual(health.errorRate, 0.4)
+
+    def test_failed_probe_reopens(self):
+        PeerHealth.objects.create(credentials=self.creds, failures=2,
+                                  openedAt=timezone.now(),
+                                  openUntil=timezone.now())
+
+        # Server errors count as failures too
+        response = mock.Mock(status_code=503)
+        with mock.patch('requests.request', return_value=response):
+            remoteGet(self.url, self.creds)
+            with self.assertRaises(CircuitOpen):
+                remoteGet(self.url, self.creds)
+
+        health = PeerHealth.objects.get(credentials=self.creds)
+        self.assertEqual(health.failures, 3)
+
+class DeliveryTests(TestCase):
+    def setUp(self):
+        self.creds = RemoteCredentials.objects.create(
+            host='http://remote.example.com/',
+            username='user',
+            password='pass'
+        )
+        self.url = self.creds.host + 'friendrequest/'
+        self.delivery = enqueueDelivery(self.url, {'query': 'friendrequest'},
+                                        self.creds)
+
+    def deliver(self, status):
+        response = mock.Mock(status_code=status, text='')
+        with mock.patch('requests.Session.request',
+                        return_value=response) as request:
+            deliverPending()
+        return request
+
+    def test_delivered(self):
+        request = self.deliver(200)
+        args, kwargs = request.call_args
+        self.assertEqual(args, ('POST', self.url))
+        self.assertEqual(json.loads(kwargs['data'].decode('utf-8')),
+                         {'query': 'friendrequest'})
+
+        # Delivered ones are removed from the queue
+        self.assertFalse(OutboundDelivery.objects.exists())
+
+    @override_settings(DELIVERY_MAX_ATTEMPTS=2)
+    def test_retry_then_dead_letter(self):
+        self.deliver(503)
+        delivery = OutboundDelivery.objects.get()
+        self.assertEqual(delivery.status, OutboundDelivery.PENDING)
+        self.assertEqual(delivery.attempts, 1)
+        self.assertGreater(delivery.nextAttempt, timezone.now())
+
+        # Not due yet
+        request = self.deliver(503)
+        self.assertFalse(request.called)
+
+        OutboundDelivery.objects.update(nextAttempt=timezone.now())
+        self.deliver(503)
+        delivery = OutboundDelivery.objects.get()
+        self.assertEqual(delivery.status, OutboundDelivery.DEAD)
+        self.assertEqual(delivery.attempts, 2)
+
+    def test_rejected_dead_letter(self):
+        self.deliver(400)
+        delivery = OutboundDelivery.objects.get()
+        self.assertEqual(delivery.status, OutboundDelivery.DEAD)
+        self.assertIn('400', delivery.lastError)
+
+    def test_circuit_open(self):
+        PeerHealth.objects.create(credentials=self.creds, failures=5,
+                                  openedAt=timezone.now(),
+                                  openUntil=timezone.now() +
+                                            datetime.timedelta(minutes=1))
+
+        # Waits without using up an attempt
+        request = self.deliver(200)
+        self.assertFalse(request.called)
+        delivery = OutboundDelivery.objects.get()
+        self.assertEqual(delivery.attempts, 0)
+        self.assertGreater(delivery.nextAttempt, timezone.now())
+
+class JobTests(TestCase):
+    def setUp(self):
+        del jobCalls[:]
+
+    def test_run_in_priority_order(self):
+        enqueueJob(recordJob, {'value': 'low'})
+        enqueueJob(recordJob, {'value': 'high'}, priority=1)
+        enqueueJob(recordJob, {'value': 'later'}, delay=60)
+
+        while runNextJob():
+            pass
+        self.assertEqual(jobCalls, ['high', 'low'])
+
+        # Finished jobs are removed, ones that aren't due are left
+        self.assertEqual(Job.objects.get().args, '{"value":"later"}')
+
+    def test_runworker(self):
+        enqueueJob(recordJob, {'value': 'command'})
+        call_command('runworker', '--once')
+        self.assertEqual(jobCalls, ['command'])
+
+    def test_claim_leases(self):
+        enqueueJob(recordJob, {'value': 1})
+        job = claimJob()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.runAt, timezone.now())
+
+        # Nobody else gets it until the lease runs out
+        self.assertIsNone(claimJob())
+        Job.objects.update(runAt=timezone.now())
+        self.assertEqual(claimJob().pk, job.pk)
+
+    def test_retry_then_dead(self):
+        enqueueJob(failingJob, maxAttempts=2)
+        runNextJob()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertIn('job failed', job.lastError)
+        self.assertGreater(job.runAt, timezone.now())
+
+        Job.objects.update(runAt=timezone.now())
+        runNextJob()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.DEAD)
+        self.assertFalse(runNextJob())
+
+class RemotePaginationTests(TestCase):
+    def setUp(self):
+        self.creds = RemoteCredentials.objects.create(
+            host='http://remote.example.com/',
+            username='user',
+            password='pass'
+        )
+
+        # Three pages of two posts, each linking to the next
+        self.pages = {}
+        for i in range(3):
+            url = '{}posts/?page={}'.format(self.creds.host, i)
+            nextUrl = '{}posts/?page={}'.format(self.creds.host, i + 1)
+            self.pages[url] = {
+                'posts': [{'id': i * 2}, {'id': i * 2 + 1}],
+                'next': nextUrl if i < 2 else None
+            }
+
+    def respond(self, method, url, **kwargs):
+        body = json.dumps(self.pages[url]).encode('utf-8')
+        chunks = [body[i:i + 10] for i in range(0, len(body), 10)]
+        return mock.Mock(status_code=200, iter_content=lambda size: chunks)
+
+    def test_follows_next_lazily(self):
+        url = self.creds.host + 'posts/?page=0'
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            posts = iterRemotePosts(url, self.creds, Deadline(5))
+            self.assertEqual([next(posts)['id'] for i in range(3)],
+                             [0, 1, 2])
+
+            # Only as many pages as were needed
+            self.assertEqual(request.call_count, 2)
+
+            self.assertEqual([post['id'] for post in posts], [3, 4, 5])
+            self.assertEqual(request.call_count, 3)
+
+    def test_headers_every_page(self):
+        url = self.creds.host + 'posts/?page=0'
+        headers = {'X-Request-User-ID': 'http://localhost/author/1/'}
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            posts = list(iterRemotePosts(url, self.creds, Deadline(5),
+                                         headers=headers,
+                                         params={'size': 2}))
+        self.assertEqual(len(posts), 6)
+        for call in request.call_args_list:
+            self.assertEqual(call[1]['headers'], headers)
+        self.assertNotIn('params', request.call_args_list[1][1])
+
+    def test_page_limits(self):
+        url = self.creds.host + 'posts/?page=0'
+        with mock.patch('requests.request', side_effect=self.respond):
+            posts = iterRemotePosts(url, self.creds, Deadline(5), maxPages=2)
+            self.assertEqual(len(list(posts)), 4)
+
+            # The first page is always read, then time's up
+            posts = iterRemotePosts(url, self.creds, Deadline(0))
+            self.assertEqual(len(list(posts)), 2)
+
+    def test_next_links_stay_on_host(self):
+        url = self.creds.host + 'posts/?page=0'
+        self.pages[url]['next'] = 'http://evil.example.com/posts/?page=1'
+        with mock.patch('requests.request', side_effect=self.respond) \
+                as request:
+            posts = iterRemotePosts(url, self.creds, Deadline(5))
+            self.assertEqual([post['id'] for post in posts], [0, 1])
+            self.assertEqual(request.call_count, 1)
+
+        # Relative links are resolved against the page
+        self.pages[url]['next'] = '?page=1'
+        with mock.patch('requests.request', side_effect=self.respond):
+            posts = iterRemotePosts(url, self.creds, Deadline(5))
+            self.assertEqual(len(list(posts)), 6)
+
+    def test_first_page_errors(self):
+        url = self.creds.host + 'posts/?page=0'
+        response = mock.Mock(status_code=404)
+        with mock.patch('requests.request', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                list(iterRemotePosts(url, self.creds, Deadline(5)))
+
+        response = mock.Mock(status_code=200,
+                             iter_content=lambda size: [b'{"authors": []}'])
+        with mock.patch('requests.request', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                list(iterRemotePosts(url, self.creds, Deadline(5)))
+
+    @override_settings(REMOTE_MAX_BYTES=200, REMOTE_MAX_POST_BYTES=40)
+    def test_size_caps(self):
+        url = self.creds.host + 'posts/?page=0'
+        self.pages[url]['posts'] = [
+            {'id': 0, 'content': 'x' * 50},
+            {'id': 1}
+        ]
+        self.pages[url]['posts'] += [{'id': i} for i in range(2, 40)]
+
+        # Big posts are skipped, reading stops after the byte cap
+        with mock.patch('requests.request', side_effect=self.respond):
+            posts = list(iterRemotePosts(url, self.creds, Deadline(5),
+                                         maxPages=1))
+        ids = [post['id'] for post in posts]
+        self.assertEqual(ids, list(range(1, len(ids) + 1)))
+        self.assertLess(len(ids), 39)
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'remote': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'remote',
+    },
+})
+class RemoteFetchTests(TestCase):
+    def setUp(self):
+        caches['remote'].clear()
+
+    @override_settings(REMOTE_SHARED_TTL=0)
+    def test_stale_fallback(self):
+        fetch = RemoteFetch('test', lambda: ['fresh'])
+        self.assertEqual(fetch.result(Deadline(5)), (['fresh'], False))
+
+        # A fetch that misses the deadline gets the last good data
+        release = threading.Event()
+        slow = RemoteFetch('test', lambda: release.wait() and ['new'])
+        self.assertEqual(slow.result(Deadline(0)), (['fresh'], True))
+
+        # It keeps going in the background and refreshes the cache
+        release.set()
+        slow.future.result()
+        failed = RemoteFetch('test', lambda: None)
+        self.assertEqual(failed.result(Deadline(5)), (['new'], True))
+
+        # Nothing to fall back on
+        self.assertEqual(RemoteFetch('other', lambda: None)
+                         .result(Deadline(5)), (None, True))
+
+    def test_identical_fetches_collapse(self):
+        calls = []
+        release = threading.Event()
+        def fetch():
+            calls.append(None)
+            release.wait()
+            return ['data']
+
+        # Concurrent callers share the fetch in flight
+        first = RemoteFetch('test', fetch)
+        second = RemoteFetch('test', fetch)
+        release.set()
+        data, stale = first.result(Deadline(5))
+        self.assertEqual(data, ['data'])
+
+        # Each caller gets its own copy
+        data.append('changed')
+        self.assertEqual(second.result(Deadline(5)), (['data'], False))
+
+        # Recently cached data is used without fetching
+        third = RemoteFetch('test', fetch)
+        self.assertEqual(third.result(Deadline(5)), (['data'], False))
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(REMOTE_SHARED_TTL=0)
+    def test_spent_budget_skips_fetch(self):
+        calls = []
+        def fetch():
+            calls.append(None)
+            return ['data']
+        RemoteFetch('test', fetch).result(Deadline(5))
+
+        # Cached data is used without starting another fetch
+        self.assertEqual(RemoteFetch('test', fetch, Deadline(0))
+                         .result(Deadline(0)), (['data'], True))
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(REMOTE_FETCH_MAX_PENDING=1)
+    def test_pending_fetches_capped(self):
+        release = threading.Event()
+        first = RemoteFetch('first', lambda: release.wait() and ['first'])
+        second = RemoteFetch('second', lambda: ['second'])
+        self.assertIsNone(second.future)
+        self.assertEqual(second.result(Deadline(0)), (None, True))
+
+        release.set()
+        self.assertEqual(first.result(Deadline(5)), (['first'], False))
+
+class JSONListReaderTests(TestCase):
+    def test_incremental_parse(self):
+        posts = [
+            {'id': 0, 'title': 'a "quoted" \\ title', 'tags': ['[', '{']},
+            {'id': 1, 'content': 'x' * 200},
+            {'id': 2, 'content': 'caf\u00e9 \u4e2d'},
+        ]
+        data = {'query': 'posts', 'count': 3, 'posts': posts, 'next': None}
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+        # Items come out as soon as they're complete, big ones are skipped
+        reader = JSONListReader('posts', 100)
+        items = []
+        for i in range(len(body)):
+            items += reader.feed(body[i:i + 1])
+        self.assertEqual(items, [posts[0], posts[2]])
+        self.assertEqual(reader.skipped, 1)
+        self.assertEqual(reader.envelope,
+                         {'query': 'posts', 'count': 3, 'next': None})
+
+    def test_bad_json(self):
+        with self.assertRaises(ValueError):
+            JSONListReader('posts', 100).feed(b'[1, 2]')
+        with self.assertRaises(ValueError):
+            JSONListReader('posts', 100).feed(b'{"posts": [{"id": }]}')
+
+class RemotePostTests(TestCase):
+    def test_normalize(self):
+        postId = uuid.uuid4().hex
+        post = RemotePost({
+            'id': postId,
+            'origin': 'http://remote.example.com/posts/' + postId,
+            'author': {'id': 'http://remote.example.com/author/1'},
+            'published': '2017-03-01T12:00:00',
+            'contentType': 'image/png;base64',
+            'content': 'aGk='
+        })
+
+        # Uuid ids become the post's url
+        self.assertEqual(post.id,
+                         'http://remote.example.com/posts/{}/'.format(postId))
+        self.assertIs(post.visibility, Visibility.PUBLIC)
+        self.assertFalse(post.unlisted)
+        self.assertEqual(post.published,
+                         datetime.datetime(2017, 3, 1, 12,
+                                           tzinfo=timezone.utc))
+        self.assertEqual(post.content, 'data:image/png;base64,aGk=')
+
+        # Survives caching
+        for copied in (pickle.loads(pickle.dumps(post)), copy.deepcopy(post)):
+            self.assertEqual(copied.id, post.id)
+            self.assertEqual(copied.published, post.published)
+
+    def test_bad_posts(self):
+        base = {
+            'id': 'http://remote.example.com/posts/1/',
+            'author': {},
+            'published': '2017-03-01T12:00:00Z'
+        }
+        for bad in ({'visibility': 'SECRET'}, {'published': 'never'},
+                    {'id': uuid.uuid4().hex}, {'id': None}):
+            data = dict(base, **bad)
+            with self.assertRaises((KeyError, TypeError, ValueError)):
+                RemotePost(data)
+
+class LogUtilsTests(TestCase):
+    def makeRecord(self, name, level=logging.INFO, **extra):
+        logger = logging.getLogger(name)
+        return logger.makeRecord(name, level, __file__, 0, 'test %s', ('msg',),
+                                 None, extra=extra)
+
+    def test_truncate(self):
+        self.assertEqual(truncate('short', 10), 'short')
+        self.assertEqual(truncate(b'x' * 20, 10), 'x' * 10 + '...[20 chars]')
+
+    def test_structured_fields(self):
+        record = self.makeRecord('stream.test', node='remote', latency=1.5)
+        data = json.loads(StructuredFormatter().format(record))
+        self.assertEqual(data['message'], 'test msg')
+        self.assertEqual(data['category'], 'stream.test')
+        self.assertEqual(data['node'], 'remote')
+        self.assertEqual(data['latency'], 1.5)
+
+    def test_background_exception(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream)
+        logger = logging.getLogger('stream.test.background')
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            try:
+                raise ValueError('broken')
+            except ValueError:
+                logger.exception('failed %s', 'job', extra={'node': 'remote'})
+
+            # Wait for the listener thread to write it out
+            handler.queue.join()
+        finally:
+            logger.removeHandler(handler)
+            logger.propagate = True
+
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data['message'], 'failed job')
+        self.assertEqual(data['node'], 'remote')
+        self.assertIn('ValueError: broken', data['exception'])
+        self.assertNotIn('Traceback', data['message'])
+
+    @override_settings(LOG_SAMPLE_RATES={'stream.test': 0.0})
+    def test_sampling(self):
+        sampler = SampleFilter()
+        self.assertFalse(sampler.filter(self.makeRecord('stream.test.sub')))
+        self.assertTrue(sampler.filter(self.makeRecord('stream.other')))
+
+        # Warnings are never sampled out
+        warning = self.makeRecord('stream.test', logging.WARNING)
+        self.assertTrue(sampler.filter(warning))
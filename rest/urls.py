@@ -4,17 +4,26 @@ from . import views
 
 urlpatterns = [
     url(r'^posts/$', views.PostsView.as_view(), name='posts'),
+    url(r'^posts/batch/$', views.PostBatchView.as_view(), name='postbatch'),
     url(r'^posts/(?P<pid>[0-9a-fA-F\-]+)/$', views.PostView.as_view(),
         name='post'),
     url(r'^posts/(?P<pid>[0-9a-fA-F\-]+)/comments/$',
         views.CommentView.as_view(), name='comments'),
-    url(r'^author/posts/$', views.PostsView.as_view(), name='allposts'),
+    url(r'^posts/(?P<pid>[0-9a-fA-F\-]+)/comments/bulk/$',
+        views.CommentBulkView.as_view(), name='commentsbulk'),
+    url(r'^author/posts/$', views.VisiblePostsView.as_view(),
+        name='allposts'),
     url(r'^author/(?P<aid>[0-9a-fA-F\-]+)/$', views.AuthorView.as_view(),
         name='author'),
+    url(r'^authors/$', views.AuthorsView.as_view(), name='authors'),
     url(r'^author/(?P<aid>[0-9a-fA-F\-]+)/friends/$',
         views.AuthorFriendsView.as_view(), name='friends'),
+    url(r'^author/(?P<aid>[0-9a-fA-F\-]+)/friends/digest/$',
+        views.AuthorFriendsDigestView.as_view(), name='friendsdigest'),
     url(r'^author/(?P<aid>[0-9a-fA-F\-]+)/posts/$',
         views.AuthorPostView.as_view(), name='authorposts'),
+    url(r'^export/posts\.ndjson$', views.PostExportView.as_view(),
+        name='exportposts'),
     url(r'^friendrequest/$', views.FriendRequestView.as_view(),
         name='friendrequest'),
     url(r'^author/(?P<aid>[0-9a-fA-F\-]+)/friends/'
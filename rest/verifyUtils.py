@@ -230,6 +230,25 @@ def validateURLList(data, name, value):
             raise InvalidField(name, value)
     return value
 
+# Most ids that can be asked for in one batch request
+BATCH_MAX_SIZE = 500
+
+def validateBatchList(data, name, value):
+    """
+    Validate that a value is a list no longer than BATCH_MAX_SIZE.
+    """
+    validateList(data, name, value)
+    if len(value) > BATCH_MAX_SIZE:
+        raise InvalidField(name + '.length', len(value))
+    return value
+
+def validateBatchURLList(data, name, value):
+    """
+    Validate that a value is a list of URLs no longer than BATCH_MAX_SIZE.
+    """
+    validateBatchList(data, name, value)
+    return validateURLList(data, name, value)
+
 def validateVisibleTo(data, name, visibleTo):
     """
     Validate a field is a list of valid visibleTo URLs.
@@ -301,12 +320,28 @@ addCommentValidators = (
     ('comment', commentValidators)
 )
 
+addCommentsValidators = (
+    ('query', functools.partial(validateQuery, 'addComments')),
+    ('post', validateURLReq),
+    ('comments', validateBatchList)
+)
+
 multiFriendQueryValidators = (
     ('query', functools.partial(validateQuery, 'friends')),
     ('author', validateURLReq),
     ('authors', validateURLList)
 )
 
+multiAuthorQueryValidators = (
+    ('query', functools.partial(validateQuery, 'authors')),
+    ('authors', validateBatchURLList)
+)
+
+multiPostQueryValidators = (
+    ('query', functools.partial(validateQuery, 'posts')),
+    ('posts', validateBatchURLList)
+)
+
 friendRequestValidators = (
     ('query', functools.partial(validateQuery, 'friendrequest')),
     ('author', authorValidators),
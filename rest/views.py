@@ -2,10 +2,12 @@
 
 # Import views into our namespace so that importing views from this file works
 # as normal
-from .multiPostView import PostsView
+from .multiPostView import PostsView, PostBatchView, VisiblePostsView
 from .singlePostView import PostView
-from .commentView import CommentView
-from .authorView import AuthorView
-from .authorFriendsView import AuthorFriendsView, AuthorIsFriendsView
+from .commentView import CommentView, CommentBulkView
+from .authorView import AuthorView, AuthorsView
+from .authorFriendsView import AuthorFriendsView, AuthorFriendsDigestView, \
+                               AuthorIsFriendsView
 from .friendRequestView import FriendRequestView
 from .authorPostView import AuthorPostView
+from .exportView import PostExportView
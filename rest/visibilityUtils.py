@@ -0,0 +1,255 @@
+# Author: Braedy Kuzma
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from dash.friendUtils import getRemoteFriends
+from dash.graphUtils import friendGraph
+from dash.idUtils import canonicalId
+from dash.models import Author, CanSee
+from .authUtils import getRemoteCredentials, ResultCache
+from .models import normalizeNetloc
+from .remoteUtils import Deadline
+
+# Header remote servers send the id of the author they're asking for with
+VIEWER_HEADER = 'HTTP_X_REQUEST_USER_ID'
+
+# How a viewer is related to a post's author, each includes the ones before
+NONE, FOAF, FRIEND, SELF = range(4)
+
+# The relation needed to see posts of each visibility, PRIVATE is handled
+# separately and SERVERONLY is never visible through the API
+REQUIRED_RELATION = {
+    'PUBLIC': NONE,
+    'FOAF': FOAF,
+    'FRIENDS': FRIEND,
+    'PRIVATE': SELF
+}
+
+# How long (seconds) the netlocs of local authors' hosts are remembered. Other
+# processes only see authors on new hosts after this long.
+LOCAL_NETLOCS_CACHE_TTL = 30
+
+# None -> set of normalized netlocs of local authors' hosts
+_localNetlocsCache = ResultCache(LOCAL_NETLOCS_CACHE_TTL, 1)
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def clearLocalNetlocsCache(sender, **kwargs):
+    """
+    Forget the local authors' hosts when any Author changes.
+    """
+    _localNetlocsCache.clear()
+
+def localNetlocs():
+    """
+    The normalized netlocs (see normalizeNetloc) this server is known by, from
+    settings.LOCAL_HOSTS and the hosts of local authors. The authors' hosts
+    are remembered in process, so this usually doesn't query.
+    """
+    found, netlocs = _localNetlocsCache.get(None)
+    if not found:
+        hosts = Author.objects.order_by().values_list('host', flat=True) \
+                                         .distinct()
+        netlocs = frozenset(normalizeNetloc(host) for host in hosts)
+        _localNetlocsCache.set(None, netlocs)
+
+    configured = getattr(settings, 'LOCAL_HOSTS', [])
+    return netlocs.union(normalizeNetloc(host) for host in configured)
+
+def isLocalHost(netloc, request):
+    """
+    Whether netloc (see normalizeNetloc) is this server's, the one the
+    request was made to or one in localNetlocs.
+    """
+    ownUrl = '{}://{}'.format(request.scheme, request.get_host())
+    if netloc == normalizeNetloc(ownUrl):
+        return True
+
+    return netloc in localNetlocs()
+
+def getViewer(request):
+    """
+    The id of the (remote) author a request is being made for, None if it
+    didn't say or we don't believe it.
+
+    The header is only as trustworthy as the server sending it. A server can
+    speak for its own authors, so the viewer has to be on the server the
+    request's credentials were given to (LocalCredentials.host) when that's
+    set. It never speaks for ours, they don't use the API, so a viewer on
+    this server is anonymous.
+    """
+    viewerId = request.META.get(VIEWER_HEADER, '').strip()
+    netloc = normalizeNetloc(viewerId)
+    if not netloc:
+        return None
+
+    creds = getattr(request, 'auth', None)
+    if creds is not None and creds.netloc and netloc != creds.netloc:
+        return None
+
+    if isLocalHost(netloc, request):
+        return None
+
+    return viewerId
+
+class VisibilityChecker(object):
+    """
+    Decides which posts viewerId (a remote author's id from getViewer, None
+    for an anonymous viewer) can see. How the viewer is related to post
+    authors is worked out with the shared FriendGraph, so checking any number
+    of posts takes a small, fixed number of queries and finding friends of
+    friends none at all.
+
+    What the viewer follows comes from their server, the last good answer is
+    used if it's slower than deadline.
+    """
+    def __init__(self, viewerId, deadline=None):
+        self.viewerId = viewerId
+        self.viewerKey = canonicalId(viewerId)
+        if deadline is None:
+            deadline = Deadline(getattr(settings, 'REMOTE_BUDGET', 0.3))
+        self.deadline = deadline
+        self.relations = {}
+        self.following = None
+        self.friendNumbers = None
+        self.foafNumbers = None
+        self.graph = friendGraph()
+
+    def viewerFollowing(self):
+        """
+        The canonical ids of the authors the viewer follows.
+        """
+        if self.following is not None:
+            return self.following
+
+        creds = getRemoteCredentials(self.viewerId)
+        following = []
+        if creds is not None:
+            following = getRemoteFriends(self.viewerId, creds, self.deadline)
+
+        self.following = {canonicalId(authorId) for authorId in following}
+        return self.following
+
+    def viewerFriendNumbers(self):
+        """
+        The numbers (see FriendGraph) of the local authors who are friends
+        with the viewer.
+        """
+        if self.friendNumbers is None:
+            self.friendNumbers = self.graph.followersOf(self.viewerId) & \
+                                 self.graph.numbersOf(self.viewerFollowing())
+        return self.friendNumbers
+
+    def viewerFoafNumbers(self):
+        """
+        The numbers of the authors who are friends with one of the viewer's
+        (local) friends.
+        """
+        if self.foafNumbers is None:
+            self.foafNumbers = self.graph.friendsOfFriends(
+                self.viewerFriendNumbers()
+            )
+        return self.foafNumbers
+
+    def viewerFriends(self):
+        """
+        Ids of the local authors who are friends with the viewer.
+        """
+        return self.graph.members(self.viewerFriendNumbers())
+
+    def viewerFoaf(self):
+        """
+        Ids of the authors who are friends with one of the viewer's (local)
+        friends.
+        """
+        return self.graph.members(self.viewerFoafNumbers())
+
+    def visibleQuery(self):
+        """
+        A Q for the listed posts the viewer can see, so lists can be filtered
+        (and paginated) in the database.
+        """
+        query = Q(visibility='PUBLIC')
+        if self.viewerId is not None:
+            friends = self.viewerFriends()
+            foaf = self.viewerFoaf() | friends
+            canSee = CanSee.objects.filter(visibleToKey=self.viewerKey) \
+                                   .values('post')
+            query |= Q(visibility='FRIENDS', author__in=friends)
+            query |= Q(visibility='FOAF', author__in=foaf)
+            query |= Q(visibility='PRIVATE', id__in=canSee)
+            query |= Q(author=self.viewerId) & ~Q(visibility='SERVERONLY')
+
+        return query & Q(unlisted=False)
+
+    def findRelation(self, authorId):
+        """
+        Work out how the viewer is related to a local author.
+        """
+        # Friends follow each other
+        if self.graph.follows(authorId, self.viewerId) and \
+           canonicalId(authorId) in self.viewerFollowing():
+            return FRIEND
+
+        # Friends of a friend are friends with one of the author's (local)
+        # friends
+        if self.graph.lookup(authorId) in self.viewerFoafNumbers():
+            return FOAF
+
+        return NONE
+
+    def relation(self, authorId):
+        """
+        How the viewer is related to a local author.
+        """
+        if self.viewerId is None:
+            return NONE
+        if authorId == self.viewerId:
+            return SELF
+        if authorId not in self.relations:
+            self.relations[authorId] = self.findRelation(authorId)
+        return self.relations[authorId]
+
+    def visibleTo(self, posts):
+        """
+        Ids of the PRIVATE posts in posts the viewer was explicitly given.
+        """
+        private = [post.id for post in posts if post.visibility == 'PRIVATE']
+        if self.viewerId is None or not private:
+            return set()
+
+        return set(CanSee.objects.filter(post__in=private,
+                                         visibleToKey=self.viewerKey)
+                                 .values_list('post', flat=True))
+
+    def allowed(self, post, visibleTo):
+        """
+        Whether the viewer can see post, visibleTo being the ids of PRIVATE
+        posts they were given.
+        """
+        # Unlisted posts are seen by anyone with the link
+        if post.visibility == 'SERVERONLY':
+            return False
+        if post.unlisted or post.visibility == 'PUBLIC':
+            return True
+        if post.id in visibleTo:
+            return True
+
+        required = REQUIRED_RELATION.get(post.visibility, SELF)
+        return self.relation(post.author_id) >= required
+
+    def canSee(self, post):
+        """
+        Whether the viewer can see a post.
+        """
+        return self.allowed(post, self.visibleTo([post]))
+
+    def filter(self, posts):
+        """
+        The posts the viewer can see, in the same order.
+        """
+        posts = list(posts)
+        visibleTo = self.visibleTo(posts)
+        return [post for post in posts if self.allowed(post, visibleTo)]
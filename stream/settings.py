@@ -29,6 +29,10 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['.herokuapp.com', 'localhost', '127.0.0.1', '[::1]']
 
+# Other urls this server is reached by. Remote servers can't speak for authors
+# on these (or on any local author's host), see rest.visibilityUtils.
+LOCAL_HOSTS = []
+
 LOGIN_REDIRECT_URL = '/login/'
 LOGIN_URL = '/login/'
 
@@ -48,7 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rest.middleware.AccessLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'rest.middleware.JSONGZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -160,3 +166,129 @@ REST_FRAMEWORK = {
         'rest.authUtils.nodeToNodeBasicAuth',
     )
 }
+
+# Don't gzip JSON responses smaller than this many bytes
+JSON_GZIP_MIN_LENGTH = 1024
+
+# Seconds to wait on a remote server before giving up
+REMOTE_TIMEOUT = 5
+
+# Consecutive failed requests before a remote server's circuit breaker opens,
+# and how many seconds it then stays open before a probe request is let through
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 60
+
+# Seconds the dashboard waits on remote servers in total before falling back to
+# their last good (stale) responses, which are kept this many seconds
+REMOTE_BUDGET = 0.3
+REMOTE_STALE_TIMEOUT = 24 * 60 * 60
+
+# Most pages of a remote post list to read while filling a dashboard page
+REMOTE_MAX_PAGES = 5
+
+# Most bytes of a remote post list page to read, and biggest single remote post
+# to keep, remote responses are streamed so this bounds memory per fetch
+REMOTE_MAX_BYTES = 8 * 1024 * 1024
+REMOTE_MAX_POST_BYTES = 2 * 1024 * 1024
+
+# Posts per dashboard page
+DASH_PAGE_SIZE = 25
+
+# Most timeline entries written while saving a post (or adding an author),
+# bigger fan outs are left to a job
+TIMELINE_FANOUT_INLINE_MAX = 100
+
+# Threads making remote requests in the background, and most remote fetches
+# running or waiting for one at once (more just use cached data)
+REMOTE_FETCH_WORKERS = 16
+REMOTE_FETCH_MAX_PENDING = 64
+
+# Identical remote requests made within this many seconds of each other (by any
+# worker) share one response
+REMOTE_SHARED_TTL = 5
+
+# Remote responses are cached in the database so every worker shares them, the
+# table is made by createcachetable (see Procfile)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'remote': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'remote_cache',
+        # Bump when the format of cached remote data changes
+        'VERSION': 2,
+    },
+    'stream': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'stream_cache',
+    },
+}
+
+# Seconds a dashboard's cached post list is used for. Local changes
+# invalidate it straight away, this bounds how long remote posts wait.
+STREAM_CACHE_TTL = 30
+
+# Seconds before each process rebuilds its friend graph (see
+# dash.graphUtils), which the API uses to decide who can see FRIENDS and FOAF
+# posts. Follow changes made by the same process show up straight away.
+FRIEND_GRAPH_TTL = 60
+
+# False positive rate of the friend digests we serve (see
+# rest.digestUtils.BloomFilter), seconds a built digest is kept for serving
+# again and seconds before asking a server that doesn't serve them again
+FRIEND_DIGEST_ERROR_RATE = 0.01
+FRIEND_DIGEST_CACHE_TTL = 60 * 60
+FRIEND_DIGEST_RETRY = 60 * 60
+
+# Outbound deliveries (see the deliver command): how many to send per pass,
+# how long a worker holds one while sending it and how failures are retried
+# (doubling from DELIVERY_RETRY_BASE seconds up to DELIVERY_RETRY_MAX) before
+# being dead lettered
+DELIVERY_BATCH_SIZE = 50
+DELIVERY_LEASE = 5 * 60
+DELIVERY_RETRY_BASE = 30
+DELIVERY_RETRY_MAX = 6 * 60 * 60
+DELIVERY_MAX_ATTEMPTS = 10
+
+# Background jobs (see the runworker command): seconds a worker holds a job
+# before it's assumed lost, and how failures are retried (doubling from
+# JOB_RETRY_BASE seconds) before the job is marked dead
+JOB_TIMEOUT = 5 * 60
+JOB_RETRY_BASE = 30
+JOB_MAX_ATTEMPTS = 5
+
+# Logging, everything of ours goes under the stream logger and is written as
+# JSON lines by a background thread so workers never block on log I/O
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'rest.logUtils.SampleFilter',
+        },
+    },
+    'handlers': {
+        'background': {
+            'class': 'rest.logUtils.BackgroundHandler',
+            'filters': ['sample'],
+        },
+    },
+    'loggers': {
+        'stream': {
+            'handlers': ['background'],
+            'level': os.environ.get('STREAM_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Fraction of records to keep per logging category (logger name prefix), ones
+# not listed are all kept. Warnings and worse are always kept.
+LOG_SAMPLE_RATES = {
+    'stream.access': 1.0,
+    'stream.remote': 1.0,
+}
+
+# Longest body (in characters) to include in a log record
+LOG_BODY_LIMIT = 512